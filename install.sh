@@ -89,7 +89,12 @@ apt-get install -y --no-install-recommends \
     gunicorn \
     python3-ruamel.yaml \
     python3-psutil \
+    python3-numpy \
+    python3-alsaaudio \
     alsa-utils \
+    flac \
+    opus-tools \
+    lame \
     network-manager \
     git
 # gpiozero on Trixie must use the lgpio backend (RPi.GPIO no longer works on
@@ -289,7 +294,7 @@ mkdir -p /etc/systemd/system/audioGuestBookWebServer.service.d
 cat > /etc/systemd/system/audioGuestBookWebServer.service.d/20-exec.conf <<EOF
 [Service]
 ExecStart=
-ExecStart=/usr/bin/gunicorn -w 1 -k gevent -b 0.0.0.0:8080 webserver.server:app
+ExecStart=/usr/bin/gunicorn -w 1 -k gevent -b 0.0.0.0:8080 "webserver.server:create_app()"
 EOF
 
 if systemd_running; then
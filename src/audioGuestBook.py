@@ -1,14 +1,24 @@
 #!/usr/bin/env python3
 import logging
-import RPi.GPIO as GPIO
+import queue
+import signal
 import subprocess
+import threading
 import time
 import yaml
-from datetime import datetime
 from pathlib import Path
 import os
 import sys
 
+from call_trace import TraceWriter
+from config_reload import ConfigWatcher, changed_groups, read_config
+from events import create_publisher
+from gpio_backend import LOW, Debouncer, create_backend
+from phone_line import PhoneLine, Services, line_configs, next_timeout
+from postprocess import PostProcessor
+from staging import Stager
+from wav_repair import repair_folder
+
 # Setup logging
 logging.basicConfig(
     level=logging.INFO,
@@ -25,380 +35,276 @@ def load_config(config_path):
         logger.error(f"Configuration file not found: {e}")
         sys.exit(1)
 
-# Global state
-recording_proc = None
-recording_start_ts = None
-record_greeting_proc = None
+# The shutdown button has no configurable bounce time; this only has to ride
+# out contact bounce, the hold time does the real filtering.
+SHUTDOWN_BOUNCE_TIME = 0.05
+
+# Put on the control queue to wake the main loop for a config reload
+RELOAD = object()
+
+# Daemon-wide groups (see config_reload.RELOAD_GROUPS), rebuilt only while
+# every line is idle; the lines rebuild the others themselves
+SHARED_GROUPS = ('backend', 'shutdown', 'staging', 'postprocess', 'events', 'trace')
+
+# How often the main loop checks that every line is still running
+LINE_CHECK_SECONDS = 1.0
 
 def set_volume(volume_pct, mixer_control):
-    """Set system volume using amixer."""
+    """Set system volume using amixer.
+
+    Prompt volumes are applied as a gain by the audio engine, so this is only
+    used once at startup to put the hardware mixer at a known level.
+    """
     vol = max(0, min(int(volume_pct * 100), 100))
     subprocess.run(["amixer", "set", mixer_control, f"{vol}%"], check=False, 
                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
 
-def is_on_hook(pin, hook_type, invert_hook):
-    """
-    Determine if handset is on-hook based on GPIO state and configuration.
-    
-    For NC (Normally Closed) with pull-up:
-      - When on-hook: circuit closed, GPIO pulled to GND → reads LOW
-      - When off-hook: circuit open, pull-up resistor → reads HIGH
-      - Therefore: HIGH = on-hook, LOW = off-hook
-      
-    Actually, based on working simple implementation:
-      - NC: HIGH = on-hook, LOW = off-hook (handset down = high)
-      
-    For NO (Normally Open):
-      - When on-hook: circuit open → reads HIGH (with pull-up)
-      - When off-hook: circuit closed → reads LOW
-      - Therefore: LOW = on-hook, HIGH = off-hook
-    
-    invert_hook flips the logic.
-    """
-    state = GPIO.input(pin)
-    
-    if hook_type == "NC":
-        # NC: HIGH = on-hook, LOW = off-hook (based on working simple implementation)
-        on_hook = (state == GPIO.HIGH)
-    else:  # NO
-        # NO: LOW = on-hook, HIGH = off-hook
-        on_hook = (state == GPIO.LOW)
-    
-    if invert_hook:
-        on_hook = not on_hook
-    
-    return on_hook
+def shutdown_system(hold_time, lines):
+    """Stop any capture in progress and power the system off."""
+    logger.warning(f"Shutdown button held for {hold_time}s -> shutting down...")
+    for line in lines:
+        line.stop()
+    logger.warning("System shutting down...")
+    os.system("sudo shutdown now")
 
-def play_wav_interruptible(file_path, pin_hook, hw_mapping, volume, mixer_control, hook_type, invert_hook):
-    """
-    Play a WAV file with aplay, checking GPIO during playback.
-    Returns True if played to completion, False if interrupted by on-hook.
-    """
-    if not Path(file_path).exists():
-        logger.error(f"Missing audio file: {file_path}")
-        return False
-    
-    logger.info(f"Playing: {Path(file_path).name}")
-    set_volume(volume, mixer_control)
+def main(config_path=None, backend=None):
+    # Load configuration
+    if config_path is None:
+        config_path = Path(__file__).parent / "../config.yaml"
+    config = load_config(config_path)
     
-    proc = subprocess.Popen(
-        ["aplay", "-q", "-D", hw_mapping, str(file_path)],
-        stdout=subprocess.DEVNULL,
-        stderr=subprocess.DEVNULL
-    )
+    logger.info(f"Loaded configuration from: {config_path}")
     
     try:
-        while proc.poll() is None:
-            # Check if handset is on-hook
-            if is_on_hook(pin_hook, hook_type, invert_hook):
-                logger.info(f"Interrupted {Path(file_path).name} (on-hook)")
-                proc.terminate()
-                try:
-                    proc.wait(timeout=1)
-                except subprocess.TimeoutExpired:
-                    proc.kill()
-                return False
-            time.sleep(0.05)
-    except Exception as e:
-        logger.error(f"Playback error: {e}")
-        return False
-    
-    return True
-
-def start_recording(config):
-    """Start arecord process for guest recording."""
-    timestamp = datetime.now().isoformat()
-    recordings_path = Path(config['recordings_path'])
-    recordings_path.mkdir(exist_ok=True)
-    
-    out_file = recordings_path / f"{timestamp}.wav"
-    logger.info(f"Recording to: {out_file.name}")
-    
-    proc = subprocess.Popen([
-        "arecord", "-q",
-        "-f", config['format'],
-        "-t", config['file_type'],
-        "-D", config['alsa_hw_mapping'],
-        "-r", str(config['sample_rate']),
-        "-c", str(config['channels']),
-        str(out_file)
-    ])
-    return proc
-
-def start_recording_greeting(config):
-    """Start arecord process for recording greeting message."""
-    greeting_path = Path(config['greeting'])
-    greeting_path.parent.mkdir(exist_ok=True)
+        initial_lines = line_configs(config)
+    except ValueError as e:
+        logger.error(f"Invalid lines configuration: {e}")
+        sys.exit(1)
     
-    logger.info(f"Recording greeting to: {greeting_path.name}")
+    if config.get('audio_sink', 'alsa') == 'alsa':
+        set_volume(1.0, config['mixer_control_name'])
     
-    proc = subprocess.Popen([
-        "arecord", "-q",
-        "-f", config['format'],
-        "-t", config['file_type'],
-        "-D", config['alsa_hw_mapping'],
-        "-r", str(config['sample_rate']),
-        "-c", str(config['channels']),
-        str(greeting_path)
-    ])
-    return proc
-
-def stop_recording(proc, name="recording"):
-    """Stop an arecord process if running."""
-    if proc and proc.poll() is None:
-        logger.info(f"Stopping {name}")
-        proc.terminate()
+    # Takes the last run never committed get their names (see staging.py),
+    # and recordings a power cut left with unpatched headers play again;
+    # nothing is recording yet (see wav_repair.py)
+    try:
+        stager = Stager.from_config(config)
+    except OSError as e:
+        logger.error(f"Could not create staging_path, recording straight to the recordings folder: {e}")
+        stager = Stager()
+    try:
+        stager.recover(config['recordings_path'])
+    except OSError as e:
+        logger.error(f"Could not recover staged recordings: {e}")
+    if config.get('repair_recordings', True):
         try:
-            proc.wait(timeout=2)
-        except subprocess.TimeoutExpired:
-            proc.kill()
-
-def check_shutdown_button(pin_shutdown, hold_time=4.0):
-    """
-    Check if shutdown button is held LOW for hold_time seconds.
-    If so, initiate system shutdown.
-    """
-    if GPIO.input(pin_shutdown) == GPIO.LOW:
-        start = time.time()
-        while GPIO.input(pin_shutdown) == GPIO.LOW:
-            if time.time() - start >= hold_time:
-                logger.warning(f"Shutdown button held for {hold_time}s -> shutting down...")
-                stop_recording(recording_proc)
-                stop_recording(record_greeting_proc, "greeting recording")
-                logger.warning("System shutting down...")
-                os.system("sudo shutdown now")
-                return True
-            time.sleep(0.1)
-    return False
-
-def main():
-    global recording_proc, recording_start_ts, record_greeting_proc
+            repair_folder(config['recordings_path'])
+        except OSError as e:
+            logger.error(f"Could not check recordings for damaged headers: {e}")
     
-    # Load configuration
-    config_path = Path(__file__).parent / "../config.yaml"
-    config = load_config(config_path)
-    
-    logger.info(f"Loaded configuration from: {config_path}")
+    # Shared by every line: the GPIO backend, live state for the web UI (see
+    # events.py), committing finished takes and post-processing them off the
+    # hook loop and per-call latency traces (see call_trace.py)
+    own_backend = backend is None
+    services = Services(
+        create_backend(config) if own_backend else backend,
+        create_publisher(config),
+        stager,
+        PostProcessor.from_config(config),
+        TraceWriter.from_config(config),
+    )
+    lines = [PhoneLine(name, line_config, services) for name, line_config in initial_lines]
     
-    # Setup GPIO
-    GPIO.setmode(GPIO.BCM)
+    # Each line watches its own inputs (see phone_line.py). The shutdown
+    # button belongs to the daemon: its edges come in on the control queue,
+    # along with config reloads.
+    control = queue.Queue()
+    shutdown_pin = shutdown_debouncer = None
+    shutdown_hold_time = shutdown_pressed_at = None
     
-    # Hook GPIO (handset)
-    GPIO.setup(config['hook_gpio'], GPIO.IN, pull_up_down=GPIO.PUD_UP)
+    def on_edge(pin, level, timestamp):
+        control.put((pin, level, timestamp))
     
-    # Record greeting button (optional)
-    has_record_greeting = config.get('record_greeting_gpio', 0) != 0
-    if has_record_greeting:
-        GPIO.setup(config['record_greeting_gpio'], GPIO.IN, pull_up_down=GPIO.PUD_UP)
-        prev_record_greeting_state = GPIO.input(config['record_greeting_gpio'])
+    def setup_shutdown():
+        """Read the shutdown settings and watch the button (again, after a reload)."""
+        nonlocal shutdown_pin, shutdown_debouncer, shutdown_hold_time, shutdown_pressed_at
+        backend = services.backend
+        if shutdown_pin:
+            backend.unwatch(shutdown_pin)
+        shutdown_pin = config.get('shutdown_gpio', 0)
+        shutdown_hold_time = config.get('shutdown_button_hold_time', 4.0)
+        shutdown_debouncer = shutdown_pressed_at = None
+        if shutdown_pin:
+            backend.setup_input(shutdown_pin)
+            backend.watch(shutdown_pin, on_edge)
+            shutdown_debouncer = Debouncer(SHUTDOWN_BOUNCE_TIME, backend.read(shutdown_pin))
+            if shutdown_debouncer.level == LOW:
+                shutdown_pressed_at = time.monotonic()
     
-    # Shutdown button (optional)
-    has_shutdown = config.get('shutdown_gpio', 0) != 0
-    if has_shutdown:
-        GPIO.setup(config['shutdown_gpio'], GPIO.IN, pull_up_down=GPIO.PUD_UP)
+    # Config reloads (SIGHUP or the file changing) are read at once and
+    # handed to the lines; shared components that need rebuilding wait in
+    # `pending` until every phone is idle
+    pending = set()
     
-    logger.info("=" * 50)
-    logger.info("Rotary Phone Audio Guest Book - Ready")
-    logger.info("Lift handset to begin recording a message")
-    logger.info("=" * 50)
+    def reload_config():
+        try:
+            new_config = read_config(config_path)
+            new_lines = dict(line_configs(new_config))
+        except (OSError, ValueError) as e:
+            logger.error(f"Not reloading configuration: {e}")
+            return
+        if list(new_lines) != [line.name for line in lines]:
+            logger.warning("Lines were added, removed or renamed - restart the service to apply that")
+        for line in lines:
+            if line.name in new_lines:
+                line.reload(new_lines[line.name])
+        if new_config == config:
+            return
+        changed = changed_groups(config, new_config) & set(SHARED_GROUPS)
+        config.clear()
+        config.update(new_config)
+        pending.update(changed)
+        logger.info(
+            "Configuration reloaded"
+            + (f"; {', '.join(sorted(changed))} will be re-applied when idle" if changed else "")
+        )
     
-    # Get hook configuration
-    hook_type = config.get('hook_type', 'NC')
-    invert_hook = config.get('invert_hook', False)
-    hook_bounce_time = config.get('hook_bounce_time', 0.1)  # Default 0.1s
+    def apply_pending():
+        """Rebuild the shared components the last reloads changed.
+        
+        Only done while every line is idle, with their loops held so none
+        of them uses a component while it is replaced.
+        """
+        held = []
+        try:
+            for line in lines:
+                if not line.pause():
+                    return
+                held.append(line)
+            if not all(line.is_idle() for line in lines):
+                return
+            applied = []
+            for group in SHARED_GROUPS:
+                if group not in pending:
+                    continue
+                try:
+                    if group == 'backend':
+                        services.backend.close()
+                        if own_backend:
+                            services.backend = create_backend(config)
+                        for line in lines:
+                            line.setup_inputs()
+                    elif group == 'shutdown':
+                        setup_shutdown()
+                    elif group == 'staging':
+                        new_stager = Stager.from_config(config)
+                        # Commits already queued finish on the old worker
+                        threading.Thread(
+                            target=services.stager.close, name="staging-close"
+                        ).start()
+                        services.stager = new_stager
+                    elif group == 'postprocess':
+                        if services.postprocessor:
+                            # Let queued takes finish without holding up the loop
+                            threading.Thread(
+                                target=services.postprocessor.close, name="postprocess-close"
+                            ).start()
+                        services.postprocessor = PostProcessor.from_config(config)
+                    elif group == 'events':
+                        services.events.close()
+                        services.events = create_publisher(config)
+                    elif group == 'trace':
+                        services.tracer = TraceWriter.from_config(config)
+                    applied.append(group)
+                except Exception as e:
+                    logger.error(f"Could not re-apply {group} settings, keeping the old ones: {e}")
+            pending.clear()
+            logger.info(f"Re-applied: {', '.join(applied) or 'nothing'}")
+            services.events.publish('config_reloaded', applied=applied)
+        finally:
+            for line in held:
+                line.resume()
     
-    prev_was_on_hook = is_on_hook(config['hook_gpio'], hook_type, invert_hook)
+    watcher = ConfigWatcher(config_path, lambda: control.put(RELOAD))
+    if threading.current_thread() is threading.main_thread():
+        # systemctl reload audioGuestBook.service (ExecReload sends SIGHUP)
+        signal.signal(signal.SIGHUP, lambda signum, frame: watcher.request())
     
     try:
+        setup_shutdown()
+        for line in lines:
+            line.start()
+        
+        logger.info("=" * 50)
+        logger.info("Rotary Phone Audio Guest Book - Ready")
+        if lines[0].name:
+            logger.info(f"Lines: {', '.join(line.name for line in lines)}")
+        logger.info("Lift handset to begin recording a message")
+        logger.info("=" * 50)
+        
         while True:
-            # Check current hook state
-            currently_on_hook = is_on_hook(config['hook_gpio'], hook_type, invert_hook)
-            
-            # Detect state change
-            if currently_on_hook != prev_was_on_hook:
-                # State changed - verify it's stable for bounce_time before acting
-                change_time = time.time()
-                stable_state = currently_on_hook
-                
-                # Wait and verify stability
-                while time.time() - change_time < hook_bounce_time:
-                    current_check = is_on_hook(config['hook_gpio'], hook_type, invert_hook)
-                    if current_check != stable_state:
-                        # State bounced back, ignore this change
-                        stable_state = current_check
-                        change_time = time.time()
-                    time.sleep(0.01)  # Check every 10ms during debounce
-                
-                # After debounce period, verify final state
-                final_state = is_on_hook(config['hook_gpio'], hook_type, invert_hook)
-                if final_state != prev_was_on_hook:
-                    # State change confirmed after debounce
-                    currently_on_hook = final_state
-                else:
-                    # State bounced back to original, ignore
-                    currently_on_hook = prev_was_on_hook
+            deadlines = [time.monotonic() + LINE_CHECK_SECONDS]
+            if shutdown_debouncer:
+                deadlines.append(shutdown_debouncer.deadline())
+            if shutdown_pressed_at is not None:
+                deadlines.append(shutdown_pressed_at + shutdown_hold_time)
             
-            # ========== MAIN HANDSET HOOK LOGIC ==========
-            
-            # OFF-HOOK: User lifted handset
-            if prev_was_on_hook and not currently_on_hook:
-                logger.info("\n[OFF-HOOK] Handset lifted")
-                
-                # Greeting start delay
-                delay = config.get('greeting_start_delay', 0)
-                if delay > 0:
-                    logger.info(f"Waiting {delay}s before greeting...")
-                    time.sleep(delay)
-                    # Check if user hung up during delay
-                    if is_on_hook(config['hook_gpio'], hook_type, invert_hook):
-                        logger.info("Handset replaced during delay - aborting")
-                        prev_was_on_hook = is_on_hook(config['hook_gpio'], hook_type, invert_hook)
-                        continue
-                
-                # Play greeting (interruptible)
-                if not play_wav_interruptible(
-                    config['greeting'],
-                    config['hook_gpio'],
-                    config['alsa_hw_mapping'],
-                    config['greeting_volume'],
-                    config['mixer_control_name'],
-                    hook_type,
-                    invert_hook
-                ):
-                    prev_was_on_hook = is_on_hook(config['hook_gpio'], hook_type, invert_hook)
-                    continue
-                
-                # Beep delay
-                beep_delay = config.get('beep_start_delay', 0)
-                if beep_delay > 0:
-                    time.sleep(beep_delay)
-                
-                # Play beep (interruptible)
-                if not play_wav_interruptible(
-                    config['beep'],
-                    config['hook_gpio'],
-                    config['alsa_hw_mapping'],
-                    config['beep_volume'],
-                    config['mixer_control_name'],
-                    hook_type,
-                    invert_hook
-                ):
-                    prev_was_on_hook = is_on_hook(config['hook_gpio'], hook_type, invert_hook)
-                    continue
-                
-                # Start recording if still off-hook
-                if not is_on_hook(config['hook_gpio'], hook_type, invert_hook) and recording_proc is None:
-                    recording_proc = start_recording(config)
-                    recording_start_ts = time.time()
-            
-            # ON-HOOK: User replaced handset
-            if not prev_was_on_hook and currently_on_hook:
-                logger.info("[ON-HOOK] Handset replaced")
-                if recording_proc:
-                    stop_recording(recording_proc)
-                    recording_proc = None
-                    recording_start_ts = None
-            
-            # Check max recording duration
-            if recording_proc and recording_proc.poll() is None and recording_start_ts:
-                elapsed = time.time() - recording_start_ts
-                if elapsed >= config['recording_limit']:
-                    logger.warning(f"[TIME EXCEEDED] Max recording time {config['recording_limit']}s reached")
-                    stop_recording(recording_proc)
-                    recording_proc = None
-                    recording_start_ts = None
-                    
-                    # Play time exceeded message (interruptible)
-                    play_wav_interruptible(
-                        config['time_exceeded'],
-                        config['hook_gpio'],
-                        config['alsa_hw_mapping'],
-                        config['time_exceeded_volume'],
-                        config['mixer_control_name'],
-                        hook_type,
-                        invert_hook
-                    )
-            
-            prev_was_on_hook = currently_on_hook
-            
-            # ========== RECORD GREETING BUTTON LOGIC ==========
+            # Block until a shutdown button edge or a reload arrives, or the
+            # next timer is due
+            settled = []
+            try:
+                item = control.get(timeout=next_timeout(deadlines))
+            except queue.Empty:
+                item = None
+            while item is not None:
+                if item is RELOAD:
+                    reload_config()
+                elif shutdown_debouncer and item[0] == shutdown_pin:
+                    # (edges from a pin dropped by a reload are ignored)
+                    _, level, timestamp = item
+                    settled.append(shutdown_debouncer.expire(timestamp))
+                    settled.append(shutdown_debouncer.feed(level, timestamp))
+                try:
+                    item = control.get_nowait()
+                except queue.Empty:
+                    item = None
+            if shutdown_debouncer:
+                settled.append(shutdown_debouncer.expire(time.monotonic()))
             
-            if has_record_greeting:
-                record_greeting_state = GPIO.input(config['record_greeting_gpio'])
-                
-                # Debounce record greeting button
-                record_greeting_bounce_time = config.get('record_greeting_bounce_time', 0.1)
-                
-                # Detect state change
-                if record_greeting_state != prev_record_greeting_state:
-                    # State changed - verify it's stable for bounce_time
-                    change_time = time.time()
-                    stable_state = record_greeting_state
-                    
-                    # Wait and verify stability
-                    while time.time() - change_time < record_greeting_bounce_time:
-                        current_check = GPIO.input(config['record_greeting_gpio'])
-                        if current_check != stable_state:
-                            # State bounced back
-                            stable_state = current_check
-                            change_time = time.time()
-                        time.sleep(0.01)
-                    
-                    # After debounce period, verify final state
-                    final_state = GPIO.input(config['record_greeting_gpio'])
-                    if final_state != prev_record_greeting_state:
-                        # State change confirmed
-                        record_greeting_state = final_state
-                    else:
-                        # State bounced back to original
-                        record_greeting_state = prev_record_greeting_state
-                
-                # Button pressed (HIGH -> LOW for NC)
-                if prev_record_greeting_state == GPIO.HIGH and record_greeting_state == GPIO.LOW:
-                    logger.info("\n[RECORD GREETING] Button pressed - recording new greeting")
-                    
-                    # Play beep to indicate recording start
-                    play_wav_interruptible(
-                        config['beep'],
-                        config['record_greeting_gpio'],  # Use record button as interrupt
-                        config['alsa_hw_mapping'],
-                        config['beep_volume'],
-                        config['mixer_control_name'],
-                        config.get('record_greeting_type', 'NC'),
-                        False  # No invert for record greeting
-                    )
-                    
-                    # Start recording greeting
-                    if record_greeting_proc is None:
-                        record_greeting_proc = start_recording_greeting(config)
-                
-                # Button released (LOW -> HIGH for NC)
-                if prev_record_greeting_state == GPIO.LOW and record_greeting_state == GPIO.HIGH:
-                    logger.info("[RECORD GREETING] Button released - saving greeting")
-                    if record_greeting_proc:
-                        stop_recording(record_greeting_proc, "greeting recording")
-                        record_greeting_proc = None
-                
-                prev_record_greeting_state = record_greeting_state
+            # ========== SHUTDOWN BUTTON ==========
             
-            # ========== SHUTDOWN BUTTON CHECK ==========
+            for level in settled:
+                if level is not None:
+                    # Active LOW: start the hold timer on press, cancel on release
+                    shutdown_pressed_at = time.monotonic() if level == LOW else None
             
-            if has_shutdown:
-                if check_shutdown_button(
-                    config['shutdown_gpio'],
-                    hold_time=config.get('shutdown_button_hold_time', 4.0)
-                ):
+            # Check shutdown button hold time
+            if shutdown_pressed_at is not None:
+                if time.monotonic() - shutdown_pressed_at >= shutdown_hold_time:
+                    services.events.publish('shutdown')
+                    shutdown_system(shutdown_hold_time, lines)
                     break  # Shutting down
             
-            # Main loop delay
-            time.sleep(0.05)
+            # A line whose loop died can no longer take calls; exit so the
+            # service is restarted
+            for line in lines:
+                if not line.is_alive():
+                    raise RuntimeError(f"Hook loop of {line.name or 'the phone'} stopped")
+            
+            # Rebuild shared components for reloaded settings between calls
+            if pending and shutdown_pressed_at is None:
+                apply_pending()
     
     except KeyboardInterrupt:
         logger.info("\n\nExiting...")
     finally:
-        stop_recording(recording_proc)
-        stop_recording(record_greeting_proc, "greeting recording")
-        GPIO.cleanup()
+        for line in lines:
+            line.stop()
+        services.stager.close()
+        if services.postprocessor:
+            services.postprocessor.close()
+        services.backend.close()
+        services.events.close()
         logger.info("Cleanup complete. Goodbye!")
 
 if __name__ == "__main__":
@@ -0,0 +1,276 @@
+"""In-process audio output for the guest book prompts.
+
+The greeting, beep and time-exceeded prompts are decoded once at startup into
+PCM in the output device's format, with their ``*_volume`` applied as a gain.
+Playback then only copies bytes into an output device that stays open for the
+lifetime of the daemon: no ``aplay``/``amixer`` processes and no WAV parsing
+between the handset being lifted and the guest hearing the greeting.
+
+Audio is written one period at a time and the ``interrupted`` callback is
+checked between periods, so a hang-up stops playback within one period.
+:meth:`AudioEngine.start` plays on a player thread instead, so the caller
+can keep handling inputs and timers while a prompt is heard.
+"""
+
+import logging
+import os
+import threading
+import time
+import wave
+from pathlib import Path
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+PROMPTS = ("greeting", "beep", "time_exceeded")
+
+# Output is always signed 16-bit little-endian.
+SAMPLE_WIDTH = 2
+
+
+def decode_wav(path, rate, channels, gain=1.0):
+    """Decode a PCM WAV file to S16_LE bytes at ``rate``/``channels``.
+
+    Any PCM sample width is accepted. Channel counts are mapped by
+    down-mixing to mono and duplicating, and the sample rate is converted by
+    linear interpolation, which is plenty for short voice prompts.
+    """
+    with wave.open(str(path), "rb") as wf:
+        width = wf.getsampwidth()
+        src_channels = wf.getnchannels()
+        src_rate = wf.getframerate()
+        raw = wf.readframes(wf.getnframes())
+
+    samples = _pcm_to_float(raw, width).reshape(-1, src_channels)
+
+    if src_channels != channels:
+        mono = samples.mean(axis=1, keepdims=True)
+        samples = np.repeat(mono, channels, axis=1)
+
+    if src_rate != rate and len(samples):
+        n_out = int(round(len(samples) * rate / src_rate))
+        t_out = np.arange(n_out) * (src_rate / rate)
+        t_in = np.arange(len(samples))
+        samples = np.column_stack(
+            [np.interp(t_out, t_in, samples[:, c]) for c in range(channels)]
+        )
+
+    samples = np.clip(samples * gain, -1.0, 32767 / 32768)
+    return (samples * 32768).astype("<i2").tobytes()
+
+
+def _pcm_to_float(raw, width):
+    """Convert little-endian PCM bytes of the given sample width to floats."""
+    if width == 1:
+        return (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128) / 128
+    if width == 2:
+        return np.frombuffer(raw, dtype="<i2").astype(np.float32) / 32768
+    if width == 3:
+        b = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        ints = b[:, 0] | (b[:, 1] << 8) | (b[:, 2] << 16)
+        ints = np.where(ints & 0x800000, ints - 0x1000000, ints)
+        return ints.astype(np.float32) / 8388608
+    if width == 4:
+        return np.frombuffer(raw, dtype="<i4").astype(np.float32) / 2147483648
+    raise ValueError(f"Unsupported sample width: {width}")
+
+
+class AlsaSink:
+    """Playback through an ALSA device held open by pyalsaaudio."""
+
+    def __init__(self, device, rate, channels, period_frames):
+        import alsaaudio
+
+        self._pcm = alsaaudio.PCM(
+            type=alsaaudio.PCM_PLAYBACK,
+            mode=alsaaudio.PCM_NORMAL,
+            device=device,
+            rate=rate,
+            channels=channels,
+            format=alsaaudio.PCM_FORMAT_S16_LE,
+            periodsize=period_frames,
+        )
+
+    def write(self, data):
+        self._pcm.write(data)
+
+    def drop(self):
+        """Discard whatever is still queued in the device buffer."""
+        drop = getattr(self._pcm, "drop", None)
+        if drop:
+            drop()
+
+    def close(self):
+        self._pcm.close()
+
+
+class FileSink:
+    """Writes raw PCM to a file, or to ``os.devnull`` for a null device.
+
+    With ``realtime`` set, each write blocks for the audio's duration the way a
+    sound card would, so prompt timing and hang-up latency can be measured
+    without hardware.
+    """
+
+    def __init__(self, path, rate, channels, realtime=True):
+        self._file = open(path, "wb")
+        self._bytes_per_second = rate * channels * SAMPLE_WIDTH
+        self._realtime = realtime
+        self._next_write = 0.0
+
+    def write(self, data):
+        self._file.write(data)
+        if self._realtime:
+            now = time.monotonic()
+            self._next_write = max(self._next_write, now) + len(data) / self._bytes_per_second
+            time.sleep(max(0.0, self._next_write - now))
+
+    def drop(self):
+        self._next_write = 0.0
+
+    def close(self):
+        self._file.close()
+
+
+def create_sink(config, rate, channels, period_frames):
+    """Build the output sink named by ``audio_sink`` in the config."""
+    kind = config.get("audio_sink", "alsa")
+    if kind == "alsa":
+        return AlsaSink(config["alsa_hw_mapping"], rate, channels, period_frames)
+    if kind == "file":
+        return FileSink(config["audio_sink_path"], rate, channels)
+    if kind == "null":
+        return FileSink(os.devnull, rate, channels)
+    raise ValueError(f"Unknown audio_sink: {kind}")
+
+
+class Playback:
+    """A prompt playing on its own thread (see AudioEngine.start)."""
+
+    def __init__(self, name):
+        self.name = name
+        self.completed = None
+        self.done = threading.Event()
+        self._cancelled = threading.Event()
+        self._thread = None
+
+    def cancel(self):
+        """Stop playback and wait until the sink is free (at most one period)."""
+        self._cancelled.set()
+        self._thread.join()
+
+
+class AudioEngine:
+    """Plays preloaded prompts on a single, persistent output sink."""
+
+    def __init__(self, sink, rate, channels, period_frames=1024, buffer_periods=4):
+        self.sink = sink
+        self.rate = rate
+        self.channels = channels
+        self.period_bytes = period_frames * channels * SAMPLE_WIDTH
+        self.buffer_periods = buffer_periods
+        self._prompts = {}
+        # Monotonic time the current/last prompt's first period was written
+        self.last_started_at = None
+        self._playback = None
+
+    @classmethod
+    def from_config(cls, config):
+        rate = int(config["sample_rate"])
+        channels = int(config["channels"])
+        period_frames = int(config.get("playback_period_frames", 1024))
+        sink = create_sink(config, rate, channels, period_frames)
+        engine = cls(sink, rate, channels, period_frames)
+        engine.load_prompts(config)
+        return engine
+
+    def load(self, name, path, volume):
+        """Decode ``path`` into the prompt cache under ``name``."""
+        if not Path(path).exists():
+            logger.error(f"Missing audio file: {path}")
+            self._prompts.pop(name, None)
+            return
+        gain = max(0.0, min(float(volume), 1.0))
+        try:
+            self._prompts[name] = decode_wav(path, self.rate, self.channels, gain)
+        except (wave.Error, EOFError, ValueError) as e:
+            logger.error(f"Could not decode {path}: {e}")
+            self._prompts.pop(name, None)
+            return
+        logger.info(f"Loaded {name}: {Path(path).name} (volume {gain:.2f})")
+
+    def load_prompts(self, config):
+        for name in PROMPTS:
+            self.load(name, config[name], config.get(f"{name}_volume", 1.0))
+
+    def play(self, name, interrupted):
+        """
+        Play a cached prompt, calling interrupted() between periods.
+        Returns True if played to completion, False if interrupted or missing.
+        """
+        pcm = self._prompts.get(name)
+        if pcm is None:
+            logger.error(f"No audio loaded for: {name}")
+            return False
+
+        logger.info(f"Playing: {name}")
+        self.last_started_at = time.monotonic()
+        step = self.period_bytes
+        silence = bytes(step)
+        try:
+            for offset in range(0, len(pcm), step):
+                if interrupted():
+                    logger.info(f"Interrupted {name} (on-hook)")
+                    self.sink.drop()
+                    return False
+                self.sink.write(pcm[offset:offset + step])
+
+            # Writes return once the data is queued, not played. Queue a
+            # buffer's worth of silence so we only return once the prompt has
+            # actually been heard, then drop the silence.
+            for _ in range(self.buffer_periods):
+                if interrupted():
+                    self.sink.drop()
+                    return False
+                self.sink.write(silence)
+            self.sink.drop()
+        except Exception as e:
+            logger.error(f"Playback error: {e}")
+            return False
+
+        return True
+
+    def start(self, name, interrupted, on_done=None):
+        """Play a cached prompt on a player thread and return its Playback.
+
+        ``interrupted()`` is checked between periods as in play(), and
+        ``on_done(playback)`` is called from the player thread when it ends;
+        ``playback.completed`` says whether it played to completion. A
+        prompt still playing is cancelled first.
+        """
+        self.stop()
+        playback = Playback(name)
+
+        def run():
+            playback.completed = self.play(
+                name, lambda: playback._cancelled.is_set() or interrupted()
+            )
+            playback.done.set()
+            if on_done:
+                on_done(playback)
+
+        playback._thread = threading.Thread(target=run, name=f"play-{name}", daemon=True)
+        self._playback = playback
+        playback._thread.start()
+        return playback
+
+    def stop(self):
+        """Cancel the prompt started by start(), if it is still playing."""
+        playback, self._playback = self._playback, None
+        if playback is not None and not playback.done.is_set():
+            playback.cancel()
+
+    def close(self):
+        self.stop()
+        self.sink.close()
@@ -0,0 +1,103 @@
+"""Per-call latency traces.
+
+Every call (handset lifted until the recording is closed) produces one
+:class:`CallTrace`: the ``time.monotonic()`` timestamps of the steps a guest
+waits on, written as one JSON line to ``cache_path/call_traces.jsonl``. The
+web server summarizes the file as p50/p95/p99 per stage on ``/metrics``
+(see ``webserver/call_traces.py``).
+
+Trace events, in call order (any may be missing if the call ended early):
+
+``edge_detected``
+    GPIO edge of the lift, as timestamped by the backend's interrupt.
+``debounce_settled``
+    The hook loop acted on the settled change.
+``greeting_delay_end``
+    ``greeting_start_delay`` has elapsed.
+``greeting_first_sample``
+    First period of the greeting written to the sound card.
+``beep_end``
+    Beep played to completion.
+``capture_started``
+    Recording started (``arecord`` spawned, or warm capture attached).
+``first_captured_frame``
+    First live frame written to the file (warm capture only; ``arecord``
+    does not report it).
+``on_hook``
+    GPIO edge of the hang-up.
+``file_closed``
+    Recording stopped and the file closed: encoder finished or writer
+    drained, on the stager's worker (the hook loop has moved on by then).
+
+``outcome`` is ``recorded``, ``time_exceeded`` (the recording limit ended
+it; the later hang-up is not part of the trace) or ``abandoned`` (hung up
+before recording started).
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# Rotate the trace file to .1 beyond this size
+MAX_BYTES = 4 * 1024 * 1024
+
+
+class CallTrace:
+    """Monotonic timestamps of one call's events."""
+
+    def __init__(self, edge_at, line=None):
+        self.started_at = time.time() - (time.monotonic() - edge_at)
+        self.line = line
+        self.events = {"edge_detected": edge_at}
+        self.recording = None
+        self.outcome = None
+
+    def mark(self, event, at=None):
+        """Record ``event`` now, or at monotonic time ``at``; first one wins."""
+        self.events.setdefault(event, time.monotonic() if at is None else at)
+
+    def to_dict(self):
+        trace = {
+            "started_at": round(self.started_at, 3),
+            "recording": self.recording,
+            "outcome": self.outcome,
+            "events": {name: round(at, 6) for name, at in self.events.items()},
+        }
+        if self.line:
+            trace["line"] = self.line
+        return trace
+
+
+class TraceWriter:
+    """Appends finished traces to a JSONL file."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+
+    def write(self, trace):
+        line = json.dumps(trace.to_dict()) + "\n"
+        try:
+            with self._lock:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                try:
+                    if self.path.stat().st_size > MAX_BYTES:
+                        os.replace(self.path, self.path.with_name(self.path.name + ".1"))
+                except FileNotFoundError:
+                    pass
+                with self.path.open("a") as f:
+                    f.write(line)
+        except OSError as e:
+            logger.warning(f"Could not write call trace: {e}")
+
+    @classmethod
+    def from_config(cls, config):
+        """Return a TraceWriter, or None if ``call_trace`` is off."""
+        if not config.get("call_trace", True):
+            return None
+        return cls(Path(config.get("cache_path", "cache")) / "call_traces.jsonl")
@@ -0,0 +1,221 @@
+"""Warm audio capture with a pre-roll ring buffer.
+
+In ``capture_mode: warm`` the input device is opened as soon as the handset is
+lifted and captured continuously into a fixed-size ring buffer while the
+greeting and beep play. When recording starts, the last ``recording_preroll``
+seconds are written out first and live audio follows seamlessly, so a guest
+who starts talking over the end of the beep is not cut off by process startup
+or device open time.
+"""
+
+import collections
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Capture is always signed 16-bit little-endian.
+SAMPLE_WIDTH = 2
+
+# arecord -f names that map onto S16_LE
+S16_FORMATS = ("cd", "dat", "S16_LE")
+
+
+class AlsaCaptureSource:
+    """Reads periods from an ALSA capture device via pyalsaaudio."""
+
+    def __init__(self, device, rate, channels, period_frames):
+        import alsaaudio
+
+        self._pcm = alsaaudio.PCM(
+            type=alsaaudio.PCM_CAPTURE,
+            mode=alsaaudio.PCM_NORMAL,
+            device=device,
+            rate=rate,
+            channels=channels,
+            format=alsaaudio.PCM_FORMAT_S16_LE,
+            periodsize=period_frames,
+        )
+
+    def read(self):
+        length, data = self._pcm.read()
+        if length < 0:
+            logger.warning("Capture overrun")
+            return b""
+        return data
+
+    def close(self):
+        self._pcm.close()
+
+
+class FakeCaptureSource:
+    """Produces PCM paced in real time, for running without a sound card.
+
+    Loops ``pcm`` (S16_LE bytes in the capture format) if given, otherwise
+    produces silence.
+    """
+
+    def __init__(self, rate, channels, period_frames, pcm=None):
+        self._period_bytes = period_frames * channels * SAMPLE_WIDTH
+        self._period_seconds = period_frames / rate
+        self._pcm = pcm or bytes(self._period_bytes)
+        self._offset = 0
+        self._next_read = time.monotonic()
+
+    def read(self):
+        self._next_read += self._period_seconds
+        time.sleep(max(0.0, self._next_read - time.monotonic()))
+        chunk = b""
+        while len(chunk) < self._period_bytes:
+            take = self._pcm[self._offset:self._offset + self._period_bytes - len(chunk)]
+            chunk += take
+            self._offset = (self._offset + len(take)) % len(self._pcm)
+        return chunk
+
+    def close(self):
+        pass
+
+
+def create_source_factory(config, period_frames):
+    """Return a callable that opens the capture source named in the config."""
+    rate = int(config["sample_rate"])
+    channels = int(config["channels"])
+    if config.get("capture_source", "alsa") == "fake":
+        return lambda: FakeCaptureSource(rate, channels, period_frames)
+    return lambda: AlsaCaptureSource(config["alsa_hw_mapping"], rate, channels, period_frames)
+
+
+class WarmCapture:
+    """Keeps an input stream running while armed and hands it to writers.
+
+    ``arm()`` opens the source and starts a reader thread that fills the
+    ring buffer. ``start(writer)`` flushes the pre-roll into ``writer`` and
+    routes live audio to it until ``stop()``. ``disarm()`` closes the source.
+    """
+
+    def __init__(self, source_factory, rate, channels, preroll):
+        self._source_factory = source_factory
+        self.rate = rate
+        self.channels = channels
+        self._preroll_bytes = int(preroll * rate) * channels * SAMPLE_WIDTH
+        self._ring = collections.deque()
+        self._ring_bytes = 0
+        self._lock = threading.Lock()
+        self._writer = None
+        self._thread = None
+        self._stopping = threading.Event()
+        # Monotonic time the first frame reached the current writer
+        self.first_frame_at = None
+
+    @classmethod
+    def from_config(cls, config):
+        if config.get("format", "cd") not in S16_FORMATS:
+            raise ValueError(
+                f"Warm capture supports 16-bit formats only ({', '.join(S16_FORMATS)}), "
+                f"not {config.get('format')}"
+            )
+        period_frames = int(config.get("capture_period_frames", 1024))
+        return cls(
+            create_source_factory(config, period_frames),
+            int(config["sample_rate"]),
+            int(config["channels"]),
+            float(config.get("recording_preroll", 0.5)),
+        )
+
+    @property
+    def armed(self):
+        return self._thread is not None
+
+    def arm(self):
+        if self._thread is not None:
+            return
+        source = self._source_factory()
+        self._stopping.clear()
+        self._thread = threading.Thread(
+            target=self._run, args=(source,), name="warm-capture", daemon=True
+        )
+        self._thread.start()
+
+    def disarm(self):
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._thread.join(timeout=2)
+        self._thread = None
+        with self._lock:
+            self._ring.clear()
+            self._ring_bytes = 0
+
+    def start(self, writer):
+        """Write the pre-roll to ``writer`` and route live audio to it."""
+        with self._lock:
+            preroll = b"".join(self._ring)[-self._preroll_bytes:] if self._preroll_bytes else b""
+            self._ring.clear()
+            self._ring_bytes = 0
+            self.first_frame_at = None
+            if preroll:
+                writer.write(preroll)
+            self._writer = writer
+        logger.info(f"Recording with {len(preroll) / (self.rate * self.channels * SAMPLE_WIDTH):.2f}s pre-roll")
+
+    def stop(self):
+        """Detach and return the current writer (the caller closes it)."""
+        with self._lock:
+            writer, self._writer = self._writer, None
+        return writer
+
+    def _run(self, source):
+        try:
+            while not self._stopping.is_set():
+                data = source.read()
+                if not data:
+                    continue
+                with self._lock:
+                    if self._writer is not None:
+                        if self.first_frame_at is None:
+                            self.first_frame_at = time.monotonic()
+                        self._writer.write(data)
+                    elif self._preroll_bytes:
+                        self._ring.append(data)
+                        self._ring_bytes += len(data)
+                        # Keep just enough whole periods to cover the pre-roll
+                        while self._ring_bytes - len(self._ring[0]) >= self._preroll_bytes:
+                            self._ring_bytes -= len(self._ring.popleft())
+        except Exception as e:
+            logger.error(f"Capture error: {e}")
+        finally:
+            source.close()
+
+
+class WarmRecording:
+    """A recording fed by a :class:`WarmCapture`.
+
+    Mimics the parts of ``subprocess.Popen`` the daemon uses for ``arecord``
+    so both capture modes share the same start/stop handling. ``terminate``
+    only detaches the writer from the capture; ``wait`` drains and closes it.
+    """
+
+    def __init__(self, capture, writer):
+        self._capture = capture
+        self._writer = writer
+        self._stopped = False
+        capture.start(writer)
+
+    def poll(self):
+        return None if self._writer is not None else 0
+
+    def terminate(self):
+        if not self._stopped:
+            self._stopped = True
+            self._capture.stop()
+
+    def wait(self, timeout=None):
+        self.terminate()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        return 0
+
+    def kill(self):
+        self.terminate()
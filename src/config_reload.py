@@ -0,0 +1,131 @@
+"""Reloading config.yaml without restarting the daemon.
+
+The web UI saves the config and sends the daemon ``SIGHUP`` (``systemctl
+reload audioGuestBook.service``); a :class:`ConfigWatcher` thread also checks
+the file every ``POLL_SECONDS``, so edits made by hand are picked up too.
+
+Plain values (delays, recording limit, file type, ...) are read when they are
+used, so they take effect as soon as the new config is loaded. Settings that
+need a component rebuilt are grouped in :data:`RELOAD_GROUPS`; the daemon
+only rebuilds a group while the phone is idle, never in the middle of a call.
+"""
+
+import logging
+import os
+import threading
+
+import yaml
+
+logger = logging.getLogger(__name__)
+
+POLL_SECONDS = 2.0
+
+# Component -> config keys it is built from
+RELOAD_GROUPS = {
+    "backend": ("gpio_backend",),
+    "gpio": (
+        "hook_gpio", "hook_type", "invert_hook", "hook_bounce_time",
+        "record_greeting_gpio", "record_greeting_bounce_time",
+    ),
+    "shutdown": ("shutdown_gpio", "shutdown_button_hold_time"),
+    "audio": (
+        "audio_sink", "audio_sink_path", "alsa_hw_mapping", "sample_rate", "channels",
+        "playback_period_frames",
+    ),
+    "prompts": (
+        "greeting", "greeting_volume", "beep", "beep_volume",
+        "time_exceeded", "time_exceeded_volume",
+    ),
+    "capture": (
+        "capture_mode", "capture_source", "capture_period_frames", "recording_preroll",
+        "alsa_hw_mapping", "format", "sample_rate", "channels",
+    ),
+    "staging": ("staging_path",),
+    "postprocess": (
+        "postprocess", "postprocess_silence_db", "postprocess_trim_padding",
+        "postprocess_tail_trim", "postprocess_target_db", "postprocess_peak_db",
+        "postprocess_workers", "cache_path",
+    ),
+    "events": ("event_socket",),
+    "trace": ("call_trace", "cache_path"),
+}
+
+# The audio engine holds the decoded prompts, so rebuilding it reloads them;
+# a new GPIO backend needs every input watched again
+IMPLIED_GROUPS = {"audio": ("prompts",), "backend": ("gpio", "shutdown")}
+
+
+def read_config(path):
+    """Parse ``path``; raises ValueError if it is not a YAML mapping."""
+    try:
+        with open(path, "r") as f:
+            config = yaml.safe_load(f)
+    except yaml.YAMLError as e:
+        raise ValueError(f"Invalid YAML: {e}") from e
+    if not isinstance(config, dict):
+        raise ValueError("Config is not a mapping")
+    return config
+
+
+def changed_groups(old, new):
+    """Names of the RELOAD_GROUPS whose settings differ between two configs."""
+    changed = {
+        group for group, keys in RELOAD_GROUPS.items()
+        if any(old.get(key) != new.get(key) for key in keys)
+    }
+    for group, implied in IMPLIED_GROUPS.items():
+        if group in changed:
+            changed.update(implied)
+    return changed
+
+
+def prompt_stamps(config):
+    """(mtime, size) of each prompt file, to notice a prompt re-uploaded
+    under the same name."""
+    stamps = {}
+    for key in RELOAD_GROUPS["prompts"]:
+        if key.endswith("_volume"):
+            continue
+        try:
+            st = os.stat(config[key])
+            stamps[key] = (st.st_mtime_ns, st.st_size)
+        except (KeyError, TypeError, OSError):
+            stamps[key] = None
+    return stamps
+
+
+class ConfigWatcher:
+    """Calls ``on_change()`` when ``path`` changes or a reload is requested.
+
+    ``on_change`` runs on the watcher's thread and should only hand the
+    request over (the daemon puts a marker on its event queue).
+    """
+
+    def __init__(self, path, on_change, interval=POLL_SECONDS):
+        self.path = path
+        self.on_change = on_change
+        self.interval = interval
+        self._requested = threading.Event()
+        self._stamp = self._read_stamp()
+        self._thread = threading.Thread(target=self._run, name="config-watcher", daemon=True)
+        self._thread.start()
+
+    def request(self):
+        """Reload now (safe to call from a signal handler)."""
+        self._requested.set()
+
+    def _read_stamp(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _run(self):
+        while True:
+            requested = self._requested.wait(self.interval)
+            self._requested.clear()
+            stamp = self._read_stamp()
+            if requested or (stamp != self._stamp and stamp is not None):
+                self._stamp = stamp
+                self.on_change()
@@ -0,0 +1,136 @@
+"""Live daemon events for the web UI.
+
+The daemon publishes what it is doing (handset lifted or replaced, prompts
+playing, recordings starting and stopping, new files) as JSON lines on a
+Unix stream socket (``event_socket``). The web server connects as a
+subscriber and fans the events out to browsers over server-sent events.
+
+Publishing never blocks the hook loop: sends are non-blocking and a
+subscriber that cannot keep up is disconnected (it reconnects and gets a
+fresh snapshot). Every new subscriber first receives a ``state`` event with
+the current snapshot, so it does not have to wait for the next change.
+
+With several phone lines (see phone_line.py) events carry the ``line`` they
+come from, and ``lines`` holds each line's own ``off_hook`` / ``playing`` /
+``recording``. The top-level values then describe the whole set: off hook
+or recording if any line is.
+"""
+
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Snapshot of one line before its first event
+LINE_STATE = {"off_hook": False, "playing": None, "recording": None}
+
+
+class EventPublisher:
+    """Accepts subscribers on a Unix socket and sends them every event."""
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(path)
+        self._server.listen(8)
+        self._clients = []
+        self._lock = threading.Lock()
+        self.state = {**LINE_STATE, "lines": {}}
+        self._thread = threading.Thread(target=self._accept, name="event-publisher", daemon=True)
+        self._thread.start()
+        logger.info(f"Publishing events on {path}")
+
+    def _accept(self):
+        while True:
+            try:
+                client, _ = self._server.accept()
+            except OSError:
+                return  # closed
+            client.setblocking(False)
+            with self._lock:
+                if self._send(client, self._line("state", self.state)):
+                    self._clients.append(client)
+
+    @staticmethod
+    def _line(event, data):
+        return (json.dumps({"event": event, "ts": time.time(), **data}) + "\n").encode()
+
+    @staticmethod
+    def _send(client, line):
+        try:
+            if client.send(line) == len(line):
+                return True
+        except OSError:
+            pass
+        # Gone, or too far behind to take a whole line: drop it
+        client.close()
+        return False
+
+    def publish(self, event, **data):
+        """Send ``event`` to every subscriber; keys in the snapshot update it."""
+        with self._lock:
+            if data.get("line"):
+                data = self._update_line(data)
+            for key in self.state.keys() & data.keys():
+                self.state[key] = data[key]
+            line = self._line(event, data)
+            self._clients = [c for c in self._clients if self._send(c, line)]
+
+    def _update_line(self, data):
+        """Fold an event of one line into ``lines`` and the set-wide values."""
+        lines = dict(self.state.get("lines", {}))
+        line_state = dict(lines.get(data["line"], LINE_STATE))
+        for key in line_state.keys() & data.keys():
+            line_state[key] = data[key]
+        lines[data["line"]] = line_state
+        states = lines.values()
+        return {
+            **data,
+            "off_hook": any(state["off_hook"] for state in states),
+            "playing": next((state["playing"] for state in states if state["playing"]), None),
+            "recording": next((state["recording"] for state in states if state["recording"]), None),
+            "lines": lines,
+        }
+
+    def close(self):
+        self._server.close()
+        with self._lock:
+            for client in self._clients:
+                client.close()
+            self._clients = []
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class NullPublisher:
+    """Drops events; used when ``event_socket`` is not set."""
+
+    state = {}
+
+    def publish(self, event, **data):
+        pass
+
+    def close(self):
+        pass
+
+
+def create_publisher(config):
+    path = config.get("event_socket")
+    if not path:
+        return NullPublisher()
+    try:
+        return EventPublisher(path)
+    except OSError as e:
+        # Live updates are a nicety; never keep the guestbook from starting
+        logger.error(f"Cannot publish events on {path}: {e}")
+        return NullPublisher()
@@ -0,0 +1,181 @@
+"""GPIO input backends and edge debouncing for the audio guest book daemon.
+
+The daemon never polls pins in a loop. A backend delivers raw level changes
+(edges) to a callback as they happen, and a :class:`Debouncer` per input turns
+those timestamped edges into settled state changes. The debouncer is pure
+logic with no hardware or clock access, so it can be exercised off-device with
+:class:`FakeGpioBackend`.
+"""
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Raw pin levels. All inputs use the internal pull-up, so an idle (open) switch
+# reads HIGH and a switch closed to GND reads LOW.
+LOW = 0
+HIGH = 1
+
+
+class GpioBackend:
+    """Interface every GPIO backend implements.
+
+    ``watch()`` callbacks are invoked from the backend's own thread as
+    ``callback(pin, level, timestamp)`` where ``timestamp`` is
+    ``time.monotonic()`` at the moment the edge was seen.
+    """
+
+    def setup_input(self, pin):
+        raise NotImplementedError
+
+    def read(self, pin):
+        raise NotImplementedError
+
+    def watch(self, pin, callback):
+        raise NotImplementedError
+
+    def unwatch(self, pin):
+        """Stop calling the callbacks of ``pin``."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class GpioZeroBackend(GpioBackend):
+    """Edge-interrupt backend built on gpiozero (lgpio pin factory on Trixie)."""
+
+    def __init__(self):
+        from gpiozero import DigitalInputDevice
+
+        self._device_class = DigitalInputDevice
+        self._devices = {}
+
+    def setup_input(self, pin):
+        if pin not in self._devices:
+            # bounce_time is left unset: debouncing is done by Debouncer so it
+            # behaves identically on every backend.
+            self._devices[pin] = self._device_class(pin, pull_up=True)
+
+    def read(self, pin):
+        return HIGH if self._devices[pin].pin.state else LOW
+
+    def watch(self, pin, callback):
+        device = self._devices[pin]
+        # With pull_up=True the device is "active" when the pin is pulled LOW.
+        device.when_activated = lambda: callback(pin, LOW, time.monotonic())
+        device.when_deactivated = lambda: callback(pin, HIGH, time.monotonic())
+
+    def unwatch(self, pin):
+        device = self._devices.get(pin)
+        if device is not None:
+            device.when_activated = None
+            device.when_deactivated = None
+
+    def close(self):
+        for device in self._devices.values():
+            device.close()
+        self._devices.clear()
+
+
+class FakeGpioBackend(GpioBackend):
+    """In-memory backend for off-device runs.
+
+    Pins start HIGH (pull-up, switch open). ``set_level()`` changes a pin and
+    fires its watchers synchronously, like an interrupt would.
+    """
+
+    def __init__(self, initial_levels=None):
+        self._lock = threading.Lock()
+        self._levels = dict(initial_levels or {})
+        self._watchers = {}
+
+    def setup_input(self, pin):
+        with self._lock:
+            self._levels.setdefault(pin, HIGH)
+
+    def read(self, pin):
+        with self._lock:
+            return self._levels.get(pin, HIGH)
+
+    def watch(self, pin, callback):
+        with self._lock:
+            self._watchers.setdefault(pin, []).append(callback)
+
+    def unwatch(self, pin):
+        with self._lock:
+            self._watchers.pop(pin, None)
+
+    def set_level(self, pin, level, timestamp=None):
+        """Drive ``pin`` to ``level``; no-op if it is already there."""
+        with self._lock:
+            if self._levels.get(pin, HIGH) == level:
+                return
+            self._levels[pin] = level
+            watchers = list(self._watchers.get(pin, ()))
+        if timestamp is None:
+            timestamp = time.monotonic()
+        for callback in watchers:
+            callback(pin, level, timestamp)
+
+    def close(self):
+        with self._lock:
+            self._watchers.clear()
+
+
+def create_backend(config):
+    """Build the backend named by ``gpio_backend`` in the config."""
+    name = config.get("gpio_backend", "gpiozero")
+    if name == "gpiozero":
+        return GpioZeroBackend()
+    if name == "fake":
+        logger.warning("Using fake GPIO backend - no hardware inputs will be read")
+        return FakeGpioBackend()
+    raise ValueError(f"Unknown gpio_backend: {name}")
+
+
+class Debouncer:
+    """Timestamp-based debouncer for one input.
+
+    The first edge that differs from the settled level is accepted at once, so
+    reaction latency is only the interrupt latency. Further edges are ignored
+    for ``bounce_time`` seconds (the contact bounce window). When the window
+    closes, the last raw level seen is compared with the settled level again so
+    that a real change made during the window is not lost.
+
+    Feed edges with :meth:`feed`, and call :meth:`expire` once
+    :meth:`deadline` has passed. Both return the new settled level when the
+    settled state changes, otherwise ``None``.
+    """
+
+    def __init__(self, bounce_time, initial_level):
+        self.bounce_time = max(0.0, float(bounce_time or 0))
+        self.level = initial_level
+        self._raw = initial_level
+        self._locked_until = None
+
+    def feed(self, level, timestamp):
+        self._raw = level
+        if self._locked_until is not None and timestamp < self._locked_until:
+            return None
+        return self._settle(timestamp)
+
+    def deadline(self):
+        """Monotonic time at which :meth:`expire` must be called, or None."""
+        return self._locked_until
+
+    def expire(self, now):
+        if self._locked_until is None or now < self._locked_until:
+            return None
+        return self._settle(self._locked_until)
+
+    def _settle(self, timestamp):
+        self._locked_until = None
+        if self._raw == self.level:
+            return None
+        self.level = self._raw
+        if self.bounce_time > 0:
+            self._locked_until = timestamp + self.bounce_time
+        return self.level
@@ -0,0 +1,752 @@
+"""Phone lines: one handset each, several on one Pi.
+
+A :class:`PhoneLine` is everything one phone needs: its hook and record
+greeting inputs, its sound card (prompts and capture), its greeting, and
+the state of the call in progress. Each line runs its own hook loop on its
+own thread, so a guest on one phone never waits for a prompt playing on
+another.
+
+Without ``lines`` in the config there is one line built from the top-level
+settings, and recordings are named as they always were. With ``lines``,
+each entry is a line: ``name`` plus any of :data:`LINE_KEYS` overriding the
+top-level value. Recordings are then tagged with the line name
+(``<timestamp>_<line>.wav``, and a ``LINE`` comment in FLAC / Opus files),
+as are the events the web UI receives and the call traces.
+
+Daemon-wide parts (the GPIO backend, the shutdown button, the event
+publisher, the staging of takes, post-processing and the trace writer) are
+shared by all lines through :class:`Services`.
+"""
+
+import logging
+import queue
+import re
+import subprocess
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+from audio_engine import AudioEngine
+from call_trace import CallTrace
+from capture import WarmCapture, WarmRecording
+from config_reload import changed_groups, prompt_stamps
+from gpio_backend import HIGH, LOW, Debouncer
+from recording_writer import (
+    ENCODED_TYPES,
+    EncodedArecord,
+    create_writer,
+    encoder_command,
+    recording_suffix,
+)
+
+logger = logging.getLogger(__name__)
+
+# Settings a line may override; everything else is daemon-wide
+LINE_KEYS = (
+    "hook_gpio", "hook_type", "invert_hook", "hook_bounce_time",
+    "record_greeting_gpio", "record_greeting_type", "record_greeting_bounce_time",
+    "alsa_hw_mapping", "audio_sink", "audio_sink_path", "format", "sample_rate", "channels",
+    "greeting", "greeting_volume", "beep", "beep_volume", "time_exceeded", "time_exceeded_volume",
+    "greeting_start_delay", "beep_start_delay", "recording_limit",
+    "capture_mode", "capture_source", "recording_preroll",
+)
+
+# Line names end up in file names, after an underscore
+LINE_NAME_RE = re.compile(r"^[A-Za-z0-9-]+$")
+
+# Groups (see config_reload.RELOAD_GROUPS) a line rebuilds itself
+LINE_GROUPS = ("gpio", "audio", "prompts", "capture")
+
+# Queue markers for the line's loop
+RELOAD = object()
+PLAYED = object()
+STOP = object()
+
+# States of a line
+IDLE = "idle"                          # on hook, nothing going on
+DELAY = "delay"                        # lifted, waiting greeting_start_delay
+GREETING = "greeting"                  # playing the greeting
+BEEP = "beep"                          # waiting beep_start_delay, then playing the beep
+RECORDING = "recording"                # recording the guest, until hang-up or recording_limit
+EXCEEDED = "exceeded"                  # recording cut off, time_exceeded playing / waiting for hang-up
+GREETING_CAPTURE = "greeting_capture"  # record button held: beep, then recording the greeting
+
+
+def line_configs(config):
+    """``[(name, line_config)]`` for the lines in ``config``.
+
+    The name is None for the single line of a config without ``lines``.
+    Raises ValueError for a bad ``lines`` section.
+    """
+    entries = config.get("lines") or []
+    if not entries:
+        return [(None, dict(config))]
+    if not isinstance(entries, list):
+        raise ValueError("lines must be a list")
+
+    lines = []
+    pins = {}
+    for number, entry in enumerate(entries, 1):
+        if not isinstance(entry, dict):
+            raise ValueError(f"lines entry {number} is not a mapping")
+        name = str(entry.get("name", f"line{number}"))
+        if not LINE_NAME_RE.match(name):
+            raise ValueError(f"Line name {name!r} may only use letters, digits and '-'")
+        if any(name == other for other, _ in lines):
+            raise ValueError(f"Duplicate line name: {name}")
+        unknown = set(entry) - set(LINE_KEYS) - {"name"}
+        if unknown:
+            logger.warning(f"Line {name}: ignoring settings that cannot be set per line: "
+                           f"{', '.join(sorted(unknown))}")
+        line_config = {key: value for key, value in config.items() if key != "lines"}
+        line_config.update({key: entry[key] for key in LINE_KEYS if key in entry})
+        for key in ("hook_gpio", "record_greeting_gpio"):
+            pin = line_config.get(key, 0)
+            if not pin:
+                continue
+            if pin in pins:
+                raise ValueError(f"GPIO {pin} is used by both {pins[pin]} and {name}")
+            pins[pin] = name
+        lines.append((name, line_config))
+
+    shutdown_pin = config.get("shutdown_gpio", 0)
+    if shutdown_pin and shutdown_pin in pins:
+        raise ValueError(f"GPIO {shutdown_pin} is both the shutdown button and an input of {pins[shutdown_pin]}")
+    return lines
+
+
+def is_on_hook(state, hook_type, invert_hook):
+    """
+    Determine if handset is on-hook based on a raw GPIO level and configuration.
+
+    For NC (Normally Closed) with pull-up:
+      - When on-hook: circuit closed, GPIO pulled to GND → reads LOW
+      - When off-hook: circuit open, pull-up resistor → reads HIGH
+      - Therefore: HIGH = on-hook, LOW = off-hook
+
+    Actually, based on working simple implementation:
+      - NC: HIGH = on-hook, LOW = off-hook (handset down = high)
+
+    For NO (Normally Open):
+      - When on-hook: circuit open → reads HIGH (with pull-up)
+      - When off-hook: circuit closed → reads LOW
+      - Therefore: LOW = on-hook, HIGH = off-hook
+
+    invert_hook flips the logic.
+    """
+    if hook_type == "NC":
+        # NC: HIGH = on-hook, LOW = off-hook (based on working simple implementation)
+        on_hook = (state == HIGH)
+    else:  # NO
+        # NO: LOW = on-hook, HIGH = off-hook
+        on_hook = (state == LOW)
+
+    if invert_hook:
+        on_hook = not on_hook
+
+    return on_hook
+
+
+def start_recording(config, capture=None, line=None, stager=None):
+    """
+    Start a guest recording.
+    With a warm capture the already-running input stream (and its pre-roll)
+    is written to the file; otherwise an arecord process is started.
+    flac/opus file types are encoded while recording.
+    With a stager the take is recorded to its staged path (see staging.py).
+    Returns the process (or Popen-like wrapper), the output path and the
+    path actually written to.
+    """
+    timestamp = datetime.now().isoformat()
+    recordings_path = Path(config['recordings_path'])
+    recordings_path.mkdir(exist_ok=True)
+
+    file_type = config.get('file_type', 'wav')
+    tag = f"_{line}" if line else ""
+    out_file = recordings_path / f"{timestamp}{tag}{recording_suffix(file_type)}"
+    write_file = stager.staged_path(out_file) if stager else out_file
+    logger.info(f"Recording to: {out_file.name}")
+    tags = {"LINE": line} if line else None
+
+    if capture is not None:
+        writer = create_writer(config, write_file, capture.rate, capture.channels, tags)
+        return WarmRecording(capture, writer), out_file, write_file
+
+    arecord_cmd = [
+        "arecord", "-q",
+        "-f", config['format'],
+        "-t", "raw" if file_type in ENCODED_TYPES else file_type,
+        "-D", config['alsa_hw_mapping'],
+        "-r", str(config['sample_rate']),
+        "-c", str(config['channels']),
+    ]
+    if file_type in ENCODED_TYPES:
+        # The encoders expect 16-bit input, which every arecord format we
+        # ship ('cd', 'dat', 'S16_LE') produces
+        return EncodedArecord(
+            arecord_cmd,
+            encoder_command(file_type, write_file, config['sample_rate'], config['channels'], config, tags)
+        ), out_file, write_file
+
+    proc = subprocess.Popen(arecord_cmd + [str(write_file)])
+    return proc, out_file, write_file
+
+
+def start_recording_greeting(config):
+    """Start arecord process for recording greeting message."""
+    greeting_path = Path(config['greeting'])
+    greeting_path.parent.mkdir(exist_ok=True)
+
+    logger.info(f"Recording greeting to: {greeting_path.name}")
+
+    # Always WAV: the audio engine decodes the greeting with the wave module
+    proc = subprocess.Popen([
+        "arecord", "-q",
+        "-f", config['format'],
+        "-t", "wav",
+        "-D", config['alsa_hw_mapping'],
+        "-r", str(config['sample_rate']),
+        "-c", str(config['channels']),
+        str(greeting_path)
+    ])
+    return proc
+
+
+def stop_recording(proc, name="recording"):
+    """Stop an arecord process if running, and wait until its file is closed.
+
+    arecord gets 2 seconds to exit before it is killed. An encoder behind it
+    (EncodedArecord) is then waited for until it has finished the file, and
+    a warm-capture writer until it has drained. This blocks: guest takes are
+    stopped on the stager's worker (see PhoneLine.finish_recording).
+    """
+    if proc and proc.poll() is None:
+        logger.info(f"Stopping {name}")
+        proc.terminate()
+        try:
+            proc.wait(timeout=2)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+
+
+def next_timeout(deadlines):
+    """Seconds until the earliest of the given monotonic deadlines, or None."""
+    pending = [d for d in deadlines if d is not None]
+    if not pending:
+        return None
+    return max(0.0, min(pending) - time.monotonic())
+
+
+class Services:
+    """Daemon-wide components the lines share.
+
+    The daemon replaces attributes on reload; lines look them up on every
+    use, so they always get the current ones.
+    """
+
+    def __init__(self, backend, events, stager, postprocessor, tracer):
+        self.backend = backend
+        self.events = events
+        self.stager = stager
+        self.postprocessor = postprocessor
+        self.tracer = tracer
+
+
+class PhoneLine:
+    """One handset and its sound card, run on its own thread.
+
+    The call is an explicit state machine (see the state constants). The
+    line's loop only ever waits on its queue, with a timeout for the next
+    timer: edges, finished prompts (played on the audio engine's player
+    thread) and reloads all arrive on the queue, and the greeting delay, the
+    beep delay and the recording limit are deadlines. Every input is
+    therefore handled within one loop step in every state, including while
+    a prompt is playing.
+    """
+
+    def __init__(self, name, config, services):
+        self.name = name
+        self.config = config
+        self.services = services
+        self.label = f"[{name}] " if name else ""
+        self._queue = queue.Queue()
+        self._stopping = threading.Event()
+        # Held by the loop while it handles what it was woken for
+        self._busy = threading.Lock()
+        self._thread = None
+        self.engine = None
+        self.capture = None
+        self.debouncers = {}
+        self.hook_pin = self.hook_type = self.invert_hook = self.greeting_pin = None
+        self.has_record_greeting = False
+        self.pending = set()
+        self.stamps = prompt_stamps(config)
+        # The call in progress
+        self.state = IDLE
+        self.timer_at = None
+        self.playback = None
+        self.recording_proc = None
+        self.recording_start_ts = None
+        self.recording_file = None
+        self.recording_staged = None
+        self.record_greeting_proc = None
+        self.trace = None
+
+    # ----- lifecycle (called from the daemon's main thread) -----
+
+    def start(self):
+        """Open the sound card, watch the inputs and start the hook loop."""
+        # Decode the prompts once; playback then never touches the filesystem
+        self.engine = AudioEngine.from_config(self.config)
+        self.capture = self.create_capture()
+        self.setup_inputs()
+        self._thread = threading.Thread(
+            target=self._run, name=f"line-{self.name}" if self.name else "line", daemon=True
+        )
+        self._thread.start()
+
+    def is_alive(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def reload(self, config):
+        """Hand a reloaded line config to the loop; applied when idle."""
+        self._queue.put((RELOAD, config))
+
+    def pause(self):
+        """Hold the loop between two steps, if it is not busy; returns whether it is held.
+
+        While held, the daemon may replace shared services and call
+        setup_inputs(). Edges queue up and are handled on resume().
+        """
+        return self._busy.acquire(blocking=False)
+
+    def resume(self):
+        self._busy.release()
+
+    def stop(self):
+        """End the call in progress and wait for the loop to exit."""
+        self._stopping.set()
+        self._queue.put(STOP)
+        if self._thread is None:
+            self._close()  # start() failed part way
+        else:
+            self._thread.join(timeout=10)
+
+    # ----- helpers -----
+
+    def publish(self, event, **data):
+        if self.name:
+            data["line"] = self.name
+        self.services.events.publish(event, **data)
+
+    def log(self, level, message):
+        logger.log(level, f"{self.label}{message}")
+
+    def create_capture(self):
+        # In warm mode the input stream is opened on lift, not after the beep
+        if self.config.get('capture_mode', 'arecord') == 'warm':
+            return WarmCapture.from_config(self.config)
+        return None
+
+    def on_edge(self, pin, level, timestamp):
+        self._queue.put((pin, level, timestamp))
+
+    def watch_input(self, pin, bounce_time):
+        backend = self.services.backend
+        backend.setup_input(pin)
+        backend.watch(pin, self.on_edge)
+        # Read the initial level only after the watch is armed so no edge
+        # can slip in between.
+        return Debouncer(bounce_time, backend.read(pin))
+
+    def setup_inputs(self):
+        """Read the input settings and watch the pins (again, after a reload)."""
+        for pin in self.debouncers:
+            self.services.backend.unwatch(pin)
+        self.debouncers.clear()
+        config = self.config
+
+        # Get hook configuration
+        self.hook_pin = config['hook_gpio']
+        self.hook_type = config.get('hook_type', 'NC')
+        self.invert_hook = config.get('invert_hook', False)
+        hook_bounce_time = config.get('hook_bounce_time', 0.1)  # Default 0.1s
+
+        # Hook GPIO (handset)
+        self.debouncers[self.hook_pin] = self.watch_input(self.hook_pin, hook_bounce_time)
+
+        # Record greeting button (optional)
+        self.greeting_pin = config.get('record_greeting_gpio', 0)
+        self.has_record_greeting = self.greeting_pin != 0
+        if self.has_record_greeting:
+            self.debouncers[self.greeting_pin] = self.watch_input(
+                self.greeting_pin, config.get('record_greeting_bounce_time', 0.1)
+            )
+
+    def hook_is_on(self):
+        return is_on_hook(self.services.backend.read(self.hook_pin), self.hook_type, self.invert_hook)
+
+    def greeting_button_released(self):
+        greeting_type = self.config.get('record_greeting_type', 'NC')
+        return is_on_hook(self.services.backend.read(self.greeting_pin), greeting_type, False)
+
+    def is_idle(self):
+        return self.state == IDLE and self.hook_is_on()
+
+    def enter(self, state, timer_at=None):
+        """Switch to ``state``; ``timer_at`` is its deadline (monotonic), if any."""
+        if state != self.state:
+            self.log(logging.DEBUG, f"{self.state} -> {state}")
+        self.state = state
+        self.timer_at = timer_at
+
+    def play(self, prompt, interrupted):
+        """Start ``prompt``; the loop hears back with PLAYED when it ends.
+
+        ``interrupted`` reads the raw pin level, so a hang-up stops the
+        prompt within one period, before the edge is even debounced.
+        """
+        self.publish('playback_started', playing=prompt)
+        self.playback = self.engine.start(
+            prompt, interrupted, lambda playback: self._queue.put((PLAYED, playback))
+        )
+
+    def stop_playback(self):
+        if self.playback is None:
+            return
+        playback, self.playback = self.playback, None
+        self.engine.stop()
+        self.publish('playback_finished', playing=None, prompt=playback.name, completed=False)
+
+    def end_trace(self, outcome):
+        if self.trace is None:
+            return
+        self.trace.outcome = outcome
+        tracer = self.services.tracer
+        if tracer:
+            tracer.write(self.trace)
+        self.trace = None
+
+    def finish_recording(self, outcome='recorded'):
+        proc = self.recording_proc
+        if proc and proc.poll() is None:
+            # Only stop capturing here: waiting for the encoder or the writer
+            # to finish the file happens on the stager's worker, so the next
+            # edge is handled straight away
+            proc.terminate()
+        trace, self.trace = self.trace, None
+        if trace is not None:
+            trace.outcome = outcome
+            if self.capture and self.capture.first_frame_at is not None:
+                trace.mark('first_captured_frame', self.capture.first_frame_at)
+        tracer = self.services.tracer
+
+        def finish():
+            stop_recording(proc)
+            if trace is not None:
+                trace.mark('file_closed')
+                if tracer:
+                    tracer.write(trace)
+
+        recording_file = self.recording_file
+        if recording_file:
+            self.publish(
+                'recording_stopped', recording=None, name=recording_file.name,
+                duration=round(time.monotonic() - self.recording_start_ts, 2)
+            )
+            # The take shows up under its own name (and is post-processed)
+            # once it is closed and the stager has moved it into place
+            self.services.stager.commit(
+                self.recording_staged, recording_file, self.committed, finish=finish
+            )
+        else:
+            finish()
+        self.recording_proc = None
+        self.recording_start_ts = None
+        self.recording_file = None
+        self.recording_staged = None
+
+    def committed(self, recording_file):
+        """Called from the stager's worker once ``recording_file`` is in place."""
+        self.publish('file_created', name=recording_file.name, size=recording_file.stat().st_size)
+        postprocessor = self.services.postprocessor
+        if postprocessor:
+            postprocessor.submit(recording_file)
+
+    # ----- config reloads -----
+
+    def _reload(self, new_config):
+        changed = changed_groups(self.config, new_config) & set(LINE_GROUPS)
+        new_stamps = prompt_stamps(new_config)
+        if new_stamps != self.stamps:
+            changed.add('prompts')
+        self.stamps = new_stamps
+        self.config.clear()
+        self.config.update(new_config)
+        self.pending.update(changed)
+
+    def apply_pending(self):
+        """Rebuild what the last reloads changed; only called while idle."""
+        applied = []
+        for group in LINE_GROUPS:
+            if group not in self.pending:
+                continue
+            try:
+                if group == 'gpio':
+                    self.setup_inputs()
+                elif group == 'audio':
+                    new_engine = AudioEngine.from_config(self.config)
+                    self.engine.close()
+                    self.engine = new_engine
+                    self.pending.discard('prompts')  # loaded by from_config
+                elif group == 'prompts':
+                    self.engine.load_prompts(self.config)
+                elif group == 'capture':
+                    new_capture = self.create_capture()
+                    if self.capture:
+                        self.capture.disarm()
+                    self.capture = new_capture
+                applied.append(group)
+            except Exception as e:
+                self.log(logging.ERROR, f"Could not re-apply {group} settings, keeping the old ones: {e}")
+        self.pending.clear()
+        if applied:
+            self.log(logging.INFO, f"Re-applied: {', '.join(applied)}")
+            self.publish('config_reloaded', applied=applied)
+
+    # ----- the event loop -----
+
+    def _run(self):
+        try:
+            self._loop()
+        except Exception:
+            logger.exception(f"{self.label}Hook loop failed")
+        finally:
+            self._close()
+
+    def _close(self):
+        if self.engine:
+            self.engine.close()
+            self.engine = None
+        if self.recording_proc:
+            # Keep the take: it is committed before the daemon exits
+            self.finish_recording()
+        stop_recording(self.record_greeting_proc, "greeting recording")
+        if self.capture:
+            self.capture.disarm()
+
+    def _loop(self):
+        while not self._stopping.is_set():
+            with self._busy:
+                deadlines = [d.deadline() for d in self.debouncers.values()]
+                deadlines.append(self.timer_at)
+
+            # Block until an edge, a finished prompt or a reload arrives, or
+            # the next timer is due
+            try:
+                item = self._queue.get(timeout=next_timeout(deadlines))
+            except queue.Empty:
+                item = None
+            with self._busy:
+                if not self._step(item):
+                    return
+
+    def _step(self, item):
+        """Handle ``item`` and whatever else is due; False once stopped."""
+        events = []
+        # Take everything that queued up, so bounce windows close on the
+        # right level
+        while item is not None:
+            if item is STOP:
+                return False
+            if item[0] is RELOAD:
+                self._reload(item[1])
+            elif item[0] is PLAYED:
+                events.append(item)
+            elif item[0] in self.debouncers:
+                # (edges from pins dropped by a reload are ignored)
+                pin, level, timestamp = item
+                debouncer = self.debouncers[pin]
+                # A bounce window that ended before this edge settles first
+                window_edge_at = debouncer.deadline()
+                settled = debouncer.expire(timestamp)
+                if settled is not None:
+                    events.append((pin, settled, window_edge_at))
+                settled = debouncer.feed(level, timestamp)
+                if settled is not None:
+                    events.append((pin, settled, timestamp))
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                item = None
+
+        now = time.monotonic()
+        for pin, debouncer in self.debouncers.items():
+            # (the edge was within the bounce window that just closed)
+            edge_at = debouncer.deadline()
+            settled = debouncer.expire(now)
+            if settled is not None:
+                events.append((pin, settled, edge_at))
+
+        for event in events:
+            if event[0] is PLAYED:
+                self.on_played(event[1])
+            elif event[0] == self.hook_pin:
+                self.on_hook_change(*event[1:])
+            elif self.has_record_greeting and event[0] == self.greeting_pin:
+                self.on_greeting_button(event[1])
+
+        if self.timer_at is not None and time.monotonic() >= self.timer_at:
+            self.timer_at = None
+            self.on_timer()
+
+        # Rebuild components for reloaded settings between calls
+        if self.pending and self.is_idle():
+            self.apply_pending()
+        return True
+
+    # ----- transitions -----
+
+    def on_hook_change(self, level, edge_at):
+        currently_on_hook = is_on_hook(level, self.hook_type, self.invert_hook)
+        self.publish('hook', off_hook=not currently_on_hook)
+        if self.state == GREETING_CAPTURE:
+            # The call starts once the greeting is saved (see on_greeting_button)
+            return
+
+        # OFF-HOOK: User lifted handset
+        if not currently_on_hook:
+            self.log(logging.INFO, "\n[OFF-HOOK] Handset lifted")
+            self.start_call(edge_at)
+
+        # ON-HOOK: User replaced handset
+        else:
+            self.log(logging.INFO, "[ON-HOOK] Handset replaced")
+            if self.state == DELAY:
+                self.log(logging.INFO, "Handset replaced during delay - aborting")
+            self.stop_playback()
+            if self.trace is not None:
+                self.trace.mark('on_hook', edge_at)
+            if self.recording_proc:
+                self.finish_recording()
+            self.end_trace('abandoned')
+            if self.capture:
+                self.capture.disarm()
+            self.enter(IDLE)
+
+    def start_call(self, edge_at):
+        self.stop_playback()
+        self.end_trace('abandoned')
+        self.trace = CallTrace(edge_at, self.name)
+        self.trace.mark('debounce_settled')
+        if self.capture:
+            self.capture.arm()
+
+        # Greeting start delay
+        delay = self.config.get('greeting_start_delay', 0)
+        if delay > 0:
+            self.log(logging.INFO, f"Waiting {delay}s before greeting...")
+            self.enter(DELAY, time.monotonic() + delay)
+        else:
+            self.start_greeting()
+
+    def start_greeting(self):
+        self.trace.mark('greeting_delay_end')
+        self.enter(GREETING)
+        self.play('greeting', self.hook_is_on)
+
+    def start_beep(self):
+        # Beep delay
+        beep_delay = self.config.get('beep_start_delay', 0)
+        if beep_delay > 0:
+            self.enter(BEEP, time.monotonic() + beep_delay)
+        else:
+            self.enter(BEEP)
+            self.play('beep', self.hook_is_on)
+
+    def start_call_recording(self):
+        # Only if still off-hook: a hang-up not debounced yet ends the call next
+        if self.hook_is_on() or self.recording_proc is not None:
+            return
+        self.recording_proc, self.recording_file, self.recording_staged = start_recording(
+            self.config, self.capture, self.name, self.services.stager
+        )
+        self.recording_start_ts = time.monotonic()
+        self.trace.mark('capture_started', self.recording_start_ts)
+        self.trace.recording = self.recording_file.name
+        self.publish('recording_started', recording=self.recording_file.name)
+        self.enter(RECORDING, self.recording_start_ts + self.config['recording_limit'])
+
+    def on_played(self, playback):
+        if playback is not self.playback:
+            return  # cancelled, its end was already reported
+        self.playback = None
+        self.publish(
+            'playback_finished', playing=None, prompt=playback.name, completed=playback.completed
+        )
+
+        if self.state == GREETING:
+            started_at = self.engine.last_started_at
+            if started_at is not None and started_at >= self.trace.events['edge_detected']:
+                self.trace.mark('greeting_first_sample', started_at)
+            # Interrupted: the hang-up edge ends the call
+            if playback.completed:
+                self.start_beep()
+
+        elif self.state == BEEP:
+            if playback.completed:
+                self.trace.mark('beep_end')
+                self.start_call_recording()
+
+        elif self.state == GREETING_CAPTURE:
+            # Beep played while the record button is held: start recording
+            if playback.completed and self.record_greeting_proc is None:
+                self.record_greeting_proc = start_recording_greeting(self.config)
+                self.publish('greeting_recording_started')
+
+    def on_timer(self):
+        if self.state == DELAY:
+            self.start_greeting()
+
+        elif self.state == BEEP:
+            self.play('beep', self.hook_is_on)
+
+        # Max recording duration
+        elif self.state == RECORDING:
+            self.log(logging.WARNING,
+                     f"[TIME EXCEEDED] Max recording time {self.config['recording_limit']}s reached")
+            self.publish('time_exceeded')
+            self.finish_recording('time_exceeded')
+            # Play time exceeded message (interruptible), then wait for the hang-up
+            self.enter(EXCEEDED)
+            self.play('time_exceeded', self.hook_is_on)
+
+    def on_greeting_button(self, level):
+        # Button pressed (HIGH -> LOW for NC)
+        if level == LOW:
+            if self.state != IDLE:
+                self.log(logging.INFO, "[RECORD GREETING] Button pressed during a call - ignored")
+                return
+            self.log(logging.INFO, "\n[RECORD GREETING] Button pressed - recording new greeting")
+            # Play beep to indicate recording start, interrupted if the
+            # record button is let go
+            self.enter(GREETING_CAPTURE)
+            self.play('beep', self.greeting_button_released)
+
+        # Button released (LOW -> HIGH for NC)
+        elif self.state == GREETING_CAPTURE:
+            self.log(logging.INFO, "[RECORD GREETING] Button released - saving greeting")
+            self.stop_playback()
+            if self.record_greeting_proc:
+                stop_recording(self.record_greeting_proc, "greeting recording")
+                self.record_greeting_proc = None
+                self.publish('greeting_recording_stopped')
+                # Pick up the new greeting for the next call
+                self.engine.load('greeting', self.config['greeting'], self.config['greeting_volume'])
+            self.enter(IDLE)
+            # A guest who lifted the handset meanwhile gets the call now
+            if not self.hook_is_on():
+                self.log(logging.INFO, "\n[OFF-HOOK] Handset lifted")
+                self.start_call(time.monotonic())
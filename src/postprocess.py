@@ -0,0 +1,280 @@
+"""Post-processing of finished recordings.
+
+When ``postprocess`` is enabled the daemon hands every finished WAV recording
+to a :class:`PostProcessor`, which queues it on a small process pool running
+at the lowest CPU priority. The hook loop only submits a job; the work never
+runs on its thread.
+
+Each job streams through the take in blocks of ``BLOCK_SECONDS``, vectorized
+with NumPy, so its memory use does not grow with the length of the take:
+
+1. cuts ``postprocess_tail_trim`` seconds from the end (the clunk of the
+   handset going down),
+2. removes the DC offset of each channel,
+3. trims leading and trailing silence below ``postprocess_silence_db``
+   (keeping ``postprocess_trim_padding`` seconds either side), and
+4. normalizes the RMS level of the non-silent parts to
+   ``postprocess_target_db``, without letting peaks exceed
+   ``postprocess_peak_db``.
+
+The result is written next to the original and renamed over it, so the
+recordings folder never holds a half-written take. Queue depth and job
+times are written to ``cache_path/postprocess.json`` for the web UI.
+"""
+
+import collections
+import json
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+import wave
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from audio_engine import _pcm_to_float
+
+logger = logging.getLogger(__name__)
+
+# Level analysis window
+WINDOW_SECONDS = 0.02
+
+# Audio converted to float at once; bounds a job's memory whatever the take's length
+BLOCK_SECONDS = 10.0
+
+# Never boost a quiet take by more than this, or room noise comes up with it
+MAX_GAIN_DB = 24.0
+
+# Finished jobs kept in the status file
+RECENT_JOBS = 20
+
+
+def _float_to_pcm(samples, width):
+    """Inverse of ``_pcm_to_float``: floats in [-1, 1] to PCM bytes."""
+    if width == 1:
+        return (np.clip(np.round(samples * 128) + 128, 0, 255)).astype(np.uint8).tobytes()
+    if width == 2:
+        return np.clip(np.round(samples * 32768), -32768, 32767).astype("<i2").tobytes()
+    if width == 3:
+        ints = np.clip(np.round(samples * 8388608), -8388608, 8388607).astype("<i4")
+        return ints.view(np.uint8).reshape(-1, 4)[:, :3].tobytes()
+    if width == 4:
+        ints = np.clip(np.round(samples.astype(np.float64) * 2147483648), -2147483648, 2147483647)
+        return ints.astype("<i4").tobytes()
+    raise ValueError(f"Unsupported sample width: {width}")
+
+
+def _db(value):
+    return 20 * np.log10(np.maximum(value, 1e-10))
+
+
+def _blocks(wf, channels, width, start, end, block):
+    """Float samples of frames ``start:end`` of an open WAV, ``block`` frames at a time."""
+    wf.setpos(start)
+    while start < end:
+        count = min(block, end - start)
+        raw = wf.readframes(count)
+        if not raw:
+            return
+        samples = _pcm_to_float(raw, width).reshape(-1, channels)
+        start += len(samples)
+        yield samples
+
+
+def process_wav(path, options):
+    """Trim, de-offset and normalize the WAV at ``path`` in place.
+
+    Returns a dict describing what was done. Takes with no sound above the
+    silence threshold are left untouched.
+
+    The take is read three times, a block at a time: once for the DC
+    offset and the level of every analysis window (from per-window sums and
+    sums of squares), once over the kept part for its peak, and once to
+    write the result.
+    """
+    path = Path(path)
+    with wave.open(str(path), "rb") as wf:
+        params = wf.getparams()
+        rate, channels, width = params.framerate, params.nchannels, params.sampwidth
+        original_frames = wf.getnframes()
+        frames = max(0, original_frames - int(options["tail_trim"] * rate))
+
+        # Blocks hold whole analysis windows, so windows never straddle them
+        window = max(1, int(WINDOW_SECONDS * rate))
+        block = max(1, int(BLOCK_SECONDS * rate) // window) * window
+        windows = frames // window
+        sums = np.zeros((windows, channels))
+        squares = np.zeros((windows, channels))
+        total = np.zeros(channels)
+        done = 0
+        for samples in _blocks(wf, channels, width, 0, frames, block):
+            total += samples.sum(axis=0, dtype=np.float64)
+            whole = min(len(samples) // window, windows - done)
+            shaped = samples[:whole * window].reshape(whole, window, channels)
+            sums[done:done + whole] = shaped.sum(axis=1, dtype=np.float64)
+            squares[done:done + whole] = np.square(shaped).sum(axis=1, dtype=np.float64)
+            done += whole
+        mean = total / frames if frames else total
+
+        # RMS per analysis window, all channels together, without the DC offset
+        energy = (squares - 2 * mean * sums + window * np.square(mean)).sum(axis=1)
+        levels = np.sqrt(np.maximum(energy, 0) / (window * channels))
+        active = _db(levels) > options["silence_db"]
+        if not active.any():
+            return {"frames": original_frames, "kept_frames": original_frames, "gain_db": 0.0,
+                    "silent": True}
+
+        padding = int(options["trim_padding"] * rate)
+        first = int(np.argmax(active))
+        last = windows - 1 - int(np.argmax(active[::-1]))
+        start = max(0, first * window - padding)
+        end = min(frames, (last + 1) * window + padding)
+        mean = mean.astype(np.float32)
+
+        speech_rms = np.sqrt(np.mean(np.square(levels[active])))
+        peak = 0.0
+        for samples in _blocks(wf, channels, width, start, end, block):
+            peak = max(peak, float(np.abs(samples - mean).max()))
+        gain_db = min(
+            options["target_db"] - _db(speech_rms),
+            options["peak_db"] - _db(peak),
+            MAX_GAIN_DB,
+        )
+        gain = np.float32(10 ** (gain_db / 20))
+
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".", suffix=".tmp")
+        try:
+            # mkstemp creates the file 0600; keep the recording's permissions
+            os.fchmod(fd, path.stat().st_mode & 0o777)
+            with os.fdopen(fd, "wb") as f:
+                with wave.open(f, "wb") as out:
+                    out.setparams(params)
+                    for samples in _blocks(wf, channels, width, start, end, block):
+                        samples -= mean
+                        samples *= gain
+                        out.writeframesraw(_float_to_pcm(samples, width))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+    return {"frames": original_frames, "kept_frames": end - start,
+            "gain_db": round(float(gain_db), 2), "silent": False}
+
+
+def process_recording(path, options):
+    """Pool entry point: process one recording and time it."""
+    started = time.monotonic()
+    result = process_wav(path, options)
+    result["seconds"] = round(time.monotonic() - started, 3)
+    return result
+
+
+def _lower_priority():
+    os.nice(19)
+
+
+class PostProcessor:
+    """Queues finished recordings onto a low-priority process pool."""
+
+    def __init__(self, options, workers=1, status_path=None):
+        self.options = options
+        self.status_path = Path(status_path) if status_path else None
+        # forkserver: workers are not forked from the daemon's GPIO and
+        # audio threads
+        self._pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("forkserver"),
+            initializer=_lower_priority,
+        )
+        # Start the workers now; the first submit would otherwise pay for
+        # starting the fork server on the hook loop
+        self._pool.submit(os.getpid)
+        self._lock = threading.RLock()
+        self._queued = {}
+        self._recent = collections.deque(maxlen=RECENT_JOBS)
+        self._completed = 0
+        self._failed = 0
+        self._total_seconds = 0.0
+
+    @classmethod
+    def from_config(cls, config):
+        """Return a PostProcessor, or None if post-processing is disabled."""
+        if not config.get("postprocess", False):
+            return None
+        options = {
+            "tail_trim": float(config.get("postprocess_tail_trim", 0.3)),
+            "silence_db": float(config.get("postprocess_silence_db", -45)),
+            "trim_padding": float(config.get("postprocess_trim_padding", 0.25)),
+            "target_db": float(config.get("postprocess_target_db", -20)),
+            "peak_db": float(config.get("postprocess_peak_db", -1)),
+        }
+        status_path = Path(config.get("cache_path", "cache")) / "postprocess.json"
+        return cls(options, int(config.get("postprocess_workers", 1)), status_path)
+
+    def submit(self, path):
+        """Queue ``path`` for processing; returns immediately."""
+        path = Path(path)
+        if path.suffix.lower() != ".wav":
+            logger.info(f"Not post-processing {path.name}: only WAV recordings are processed")
+            return
+        with self._lock:
+            self._queued[path.name] = time.time()
+        future = self._pool.submit(process_recording, str(path), self.options)
+        future.add_done_callback(lambda f: self._finished(path.name, f))
+        self._write_status()
+
+    def _finished(self, name, future):
+        finished_at = time.time()
+        job = {"name": name, "finished_at": finished_at}
+        try:
+            job.update(future.result())
+            logger.info(
+                f"Post-processed {name} in {job['seconds']}s "
+                f"(gain {job['gain_db']} dB, {job['kept_frames']}/{job['frames']} frames kept)"
+            )
+        except Exception as e:
+            job["error"] = str(e)
+            logger.error(f"Post-processing {name} failed: {e}")
+        with self._lock:
+            job["waited"] = round(finished_at - self._queued.pop(name, finished_at) - job.get("seconds", 0), 3)
+            self._recent.appendleft(job)
+            if "error" in job:
+                self._failed += 1
+            else:
+                self._completed += 1
+                self._total_seconds += job["seconds"]
+        self._write_status()
+
+    def status(self):
+        """Queue depth (queued or running), counts and recent job times."""
+        with self._lock:
+            return {
+                "queued": len(self._queued),
+                "completed": self._completed,
+                "failed": self._failed,
+                "mean_seconds": round(self._total_seconds / self._completed, 3) if self._completed else None,
+                "recent": list(self._recent),
+                "updated_at": time.time(),
+            }
+
+    def _write_status(self):
+        if self.status_path is None:
+            return
+        try:
+            with self._lock:
+                self.status_path.parent.mkdir(parents=True, exist_ok=True)
+                tmp = self.status_path.with_suffix(".tmp")
+                tmp.write_text(json.dumps(self.status()))
+                os.replace(tmp, self.status_path)
+        except OSError as e:
+            logger.warning(f"Could not write post-processing status: {e}")
+
+    def close(self):
+        """Finish queued jobs and stop the pool."""
+        self._pool.shutdown(wait=True)
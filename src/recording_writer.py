@@ -0,0 +1,222 @@
+"""Writers that turn captured PCM into recording files.
+
+``wav`` recordings are written directly. ``flac`` and ``opus`` recordings are
+encoded while capturing by piping raw PCM into the ``flac`` / ``opusenc``
+command line encoders. In warm capture mode every writer is wrapped in a
+:class:`ThreadedWriter`, so a slow SD card or encoder never stalls capture.
+WAV headers can be kept current while recording (``wav_header_interval``),
+so a power cut does not leave a file that claims to be empty.
+"""
+
+import logging
+import queue
+import subprocess
+import threading
+import wave
+
+from wav_repair import HeaderSync
+
+logger = logging.getLogger(__name__)
+
+# file_type values that are encoded while recording
+ENCODED_TYPES = ("flac", "opus")
+
+# Seconds an encoder gets to finish the file once its input has ended;
+# writing the last blocks and the header can be slow on a loaded Pi Zero
+ENCODER_TIMEOUT = 30
+
+# Periods queued for a writer before it is reported as falling behind
+# (about 20 s of audio at 1024 frames per period)
+BACKLOG_WARN_PERIODS = 1000
+
+
+def recording_suffix(file_type):
+    """File extension used for recordings of the given ``file_type``."""
+    return f".{file_type}"
+
+
+def encoder_command(file_type, path, rate, channels, config, tags=None):
+    """Command line for an encoder reading raw S16_LE PCM on stdin.
+
+    ``tags`` ({field: value}) are written as Vorbis comments.
+    """
+    comments = [f"{field}={value}" for field, value in (tags or {}).items()]
+    if file_type == "flac":
+        return [
+            "flac", "--silent", "--force", f"-{int(config.get('flac_compression', 5))}",
+            "--force-raw-format", "--endian=little", "--sign=signed",
+            "--bps=16", f"--channels={channels}", f"--sample-rate={rate}",
+            *(f"--tag={comment}" for comment in comments),
+            "-o", str(path), "-",
+        ]
+    if file_type == "opus":
+        return [
+            "opusenc", "--quiet",
+            "--raw", "--raw-bits", "16", "--raw-rate", str(rate), "--raw-chan", str(channels),
+            "--bitrate", str(config.get("opus_bitrate", 64)),
+            *(arg for comment in comments for arg in ("--comment", comment)),
+            "-", str(path),
+        ]
+    raise ValueError(f"Not an encoded file_type: {file_type}")
+
+
+class WavWriter:
+    """Writes S16_LE PCM to a WAV file.
+
+    With ``header_interval`` (seconds) the header's sizes are brought up to
+    date that often while recording (see wav_repair.HeaderSync).
+    """
+
+    def __init__(self, path, rate, channels, sample_width=2, header_interval=0):
+        self.path = path
+        self._file = open(path, "wb")
+        self._wav = wave.open(self._file, "wb")
+        self._wav.setnchannels(channels)
+        self._wav.setsampwidth(sample_width)
+        self._wav.setframerate(rate)
+        self._sync = HeaderSync(header_interval) if header_interval > 0 else None
+        self._data_offset = None
+        self._data_size = 0
+
+    def write(self, data):
+        self._wav.writeframesraw(data)
+        if self._sync:
+            self._data_size += len(data)
+            if self._data_offset is None:
+                # The header is written with the first frames
+                self._data_offset = self._file.tell() - self._data_size
+            self._sync.update(self._file, self._data_offset, self._data_size)
+
+    def close(self):
+        # wave patches the RIFF/data sizes in the header on close
+        self._wav.close()
+        self._file.close()
+
+
+class EncoderWriter:
+    """Streams S16_LE PCM into a flac/opusenc process writing ``path``."""
+
+    def __init__(self, file_type, path, rate, channels, config, tags=None):
+        self.path = path
+        self._proc = subprocess.Popen(
+            encoder_command(file_type, path, rate, channels, config, tags),
+            stdin=subprocess.PIPE,
+        )
+
+    def write(self, data):
+        self._proc.stdin.write(data)
+
+    def close(self):
+        self._proc.stdin.close()
+        try:
+            self._proc.wait(timeout=ENCODER_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            logger.error(f"Encoder did not finish {self.path}, killing it")
+            self._proc.kill()
+            self._proc.wait()
+
+
+def create_writer(config, path, rate, channels, tags=None):
+    """Writer for ``config['file_type']``, run on its own worker thread.
+
+    ``tags`` only end up in encoded files; WAV has no comments.
+    """
+    file_type = config.get("file_type", "wav")
+    if file_type in ENCODED_TYPES:
+        inner = EncoderWriter(file_type, path, rate, channels, config, tags)
+    else:
+        inner = WavWriter(
+            path, rate, channels, header_interval=float(config.get("wav_header_interval", 5))
+        )
+    return ThreadedWriter(inner)
+
+
+class ThreadedWriter:
+    """Moves writes of another writer onto a worker thread.
+
+    ``write()`` only appends to an unbounded queue, so the capture thread
+    never waits on the disk or the encoder; a queue that backs up is logged
+    rather than dropped. ``close()`` drains the queue and closes the inner
+    writer, so it is called off the hook loop (see staging.Stager).
+    """
+
+    def __init__(self, inner):
+        self.inner = inner
+        self.path = inner.path
+        self._queue = queue.Queue()
+        self._warned = False
+        self._thread = threading.Thread(target=self._run, name="recording-writer", daemon=True)
+        self._thread.start()
+
+    def write(self, data):
+        self._queue.put(data)
+        if not self._warned and self._queue.qsize() > BACKLOG_WARN_PERIODS:
+            self._warned = True
+            logger.warning(f"Writing {self.path.name} is falling behind capture; audio is queued in memory")
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        failed = False
+        while True:
+            data = self._queue.get()
+            if data is None:
+                break
+            if failed:
+                continue
+            try:
+                self.inner.write(data)
+            except Exception as e:
+                # Keep draining so close() still returns
+                logger.error(f"Error writing {self.path}: {e}")
+                failed = True
+        try:
+            self.inner.close()
+        except Exception as e:
+            logger.error(f"Error closing {self.path}: {e}")
+
+
+class EncodedArecord:
+    """``arecord`` piped into an encoder process.
+
+    Mimics the parts of ``subprocess.Popen`` the daemon uses, like
+    ``capture.WarmRecording``. Stopping (``terminate`` or ``kill``) ends
+    ``arecord``; the encoder then sees end of input and finalises the file,
+    and counts as running until it has.
+    """
+
+    def __init__(self, arecord_cmd, encoder_cmd):
+        self._arecord = subprocess.Popen(arecord_cmd, stdout=subprocess.PIPE)
+        self._encoder = subprocess.Popen(encoder_cmd, stdin=self._arecord.stdout)
+        # Only the encoder should hold the read end of the pipe
+        self._arecord.stdout.close()
+
+    def poll(self):
+        if self._arecord.poll() is None:
+            return None
+        return self._encoder.poll()
+
+    def terminate(self):
+        self._arecord.terminate()
+
+    def wait(self, timeout=None):
+        """Wait ``timeout`` for arecord, then up to ENCODER_TIMEOUT for the encoder.
+
+        The encoder is only killed if it does not finish the file by then.
+        """
+        self._arecord.wait(timeout=timeout)
+        try:
+            return self._encoder.wait(timeout=ENCODER_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            logger.error(
+                f"Encoder did not finish within {ENCODER_TIMEOUT}s, killing it; "
+                "the recording may be truncated"
+            )
+            self._encoder.kill()
+            return self._encoder.wait()
+
+    def kill(self):
+        # The encoder is left to finish what arecord captured; wait() reaps it
+        self._arecord.kill()
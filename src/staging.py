@@ -0,0 +1,175 @@
+"""Recordings are written under a hidden name and committed when the call ends.
+
+A take is recorded to ``.<name>.part`` and only gets its real name once it
+is closed, so the web server (which skips dot files) never lists, zips or
+indexes a half-written recording.
+
+With ``staging_path`` set, the ``.part`` file lives there instead of in the
+recordings folder. Point it at a tmpfs (``/dev/shm/...``) and the whole
+call is captured in RAM: the SD card sees no small writes while the guest
+talks, only one large sequential copy once the handset is replaced. When
+the staging folder is on the same filesystem as the recordings the commit
+is a rename and nothing is copied.
+
+Commits run on one worker thread (:class:`Stager`), off the hook loop,
+together with whatever blocks until the take is closed: waiting for an
+encoder to finish the file, or draining a warm-capture writer. A
+take that was never committed (the service was killed, or the power cut on
+a staging folder on the SD card) is committed by :meth:`Stager.recover` at
+the next start; a take staged on tmpfs does not survive a power cut.
+"""
+
+import errno
+import logging
+import os
+import queue
+import shutil
+import threading
+from pathlib import Path
+
+from wav_repair import repair_file
+
+logger = logging.getLogger(__name__)
+
+PART_SUFFIX = ".part"
+
+
+def staged_name(name):
+    """Hidden name a recording called ``name`` has until it is committed."""
+    return f".{name}{PART_SUFFIX}"
+
+
+def final_name(staged):
+    """The recording name of a staged file name, or None if it is not one."""
+    if not (staged.startswith(".") and staged.endswith(PART_SUFFIX)):
+        return None
+    return staged[1:-len(PART_SUFFIX)] or None
+
+
+def commit_file(staged, final):
+    """Give the staged recording its final name.
+
+    A rename if both are on one filesystem. Otherwise the recording is
+    copied in one go to a hidden file next to ``final`` (sendfile, so in
+    large sequential writes), synced and renamed, and the staged file is
+    removed. Raises OSError.
+    """
+    try:
+        os.replace(staged, final)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    tmp = final.with_name(staged_name(final.name))
+    try:
+        shutil.copyfile(staged, tmp)
+        with open(tmp, "rb") as f:
+            os.fsync(f.fileno())
+        os.replace(tmp, final)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    os.unlink(staged)
+
+
+class Stager:
+    """Where takes are recorded, and the worker that commits them."""
+
+    def __init__(self, staging_path=None):
+        self.staging_path = Path(staging_path) if staging_path else None
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="staging", daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def from_config(cls, config):
+        staging_path = config.get("staging_path")
+        if staging_path:
+            Path(staging_path).mkdir(parents=True, exist_ok=True)
+        return cls(staging_path)
+
+    def staged_path(self, final):
+        """Where to record the take that will be committed as ``final``."""
+        final = Path(final)
+        return (self.staging_path or final.parent) / staged_name(final.name)
+
+    def commit(self, staged, final, on_done=None, finish=None):
+        """Queue ``staged`` to become ``final``; returns immediately.
+
+        ``finish()``, if given, is called from the worker first and returns
+        once the staged file is complete. ``on_done(final)`` is called from
+        the worker once the recording is in place. If the commit fails, the
+        staged file is left for recover().
+        """
+        self._queue.put((Path(staged), Path(final), on_done, finish))
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            staged, final, on_done, finish = item
+            if finish:
+                try:
+                    finish()
+                except Exception:
+                    logger.exception(f"Error closing {final.name}")
+            try:
+                commit_file(staged, final)
+            except FileNotFoundError:
+                logger.warning(f"Nothing was recorded to {final.name}")
+                continue
+            except OSError as e:
+                logger.error(f"Could not commit {final.name}: {e}")
+                continue
+            logger.info(f"Committed {final.name}")
+            if on_done:
+                try:
+                    on_done(final)
+                except Exception:
+                    logger.exception(f"Error after committing {final.name}")
+
+    def recover(self, recordings_path):
+        """Commit takes left staged by a previous run; returns how many.
+
+        Call at startup, before anything records. WAV headers the recording
+        never completed are repaired on the way (see wav_repair.py).
+        """
+        recordings_path = Path(recordings_path)
+        recordings_path.mkdir(exist_ok=True)
+        folders = [recordings_path]
+        if self.staging_path and self.staging_path.resolve() != recordings_path.resolve():
+            # Takes still in the staging folder first: a copy they left
+            # half-done in the recordings folder has the same hidden name
+            folders.insert(0, self.staging_path)
+        recovered = 0
+        for folder in folders:
+            try:
+                entries = list(os.scandir(folder))
+            except FileNotFoundError:
+                continue
+            for entry in entries:
+                name = final_name(entry.name)
+                if name is None or not entry.is_file():
+                    continue
+                staged = Path(entry.path)
+                try:
+                    if name.lower().endswith(".wav"):
+                        repair_file(staged)
+                except (OSError, ValueError) as e:
+                    logger.warning(f"Cannot repair {entry.name}: {e}")
+                try:
+                    commit_file(staged, recordings_path / name)
+                except FileNotFoundError:
+                    continue  # committed along with its staged original
+                except OSError as e:
+                    logger.error(f"Could not commit {name}: {e}")
+                    continue
+                recovered += 1
+                logger.warning(f"Recovered {name}, left uncommitted by the last run")
+        return recovered
+
+    def close(self):
+        """Finish the queued commits and stop the worker."""
+        self._queue.put(None)
+        self._thread.join()
@@ -0,0 +1,207 @@
+"""Repair of WAV recordings cut off by a power loss.
+
+A WAV file states its length twice in the header: the RIFF size and the size
+of the ``data`` chunk. Both ``arecord`` and the warm capture writer fill them
+in when the recording is closed, so a file whose writer never got there (the
+power was cut mid-call) claims 0 bytes of audio, or more than it holds, and
+browsers refuse to play it.
+
+:func:`repair_file` reads only the first few KiB of a file, works out the
+real data size from the file size, and rewrites the two 4-byte size fields in
+place; the audio itself is never read or copied, so a folder of thousands of
+recordings is checked in seconds. The daemon runs :func:`repair_folder` at
+startup (``repair_recordings``), before any new recording is started. To run
+it by hand::
+
+    python3 src/wav_repair.py [--dry-run] [--min-age SECONDS] [PATH ...]
+
+Warm capture can also keep the header of the file being recorded current
+while it is written (``wav_header_interval``, see :class:`HeaderSync`), so a
+power cut loses at most that many seconds from the header's point of view.
+"""
+
+import argparse
+import logging
+import os
+import struct
+import sys
+import time
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# The fmt and data chunk headers are always within this many bytes; anything
+# bigger in front of them (a huge LIST chunk) is not a recording of ours
+HEAD_BYTES = 4096
+
+
+def parse_header(head):
+    """(data_offset, data_size, block_align) from the start of a WAV file.
+
+    ``data_offset`` is where the audio starts and ``data_size`` what the
+    header claims. Raises ValueError if ``head`` does not hold a WAV header
+    up to the start of the data chunk.
+    """
+    if len(head) < 12 or head[:4] != b"RIFF" or head[8:12] != b"WAVE":
+        raise ValueError("not a WAV file")
+    offset = 12
+    block_align = None
+    while offset + 8 <= len(head):
+        chunk_id, chunk_size = struct.unpack_from("<4sI", head, offset)
+        if chunk_id == b"fmt ":
+            if offset + 8 + 14 > len(head):
+                break
+            block_align = struct.unpack_from("<H", head, offset + 8 + 12)[0]
+        elif chunk_id == b"data":
+            if not block_align:
+                raise ValueError("no fmt chunk before the data")
+            return offset + 8, chunk_size, block_align
+        offset += 8 + chunk_size + (chunk_size & 1)
+    raise ValueError("header incomplete")
+
+
+def write_sizes(f, data_offset, data_size):
+    """Write the RIFF and data chunk sizes for ``data_size`` bytes of audio."""
+    riff_size = data_offset - 8 + data_size + (data_size & 1)
+    f.seek(4)
+    f.write(struct.pack("<I", riff_size))
+    f.seek(data_offset - 4)
+    f.write(struct.pack("<I", data_size))
+
+
+def repair_file(path, dry_run=False):
+    """Fix the header of one WAV file if its sizes do not match the file.
+
+    Returns the data size written (or that would be written with
+    ``dry_run``), or None if the header was fine. Raises ValueError for a
+    file whose header itself is missing or damaged, and OSError.
+    """
+    with open(path, "rb" if dry_run else "r+b") as f:
+        head = f.read(HEAD_BYTES)
+        size = os.fstat(f.fileno()).st_size
+        data_offset, claimed, block_align = parse_header(head)
+        riff_size = struct.unpack_from("<I", head, 4)[0]
+        available = max(0, size - data_offset)
+        # An unpatched header claims nothing, or more than the file holds
+        if claimed and data_offset + claimed <= size and 0 < riff_size <= size - 8:
+            return None
+        if not claimed and not available:
+            return None  # really empty
+        data_size = available - available % block_align
+        if not dry_run:
+            write_sizes(f, data_offset, data_size)
+    return data_size
+
+
+def repair_folder(folder, min_age=0.0, dry_run=False):
+    """Repair every ``*.wav`` directly in ``folder``; returns (checked, repaired, failed).
+
+    Files modified within the last ``min_age`` seconds are skipped: they may
+    still be recording.
+    """
+    started = time.monotonic()
+    cutoff = time.time() - min_age
+    checked = repaired = failed = 0
+    try:
+        entries = list(os.scandir(folder))
+    except FileNotFoundError:
+        return 0, 0, 0
+    for entry in entries:
+        if entry.name.startswith(".") or not entry.name.lower().endswith(".wav"):
+            continue
+        try:
+            st = entry.stat()
+            if not entry.is_file() or st.st_mtime > cutoff:
+                continue
+            checked += 1
+            data_size = repair_file(entry.path, dry_run)
+        except (OSError, ValueError) as e:
+            failed += 1
+            logger.warning(f"Cannot repair {entry.name}: {e}")
+            continue
+        if data_size is not None:
+            repaired += 1
+            logger.info(
+                f"{'Would repair' if dry_run else 'Repaired'} {entry.name}: "
+                f"{data_size} bytes of audio"
+            )
+    if repaired and not dry_run:
+        # Headers were rewritten in place; make the web server's recordings
+        # index rescan the folder instead of trusting its cached sizes
+        os.utime(folder)
+    logger.info(
+        f"Checked {checked} recordings in {time.monotonic() - started:.2f}s: "
+        f"{repaired} {'to repair' if dry_run else 'repaired'}, {failed} unreadable"
+    )
+    return checked, repaired, failed
+
+
+class HeaderSync:
+    """Rewrites the sizes of a WAV file being written every ``interval`` seconds.
+
+    Used by the warm capture writer: ``update(f, data_offset, data_size)``
+    after each write patches the header (and flushes it to the card) once
+    the interval has passed, so the file is playable up to the last sync if
+    the recording never gets to close it.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._next = time.monotonic() + interval
+
+    def update(self, f, data_offset, data_size):
+        now = time.monotonic()
+        if now < self._next:
+            return
+        self._next = now + self.interval
+        end = f.tell()
+        write_sizes(f, data_offset, data_size)
+        f.seek(end)
+        f.flush()
+        os.fdatasync(f.fileno())
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Fix WAV headers left unpatched by a power cut, without copying the audio."
+    )
+    parser.add_argument("paths", nargs="*",
+                        help="WAV files or folders (default: recordings_path from config.yaml)")
+    parser.add_argument("--config", help="config.yaml (default: AGB_CONFIG_PATH or ./config.yaml)")
+    parser.add_argument("--min-age", type=float, default=60.0,
+                        help="skip files modified in the last SECONDS (default 60; may still be recording)")
+    parser.add_argument("--dry-run", action="store_true", help="only report what would be repaired")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    paths = [Path(p) for p in args.paths]
+    if not paths:
+        import yaml
+
+        base_dir = Path(__file__).parent.parent
+        config_path = Path(args.config or os.environ.get("AGB_CONFIG_PATH", base_dir / "config.yaml"))
+        with config_path.open("r") as f:
+            config = yaml.safe_load(f)
+        recordings_path = Path(config.get("recordings_path", "recordings"))
+        paths = [recordings_path if recordings_path.is_absolute() else base_dir / recordings_path]
+
+    failed = 0
+    for path in paths:
+        if path.is_dir():
+            failed += repair_folder(path, args.min_age, args.dry_run)[2]
+            continue
+        try:
+            data_size = repair_file(path, args.dry_run)
+        except (OSError, ValueError) as e:
+            failed += 1
+            logger.warning(f"Cannot repair {path}: {e}")
+            continue
+        if data_size is None:
+            logger.info(f"{path.name} is fine")
+        else:
+            logger.info(f"{'Would repair' if args.dry_run else 'Repaired'} {path.name}: {data_size} bytes of audio")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,628 @@
+"""Load benchmark of the web server against large synthetic recording libraries.
+
+Like ``test/test_server.py`` this serves the **real** Flask app from
+``webserver/server.py``, configured from ``config.example.yaml`` through the
+``AGB_CONFIG_PATH`` / ``AGB_UPLOAD_FOLDER`` overrides with the device-only
+side effects stubbed out. The app runs in its own process under gunicorn
+with one gevent worker, as the web server service runs it on the Pi
+(``gunicorn -w 1 -k gevent "webserver.server:create_app()"``, from the unit
+override ``install.sh`` writes), and is driven over HTTP by concurrent
+clients from this process.
+
+For each library size it:
+
+* generates a recordings folder of that many WAVs, named and dated like the
+  daemon's, with realistic sizes (CD quality, take lengths drawn from a
+  log-normal distribution). The files are sparse: the header is real, the
+  audio reads back as silence and costs no disk space, so ZIP throughput is
+  optimistic compared with real takes,
+* builds the recordings index before serving and reports how long it took,
+  and marks every take as analyzed, so the runs measure the steady state
+  rather than the first-visit scan and the background empty-take analysis,
+* runs each endpoint for ``--duration`` seconds at every ``--concurrency``
+  level, recording latency (p50/p95/p99/max), time to first byte,
+  throughput, errors, and the CPU time and peak RSS of the gunicorn worker.
+
+Endpoints: ``/api/recordings`` (first page, sorted by duration, and a 304
+revalidation), ``/recordings/<f>`` 64 KiB range requests,
+``/download-all`` (time to the first ``--zip-mb`` MiB, then the connection
+is dropped), ``/download-selected`` (five takes), ``/delete-recordings``
+(ten takes per request, run last) and ``/api/system-status``.
+
+Run:
+
+    python test/bench_server.py                            # 100, 10k and 50k takes
+    python test/bench_server.py --sizes 100,1000 --duration 2
+    python test/bench_server.py --workdir /home/admin      # library on the SD card
+    python test/bench_server.py --baseline test/bench_results/<earlier run>.json
+
+Results are written as JSON to ``test/bench_results/`` (or ``--output``),
+tagged with the git commit, so runs of different versions can be compared.
+With ``--baseline`` the exit status is 1 if p95 latency, throughput or peak
+RSS of any run got worse than the saved run by more than ``--tolerance``.
+"""
+
+import argparse
+import datetime
+import http.client
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from unittest import mock
+
+import psutil
+
+TEST_DIR = Path(__file__).resolve().parent
+PROJECT_ROOT = TEST_DIR.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+RESULTS_DIR = TEST_DIR / "bench_results"
+
+# Library shape: CD quality, like the default config
+SAMPLE_RATE = 44100
+CHANNELS = 2
+SAMPLE_WIDTH = 2
+# Take lengths: log-normal around MEDIAN_TAKE seconds, within [1 s, recording_limit]
+MEDIAN_TAKE = 40.0
+TAKE_SIGMA = 0.9
+RECORDING_LIMIT = 300.0
+# Takes are spread over this many days before now
+LIBRARY_DAYS = 365
+
+RANGE_BYTES = 64 * 1024
+SELECTED_FILES = 5
+DELETE_BATCH = 10
+# How often the server's RSS is sampled during a run
+RSS_POLL = 0.02
+
+
+# ---------------------------------------------------------------------------
+# Synthetic library
+# ---------------------------------------------------------------------------
+
+def wav_header(data_size):
+    """Canonical 44-byte PCM WAV header for ``data_size`` bytes of audio."""
+    block_align = CHANNELS * SAMPLE_WIDTH
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", 36 + data_size, b"WAVE",
+        b"fmt ", 16, 1, CHANNELS, SAMPLE_RATE, SAMPLE_RATE * block_align, block_align,
+        SAMPLE_WIDTH * 8,
+        b"data", data_size,
+    )
+
+
+def generate_library(path, count, seed=0):
+    """Write ``count`` sparse WAV takes into ``path``; returns {name: size}."""
+    rng = random.Random(seed)
+    path.mkdir(parents=True, exist_ok=True)
+    end = time.time()
+    start = end - LIBRARY_DAYS * 86400
+    sizes = {}
+    while len(sizes) < count:
+        ts = rng.uniform(start, end)
+        name = datetime.datetime.fromtimestamp(ts).isoformat(timespec="microseconds") + ".wav"
+        if name in sizes:
+            continue
+        seconds = min(max(rng.lognormvariate(0, TAKE_SIGMA) * MEDIAN_TAKE, 1.0), RECORDING_LIMIT)
+        data_size = int(seconds * SAMPLE_RATE) * CHANNELS * SAMPLE_WIDTH
+        file_path = path / name
+        with file_path.open("wb") as f:
+            f.write(wav_header(data_size))
+            f.truncate(44 + data_size)
+        # The take finished recording at ts
+        os.utime(file_path, (ts + seconds, ts + seconds))
+        sizes[name] = 44 + data_size
+    return sizes
+
+
+# ---------------------------------------------------------------------------
+# Server process
+# ---------------------------------------------------------------------------
+
+def write_config(workdir):
+    from ruamel.yaml import YAML
+
+    yaml = YAML()
+    template = PROJECT_ROOT / "config.example.yaml"
+    config = yaml.load(template.read_text().replace("__INSTALL_DIR__", str(workdir)))
+    config["recordings_path"] = str(workdir / "recordings")
+    config["cache_path"] = str(workdir / "cache")
+    # Never attach to a daemon that happens to run on this machine
+    config["event_socket"] = ""
+    config_path = workdir / "config.yaml"
+    with config_path.open("w") as f:
+        yaml.dump(config, f)
+    return config_path
+
+
+def run_child(workdir, port):
+    """Index the library, then serve the real app with gunicorn on ``port``."""
+    from gunicorn.app.base import BaseApplication
+
+    from webserver.recordings_index import RecordingsIndex
+
+    workdir = Path(workdir)
+    os.environ["AGB_CONFIG_PATH"] = str(write_config(workdir))
+    os.environ["AGB_UPLOAD_FOLDER"] = str(workdir / "uploads")
+
+    # The same index file the app opens, so it starts from a built index
+    index = RecordingsIndex(workdir / "cache" / "recordings.sqlite3", workdir / "recordings")
+    started = time.perf_counter()
+    index.sync()
+    index_build_s = time.perf_counter() - started
+    rng = random.Random(1)
+    index.set_analysis([
+        (row["name"], row["size"], row["mtime"],
+         {"rms_db": -30.0, "speech_db": -24.0, "speech_seconds": rng.uniform(0.0, 60.0)})
+        for row in index.pending_analysis()
+    ])
+    print(json.dumps({"index_build_s": index_build_s}), flush=True)
+
+    class Application(BaseApplication):
+        def load_config(self):
+            self.cfg.set("bind", f"127.0.0.1:{port}")
+            self.cfg.set("workers", 1)
+            self.cfg.set("worker_class", "gevent")
+
+        def load(self):
+            # Imported in the worker, after gevent has patched it; same
+            # stubs as test/test_server.py
+            mock.patch("webserver.server.subprocess.run").start()
+            mock.patch("webserver.server.os.system").start()
+            from webserver.server import create_app
+
+            return create_app()
+
+    Application().run()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class ServerProcess:
+    """gunicorn serving one library; measurements are of its worker."""
+
+    def __init__(self, workdir):
+        self.port = free_port()
+        self.log_path = workdir / "server.log"
+        self.log = self.log_path.open("w")
+        self.proc = subprocess.Popen(
+            [sys.executable, __file__, "--child", str(workdir), str(self.port)],
+            stdout=subprocess.PIPE, stderr=self.log, text=True,
+        )
+        line = self.proc.stdout.readline()
+        if not line:
+            self.fail(f"Server failed to start (exit {self.proc.wait()})")
+        self.index_build_s = json.loads(line)["index_build_s"]
+        # Ready once the worker is up and has taken its first metrics sample
+        deadline = time.monotonic() + 60
+        while True:
+            if self.proc.poll() is not None or time.monotonic() > deadline:
+                self.fail("Server did not come up")
+            try:
+                conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=5)
+                conn.request("GET", "/api/system-status")
+                if conn.getresponse().status == 200:
+                    break
+            except OSError:
+                pass
+            finally:
+                conn.close()
+            time.sleep(0.2)
+        self.master = psutil.Process(self.proc.pid)
+        self.worker = None
+        # Workers the master has replaced (e.g. killed for a timeout)
+        self.restarts = 0
+        self._cpu = 0.0
+        self._dead_cpu = 0.0
+
+    def fail(self, message):
+        # The library (and the log) are removed on the way out
+        self.stop()
+        sys.stderr.write(self.log_path.read_text()[-4000:])
+        raise SystemExit(message)
+
+    def _alive(self, proc):
+        try:
+            return proc.is_running() and proc.status() != psutil.STATUS_ZOMBIE
+        except psutil.Error:
+            return False
+
+    def _worker(self):
+        if self.worker is not None and not self._alive(self.worker):
+            self._dead_cpu = self._cpu
+            self.worker = None
+            self.restarts += 1
+        if self.worker is None:
+            children = self.master.children()
+            if not children:
+                return None
+            self.worker = children[0]
+        return self.worker
+
+    def rss(self):
+        try:
+            return self._worker().memory_info().rss
+        except (AttributeError, psutil.Error):
+            return 0
+
+    def cpu_seconds(self):
+        """CPU time of the worker so far, including replaced ones."""
+        try:
+            times = self._worker().cpu_times()
+            self._cpu = self._dead_cpu + times.user + times.system
+        except (AttributeError, psutil.Error):
+            pass
+        return self._cpu
+
+    def stop(self):
+        self.proc.terminate()
+        try:
+            self.proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+            self.proc.wait()
+        self.log.close()
+
+
+# ---------------------------------------------------------------------------
+# Load generation
+# ---------------------------------------------------------------------------
+
+class Client:
+    """One keep-alive connection, as a browser tab would hold."""
+
+    def __init__(self, port):
+        self.port = port
+        self.conn = None
+
+    def request(self, method, url, body=None, headers=None, max_bytes=None):
+        """Returns (status, bytes read, seconds to first byte)."""
+        if self.conn is None:
+            self.conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=120)
+        started = time.perf_counter()
+        self.conn.request(method, url, body=body, headers=headers or {})
+        resp = self.conn.getresponse()
+        ttfb = time.perf_counter() - started
+        read = 0
+        while max_bytes is None or read < max_bytes:
+            chunk = resp.read(64 * 1024)
+            if not chunk:
+                break
+            read += len(chunk)
+        if not resp.isclosed():
+            # Stopped early: drop the connection, as a cancelled download would
+            self.conn.close()
+            self.conn = None
+        return resp.status, read, ttfb
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+
+
+def make_jobs(sizes, zip_bytes, port, runs):
+    """Endpoint -> (start, accepted statuses).
+
+    ``start()`` is called once per run and returns a job factory; a job is
+    ``job(client) -> (status, bytes, ttfb)`` and the factory returns None
+    once the run is out of work. Deletions are shared out over ``runs``.
+    """
+    rng = random.Random(2)
+    names = sorted(sizes)
+    conn = http.client.HTTPConnection("127.0.0.1", port)
+    conn.request("GET", "/api/recordings?limit=50")
+    resp = conn.getresponse()
+    resp.read()
+    etag = resp.getheader("ETag")
+    conn.close()
+
+    def recording_range_job():
+        name = rng.choice(names)
+        offset = rng.randrange(0, max(1, sizes[name] - RANGE_BYTES))
+        headers = {"Range": f"bytes={offset}-{offset + RANGE_BYTES - 1}"}
+        return lambda c: c.request("GET", f"/recordings/{name}", headers=headers)
+
+    def download_selected_job():
+        body = "&".join(f"files[]={n}" for n in rng.sample(names, min(SELECTED_FILES, len(names))))
+        headers = {"Content-Type": "application/x-www-form-urlencoded"}
+        return lambda c: c.request("POST", "/download-selected", body, headers, max_bytes=zip_bytes)
+
+    doomed = list(names)
+    rng.shuffle(doomed)
+    per_run = max(DELETE_BATCH, len(doomed) // max(1, runs))
+
+    def delete_recordings():
+        pool = [doomed.pop() for _ in range(min(per_run, len(doomed)))]
+
+        def job():
+            if not pool:
+                return None
+            batch = [pool.pop() for _ in range(min(DELETE_BATCH, len(pool)))]
+            body = json.dumps({"ids": batch})
+            headers = {"Content-Type": "application/json"}
+            return lambda c: c.request("POST", "/delete-recordings", body, headers)
+
+        return job
+
+    def get(url, headers=None, max_bytes=None):
+        job = lambda c: c.request("GET", url, headers=headers, max_bytes=max_bytes)  # noqa: E731
+        return lambda: lambda: job
+
+    def recording_range():
+        return recording_range_job
+
+    def download_selected():
+        return download_selected_job
+
+    return {
+        "api_recordings": (get("/api/recordings?limit=50"), {200}),
+        "api_recordings_by_duration": (get("/api/recordings?limit=50&sort=duration&order=asc"), {200}),
+        "api_recordings_revalidate": (
+            get("/api/recordings?limit=50", headers={"If-None-Match": etag or ""}), {304}),
+        "recording_range": (recording_range, {206}),
+        "system_status": (get("/api/system-status"), {200}),
+        "download_all": (get("/download-all", max_bytes=zip_bytes), {200}),
+        "download_selected": (download_selected, {200}),
+        # Destructive, so last
+        "delete_recordings": (delete_recordings, {200}),
+    }
+
+
+def quantiles(values):
+    if not values:
+        return None
+    values = sorted(values)
+
+    def pick(q):
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+    return {
+        "p50": round(pick(0.5) * 1000, 2),
+        "p95": round(pick(0.95) * 1000, 2),
+        "p99": round(pick(0.99) * 1000, 2),
+        "max": round(values[-1] * 1000, 2),
+    }
+
+
+def run_load(server, factory, accepted, concurrency, duration):
+    """Hammer one endpoint from ``concurrency`` clients for ``duration`` s."""
+    lock = threading.Lock()
+    latencies, ttfbs = [], []
+    counts = {"requests": 0, "errors": 0, "bytes": 0}
+    stop = threading.Event()
+    peak = [server.rss()]
+
+    def poll_rss():
+        while not stop.wait(RSS_POLL):
+            peak[0] = max(peak[0], server.rss())
+            # Keeps the CPU time of a worker that gets replaced mid-run
+            server.cpu_seconds()
+
+    def worker():
+        client = Client(server.port)
+        try:
+            while time.perf_counter() < deadline:
+                with lock:
+                    job = factory()
+                if job is None:
+                    return
+                started = time.perf_counter()
+                try:
+                    status, read, ttfb = job(client)
+                except (OSError, http.client.HTTPException):
+                    client.close()
+                    client = Client(server.port)
+                    status, read, ttfb = None, 0, None
+                elapsed = time.perf_counter() - started
+                with lock:
+                    counts["requests"] += 1
+                    counts["bytes"] += read
+                    if status in accepted:
+                        latencies.append(elapsed)
+                        ttfbs.append(ttfb)
+                    else:
+                        counts["errors"] += 1
+        finally:
+            client.close()
+
+    poller = threading.Thread(target=poll_rss, daemon=True)
+    poller.start()
+    cpu_before = server.cpu_seconds()
+    restarts_before = server.restarts
+    started = time.perf_counter()
+    deadline = started + duration
+    workers = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    wall = time.perf_counter() - started
+    stop.set()
+    poller.join()
+    peak[0] = max(peak[0], server.rss())
+    return {
+        "concurrency": concurrency,
+        **counts,
+        "wall_s": round(wall, 3),
+        "throughput_rps": round(len(latencies) / wall, 2),
+        "mb_per_s": round(counts["bytes"] / wall / 2**20, 2),
+        "latency_ms": quantiles(latencies),
+        "ttfb_ms": quantiles(ttfbs),
+        "server_cpu_s": round(server.cpu_seconds() - cpu_before, 3),
+        "peak_rss_mb": round(peak[0] / 2**20, 1),
+        "worker_restarts": server.restarts - restarts_before,
+    }
+
+
+def bench_library(count, args):
+    workdir = Path(tempfile.mkdtemp(prefix="agb-bench-", dir=args.workdir))
+    try:
+        print(f"Generating {count} takes in {workdir}...", file=sys.stderr)
+        started = time.perf_counter()
+        sizes = generate_library(workdir / "recordings", count)
+        generate_s = time.perf_counter() - started
+        server = ServerProcess(workdir)
+        try:
+            result = {
+                "recordings": count,
+                "library_gb": round(sum(sizes.values()) / 2**30, 2),
+                "generate_s": round(generate_s, 2),
+                "index_build_s": round(server.index_build_s, 2),
+                "startup_rss_mb": round(server.rss() / 2**20, 1),
+                "endpoints": {},
+            }
+            jobs = make_jobs(sizes, args.zip_mb * 2**20, server.port, len(args.concurrency))
+            for endpoint, (start, accepted) in jobs.items():
+                if args.endpoint and endpoint not in args.endpoint:
+                    continue
+                runs = result["endpoints"][endpoint] = {}
+                for concurrency in args.concurrency:
+                    print(f"  {endpoint} x{concurrency}", file=sys.stderr)
+                    runs[str(concurrency)] = run_load(server, start(), accepted, concurrency, args.duration)
+        finally:
+            server.stop()
+        return result
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+# ---------------------------------------------------------------------------
+# Reporting
+# ---------------------------------------------------------------------------
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"], cwd=PROJECT_ROOT,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def fmt(q):
+    return "-" if q is None else f"{q['p50']:.1f}/{q['p95']:.1f}/{q['p99']:.1f}"
+
+
+def print_report(results):
+    print("\nLatency in ms (p50/p95/p99)\n")
+    header = f"{'endpoint':<28} {'conc':>4} {'reqs':>6} {'err':>4} {'req/s':>8} {'MB/s':>7} " \
+             f"{'latency':>22} {'ttfb':>22} {'cpu s':>6} {'rss MB':>7}"
+    for size, lib in results["libraries"].items():
+        print(f"{size} recordings ({lib['library_gb']} GB): index built in {lib['index_build_s']} s, "
+              f"startup RSS {lib['startup_rss_mb']} MB")
+        print(header)
+        print("-" * len(header))
+        for endpoint, runs in lib["endpoints"].items():
+            for concurrency, r in runs.items():
+                print(
+                    f"{endpoint:<28} {concurrency:>4} {r['requests']:>6} {r['errors']:>4} "
+                    f"{r['throughput_rps']:>8.1f} {r['mb_per_s']:>7.1f} {fmt(r['latency_ms']):>22} "
+                    f"{fmt(r['ttfb_ms']):>22} {r['server_cpu_s']:>6.2f} {r['peak_rss_mb']:>7.1f}"
+                )
+                if r["worker_restarts"]:
+                    print(f"{'':<28} gunicorn replaced the worker {r['worker_restarts']} time(s)")
+        print()
+
+
+def regressions(results, baseline, tolerance):
+    """Runs that got slower or bigger than the same run in ``baseline``."""
+    problems = []
+    for size, lib in results["libraries"].items():
+        base_lib = baseline.get("libraries", {}).get(size, {})
+        for endpoint, runs in lib["endpoints"].items():
+            for concurrency, r in runs.items():
+                base = base_lib.get("endpoints", {}).get(endpoint, {}).get(concurrency)
+                if base is None:
+                    continue
+                where = f"{size}/{endpoint}/x{concurrency}"
+                now, then = r["latency_ms"], base["latency_ms"]
+                if now and then and now["p95"] > then["p95"] * (1 + tolerance) + 2:
+                    problems.append(f"{where}: p95 {now['p95']:.1f} ms (was {then['p95']:.1f} ms)")
+                if r["throughput_rps"] < base["throughput_rps"] / (1 + tolerance):
+                    problems.append(
+                        f"{where}: {r['throughput_rps']:.1f} req/s (was {base['throughput_rps']:.1f})"
+                    )
+                if r["peak_rss_mb"] > base["peak_rss_mb"] * (1 + tolerance) + 5:
+                    problems.append(f"{where}: peak RSS {r['peak_rss_mb']} MB (was {base['peak_rss_mb']} MB)")
+                if r["errors"] > base["errors"]:
+                    problems.append(f"{where}: {r['errors']} errors (was {base['errors']})")
+                if r["worker_restarts"] > base.get("worker_restarts", 0):
+                    problems.append(f"{where}: worker replaced {r['worker_restarts']} time(s)")
+    return problems
+
+
+def int_list(value):
+    return [int(v) for v in value.split(",") if v]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the web server against synthetic libraries.")
+    parser.add_argument("--sizes", type=int_list, default=[100, 10000, 50000],
+                        help="library sizes, comma separated (default 100,10000,50000)")
+    parser.add_argument("--concurrency", type=int_list, default=[1, 8],
+                        help="concurrent clients per run, comma separated (default 1,8)")
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per run (default 5)")
+    parser.add_argument("-e", "--endpoint", action="append",
+                        help="only run this endpoint (repeatable; default: all)")
+    parser.add_argument("--zip-mb", type=int, default=16,
+                        help="MiB of each ZIP download to read before dropping it (default 16)")
+    parser.add_argument("--workdir", help="where to create the libraries (default: the temp dir)")
+    parser.add_argument("--output", help="results file (default: test/bench_results/<time>-<commit>.json)")
+    parser.add_argument("--baseline", help="compare against saved results; exit 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed relative slowdown against the baseline (default 0.25)")
+    parser.add_argument("--child", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(*args.child)
+        return
+
+    commit = git_commit()
+    results = {
+        "commit": commit,
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "duration_s": args.duration,
+        "libraries": {},
+    }
+    for count in args.sizes:
+        results["libraries"][str(count)] = bench_library(count, args)
+    print_report(results)
+
+    if args.output:
+        output = Path(args.output)
+    else:
+        stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        output = RESULTS_DIR / f"{stamp}-{commit or 'unknown'}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2) + "\n")
+    print(f"Results written to {output}")
+
+    baseline = json.loads(Path(args.baseline).read_text()) if args.baseline else {}
+    problems = regressions(results, baseline, args.tolerance)
+    for problem in problems:
+        print(f"REGRESSION {problem}")
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
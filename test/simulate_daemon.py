@@ -0,0 +1,546 @@
+"""Hardware-free simulation and benchmark of the guestbook daemon.
+
+Runs the **real** ``main()`` from ``src/audioGuestBook.py`` with the fake GPIO
+backend, the null audio sink and the fake capture source (warm capture), and
+a stand-in ``arecord`` on ``PATH`` for the record greeting button. Scripted
+or recorded hook / button edges are replayed into the fake backend while the
+daemon's live event stream (``event_socket``) and call traces
+(``call_traces.jsonl``) are collected.
+
+Time is compressed by ``--speed``: everything on a human scale (greeting
+delay, prompt lengths, how long a guest talks, ``recording_limit``) is
+divided by it, but never below ``MIN_HUMAN`` so it stays well clear of the
+bounce window. Switch bounce and ``hook_bounce_time`` stay real, so the
+debounce logic sees what it would on the Pi.
+
+For each scenario it reports:
+
+* hook transitions the script implies that the daemon never reported
+  (missed) or that it reported without cause (unexpected), plus missing
+  recordings / time-exceeded / greeting recordings,
+* latency from the GPIO edge to the daemon publishing the hook change,
+* the daemon's own stage latencies (see ``src/call_trace.py``),
+* CPU time used by the daemon process.
+
+Run:
+
+    python test/simulate_daemon.py                       # every scenario
+    python test/simulate_daemon.py -s bouncy_hook -s limit_overrun --speed 20
+    python test/simulate_daemon.py --edges edges.jsonl   # {"t": s, "pin": "hook", "level": 0}
+    python test/simulate_daemon.py --call-traces cache/call_traces.jsonl
+    python test/simulate_daemon.py --save test/sim_baseline.json
+    python test/simulate_daemon.py --baseline test/sim_baseline.json
+
+The exit status is 1 if any transition was missed or unexpected, or (with
+``--baseline``) if CPU time or edge latency got worse than the saved run
+by more than ``--tolerance``. Each scenario runs in its own process, so
+every run starts from a clean daemon.
+"""
+
+import argparse
+import collections
+import json
+import os
+import resource
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import wave
+from pathlib import Path
+
+TEST_DIR = Path(__file__).resolve().parent
+PROJECT_ROOT = TEST_DIR.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+HOOK_PIN = 22
+GREETING_PIN = 23
+PINS = {"hook": HOOK_PIN, "greeting": GREETING_PIN}
+HIGH, LOW = 1, 0
+
+# Human-scale timings, in simulated seconds
+GREETING_DELAY = 1.5
+PROMPT_SECONDS = {"greeting": 3.0, "beep": 0.5, "time_exceeded": 2.0}
+RECORDING_LIMIT = 30.0
+
+# Physical timings, never compressed (seconds)
+BOUNCE_TIME = 0.1
+BOUNCE_SPACING = 0.004
+# Gaps at least this long in recorded edges are human, so compressed
+HUMAN_GAP = 0.5
+# Shortest a compressed human duration gets (real seconds)
+MIN_HUMAN = 3 * BOUNCE_TIME
+# Real time left after the last edge for the daemon to finish up
+TAIL_SECONDS = 1.5
+
+SAMPLE_RATE = 16000
+PLAYBACK_PERIOD = 256
+# The audio engine plays this much silence after each prompt, so it only
+# returns once the prompt has been heard (AudioEngine.buffer_periods)
+PROMPT_TAIL = 4 * PLAYBACK_PERIOD / SAMPLE_RATE
+
+# Stand-in for arecord: writes silence in real time until terminated
+FAKE_ARECORD = '''#!{python}
+import signal, sys, time, wave
+args = sys.argv[1:]
+rate = int(args[args.index("-r") + 1])
+channels = int(args[args.index("-c") + 1])
+wf = wave.open(args[-1], "wb")
+wf.setnchannels(channels); wf.setsampwidth(2); wf.setframerate(rate)
+signal.signal(signal.SIGTERM, lambda *a: (wf.close(), sys.exit(0)))
+period = rate // 50
+while True:
+    wf.writeframes(bytes(period * channels * 2))
+    time.sleep(0.02)
+'''
+
+
+# ---------------------------------------------------------------------------
+# Scenarios (built in the parent, scaled by --speed)
+# ---------------------------------------------------------------------------
+
+def scale(seconds, speed):
+    """Real duration of a simulated human-scale one."""
+    return max(seconds / speed, MIN_HUMAN) if seconds > 0 else 0.0
+
+
+class Script:
+    """Edge script in real seconds, written in simulated ones."""
+
+    def __init__(self, speed):
+        self.speed = speed
+        self.now = 0.0
+        self.edges = []
+        self.expect = collections.Counter()
+
+    def wait(self, seconds):
+        self.now += scale(seconds, self.speed)
+
+    def set(self, pin, level, bounces=0):
+        """Drive ``pin`` to ``level`` now, after ``bounces`` bounce edges
+        (real ``BOUNCE_SPACING`` apart, well inside the bounce window)."""
+        for i in range(bounces):
+            self.edges.append((self.now + i * BOUNCE_SPACING, pin, level if i % 2 == 0 else 1 - level))
+        self.edges.append((self.now + bounces * BOUNCE_SPACING, pin, level))
+
+    def call(self, talk=None, hang_up_in=None, bounces=0):
+        """Lift, then hang up ``talk`` seconds into the recording, or half
+        way through ``hang_up_in`` ("delay", "greeting" or "beep")."""
+        self.set("hook", LOW, bounces)
+        phases = [("delay", GREETING_DELAY), ("greeting", PROMPT_SECONDS["greeting"]),
+                  ("beep", PROMPT_SECONDS["beep"])]
+        for phase, seconds in phases:
+            if phase == hang_up_in:
+                self.now += scale(seconds, self.speed) / 2
+                break
+            self.wait(seconds)
+            if phase != "delay":
+                self.now += PROMPT_TAIL
+        else:
+            self.wait(talk)
+            self.expect["recording_started"] += 1
+            if talk > RECORDING_LIMIT:
+                self.expect["time_exceeded"] += 1
+                self.wait(PROMPT_SECONDS["time_exceeded"])
+        self.set("hook", HIGH, bounces)
+
+
+def normal_call(s):
+    s.wait(1)
+    s.call(talk=10)
+
+
+def bouncy_hook(s):
+    for _ in range(3):
+        s.wait(2)
+        s.call(talk=5, bounces=7)
+
+
+def fast_hangups(s):
+    for phase in ("delay", "greeting", "beep") * 2:
+        s.wait(1)
+        s.call(hang_up_in=phase, bounces=3)
+
+
+def limit_overrun(s):
+    s.wait(1)
+    s.call(talk=RECORDING_LIMIT + 5)
+
+
+def greeting_button(s):
+    s.wait(1)
+    s.set("greeting", LOW, bounces=3)
+    s.wait(5)
+    s.set("greeting", HIGH, bounces=3)
+    s.expect["greeting_recording_started"] += 1
+    s.wait(2)
+    s.call(talk=5)
+
+
+def back_to_back(s):
+    for _ in range(10):
+        s.wait(1)
+        s.call(talk=2)
+
+
+SCENARIOS = {
+    f.__name__: f
+    for f in (normal_call, bouncy_hook, fast_hangups, limit_overrun, greeting_button, back_to_back)
+}
+
+
+def compress(edges, speed):
+    """Compress human-length gaps in real-time edges (see scale())."""
+    out = []
+    t = prev = None
+    for at, pin, level in sorted(edges):
+        gap = None if prev is None else at - prev
+        t = 1.0 if gap is None else t + (scale(gap, speed) if gap >= HUMAN_GAP else gap)
+        prev = at
+        out.append((t, pin, level))
+    return out
+
+
+def load_edges(path):
+    edges = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                e = json.loads(line)
+                edges.append((float(e["t"]), e["pin"], int(e["level"])))
+    return edges
+
+
+def edges_from_call_traces(path):
+    """Hook edges of the calls in a daemon call_traces.jsonl."""
+    edges = []
+    with open(path) as f:
+        for line in f:
+            try:
+                events = json.loads(line)["events"]
+            except (ValueError, KeyError):
+                continue
+            edges.append((events["edge_detected"], "hook", LOW))
+            hangup = events.get("on_hook", events.get("file_closed", events["edge_detected"]) + 1)
+            edges.append((hangup, "hook", HIGH))
+    return edges
+
+
+def scaled_config(speed, workdir):
+    """config.example.yaml pointed at ``workdir``, with human timings scaled."""
+    import yaml
+
+    config = yaml.safe_load((PROJECT_ROOT / "config.example.yaml").read_text())
+    config.update({
+        "audio_sink": "null",
+        "gpio_backend": "fake",
+        "capture_mode": "warm",
+        "capture_source": "fake",
+        "file_type": "wav",
+        "channels": 1,
+        "sample_rate": SAMPLE_RATE,
+        "playback_period_frames": PLAYBACK_PERIOD,
+        "hook_gpio": HOOK_PIN,
+        "hook_type": "NC",
+        "invert_hook": False,
+        "hook_bounce_time": BOUNCE_TIME,
+        "record_greeting_gpio": GREETING_PIN,
+        "record_greeting_type": "NC",
+        "record_greeting_bounce_time": BOUNCE_TIME,
+        "shutdown_gpio": 0,
+        "greeting_start_delay": scale(GREETING_DELAY, speed),
+        "beep_start_delay": 0.0,
+        "recording_limit": scale(RECORDING_LIMIT, speed),
+        "postprocess": False,
+        "call_trace": True,
+        "recordings_path": str(workdir / "recordings"),
+        "cache_path": str(workdir / "cache"),
+        "event_socket": str(workdir / "events.sock"),
+    })
+    for name in PROMPT_SECONDS:
+        config[name] = str(workdir / "sounds" / f"{name}.wav")
+        config[f"{name}_volume"] = 1.0
+    return config
+
+
+# ---------------------------------------------------------------------------
+# Child: one daemon run
+# ---------------------------------------------------------------------------
+
+def write_prompts(config, speed):
+    for name, seconds in PROMPT_SECONDS.items():
+        path = Path(config[name])
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with wave.open(str(path), "wb") as wf:
+            wf.setnchannels(1)
+            wf.setsampwidth(2)
+            wf.setframerate(SAMPLE_RATE)
+            wf.writeframes(bytes(2 * int(SAMPLE_RATE * scale(seconds, speed))))
+
+
+def run_child(spec_path, result_path):
+    import logging
+
+    import yaml
+
+    spec = json.loads(Path(spec_path).read_text())
+    workdir = Path(spec["workdir"])
+    config = spec["config"]
+    write_prompts(config, spec["speed"])
+    config_path = workdir / "config.yaml"
+    config_path.write_text(yaml.safe_dump(config))
+
+    sys.path.insert(0, str(PROJECT_ROOT / "src"))
+    import audioGuestBook
+    from gpio_backend import FakeGpioBackend
+
+    logging.getLogger().setLevel(logging.WARNING)
+    backend = FakeGpioBackend()
+    observed = []
+    fired = []
+
+    def listen():
+        path = config["event_socket"]
+        while not os.path.exists(path):
+            time.sleep(0.005)
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(path)
+            with sock.makefile("r") as lines:
+                for line in lines:
+                    observed.append((time.monotonic(), json.loads(line)))
+
+    def drive():
+        while not observed:  # the daemon is up once it sends its snapshot
+            time.sleep(0.005)
+        t0 = time.monotonic()
+        for at, pin, level in spec["edges"]:
+            time.sleep(max(0.0, t0 + at - time.monotonic()))
+            now = time.monotonic()
+            fired.append((now, pin, level))
+            backend.set_level(PINS[pin], level, now)
+        time.sleep(TAIL_SECONDS)
+        os.kill(os.getpid(), signal.SIGINT)
+
+    threading.Thread(target=listen, daemon=True).start()
+    threading.Thread(target=drive, daemon=True).start()
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    started = time.monotonic()
+    audioGuestBook.main(config_path, backend)
+    wall = time.monotonic() - started
+    end = resource.getrusage(resource.RUSAGE_SELF)
+
+    traces = []
+    trace_path = Path(config["cache_path"]) / "call_traces.jsonl"
+    if trace_path.exists():
+        traces = [json.loads(line) for line in trace_path.read_text().splitlines()]
+    Path(result_path).write_text(json.dumps({
+        "fired": fired,
+        "observed": observed,
+        "traces": traces,
+        "cpu_s": (end.ru_utime - usage.ru_utime) + (end.ru_stime - usage.ru_stime),
+        "wall_s": wall,
+    }))
+
+
+# ---------------------------------------------------------------------------
+# Analysis
+# ---------------------------------------------------------------------------
+
+def expected_transitions(fired, pin, bounce_time):
+    """Settled level changes an ideal debouncer reports for ``pin``.
+
+    A level held for at least ``bounce_time`` is a real state; the
+    transition into it starts at the first edge after the previous real
+    state ended.
+    """
+    edges = [(t, level) for t, p, level in fired if p == pin]
+    transitions = []
+    settled = HIGH
+    burst_start = None
+    for i, (t, level) in enumerate(edges):
+        if burst_start is None:
+            burst_start = t
+        held_until = edges[i + 1][0] if i + 1 < len(edges) else float("inf")
+        if held_until - t >= bounce_time:
+            if level != settled:
+                transitions.append((burst_start, level))
+                settled = level
+            burst_start = None
+    return transitions
+
+
+def percentiles(values):
+    if not values:
+        return None
+    values = sorted(values)
+    pick = lambda q: values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+    return {"p50": round(pick(0.5), 2), "p95": round(pick(0.95), 2), "max": round(values[-1], 2)}
+
+
+def analyze(run, expect):
+    # Hook: match the ideal transitions in order against the reported ones
+    expected = expected_transitions(run["fired"], "hook", BOUNCE_TIME)
+    reported = [(t, e["off_hook"]) for t, e in run["observed"] if e["event"] == "hook"]
+    missed = 0
+    latencies = []
+    j = 0
+    for at, level in expected:
+        off_hook = level == LOW
+        k = j
+        while k < len(reported) and (reported[k][1] != off_hook or reported[k][0] < at):
+            k += 1
+        if k == len(reported):
+            missed += 1
+            continue
+        latencies.append((reported[k][0] - at) * 1000)
+        j = k + 1
+    unexpected = len(reported) - len(latencies)
+
+    counts = collections.Counter(e["event"] for _, e in run["observed"])
+    derived_missed = {
+        event: n - counts[event] for event, n in expect.items() if counts[event] < n
+    }
+
+    stages = collections.defaultdict(list)
+    for trace in run["traces"]:
+        ev = trace["events"]
+        for stage, (a, b) in STAGES.items():
+            if a in ev and b in ev:
+                stages[stage].append((ev[b] - ev[a]) * 1000)
+    return {
+        "edges": len(run["fired"]),
+        "transitions": len(expected),
+        "missed": missed + sum(derived_missed.values()),
+        "missed_events": derived_missed,
+        "unexpected": unexpected,
+        "edge_to_event_ms": percentiles(latencies),
+        "stages_ms": {stage: percentiles(v) for stage, v in stages.items()},
+        "cpu_s": round(run["cpu_s"], 3),
+        "wall_s": round(run["wall_s"], 2),
+    }
+
+
+# Stage latencies reported from the call traces (real milliseconds)
+STAGES = {
+    "edge_to_settled": ("edge_detected", "debounce_settled"),
+    "delay_to_greeting": ("greeting_delay_end", "greeting_first_sample"),
+    "beep_to_first_frame": ("beep_end", "first_captured_frame"),
+    "hangup_to_closed": ("on_hook", "file_closed"),
+}
+
+
+def run_scenario(name, edges, expect, speed):
+    with tempfile.TemporaryDirectory(prefix="agb-sim-") as tmp:
+        workdir = Path(tmp)
+        bindir = workdir / "bin"
+        bindir.mkdir()
+        arecord = bindir / "arecord"
+        arecord.write_text(FAKE_ARECORD.format(python=sys.executable))
+        arecord.chmod(0o755)
+        spec = workdir / "spec.json"
+        spec.write_text(json.dumps({
+            "workdir": str(workdir),
+            "speed": speed,
+            "config": scaled_config(speed, workdir),
+            "edges": sorted(edges),
+        }))
+        result = workdir / "result.json"
+        env = dict(os.environ, PATH=f"{bindir}{os.pathsep}{os.environ.get('PATH', '')}")
+        proc = subprocess.run(
+            [sys.executable, __file__, "--child", str(spec), str(result)],
+            env=env, stderr=subprocess.PIPE, text=True,
+        )
+        if proc.returncode != 0 or not result.exists():
+            sys.stderr.write(proc.stderr)
+            raise SystemExit(f"{name}: daemon run failed (exit {proc.returncode})")
+        return analyze(json.loads(result.read_text()), expect)
+
+
+def fmt(p):
+    return "-" if p is None else f"{p['p50']:.1f}/{p['p95']:.1f}/{p['max']:.1f}"
+
+
+def print_report(results, speed):
+    print(f"\nSimulated at {speed}x (latencies in real ms, p50/p95/max)\n")
+    header = f"{'scenario':<16} {'edges':>5} {'trans':>5} {'missed':>6} {'unexp':>5} " \
+             f"{'edge->event':>18} {'delay->greeting':>18} {'beep->frame':>18} {'cpu s':>6} {'wall s':>6}"
+    print(header)
+    print("-" * len(header))
+    for name, r in results.items():
+        print(
+            f"{name:<16} {r['edges']:>5} {r['transitions']:>5} {r['missed']:>6} {r['unexpected']:>5} "
+            f"{fmt(r['edge_to_event_ms']):>18} {fmt(r['stages_ms'].get('delay_to_greeting')):>18} "
+            f"{fmt(r['stages_ms'].get('beep_to_first_frame')):>18} {r['cpu_s']:>6.2f} {r['wall_s']:>6.1f}"
+        )
+        if r["missed_events"]:
+            print(f"{'':<16} missing: {r['missed_events']}")
+
+
+def regressions(results, baseline, tolerance):
+    """Problems compared with a saved run; wrong transitions always count."""
+    problems = []
+    for name, r in results.items():
+        if r["missed"]:
+            problems.append(f"{name}: {r['missed']} missed transitions")
+        if r["unexpected"]:
+            problems.append(f"{name}: {r['unexpected']} unexpected transitions")
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if r["cpu_s"] > base["cpu_s"] * (1 + tolerance) + 0.05:
+            problems.append(f"{name}: CPU {r['cpu_s']:.2f}s (was {base['cpu_s']:.2f}s)")
+        now, then = r["edge_to_event_ms"], base["edge_to_event_ms"]
+        if now and then and now["p95"] > then["p95"] * (1 + tolerance) + 5:
+            problems.append(f"{name}: edge->event p95 {now['p95']:.1f} ms (was {then['p95']:.1f} ms)")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate the guestbook daemon without hardware.")
+    parser.add_argument("-s", "--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="scenario to run (repeatable; default: all)")
+    parser.add_argument("--edges", help="replay a JSONL edge file instead of the scenarios")
+    parser.add_argument("--call-traces", help="replay the hook edges of a daemon call_traces.jsonl")
+    parser.add_argument("--speed", type=float, default=10.0, help="time compression (default 10)")
+    parser.add_argument("--save", help="write the results as JSON (a baseline)")
+    parser.add_argument("--baseline", help="compare against saved results; exit 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=0.5,
+                        help="allowed relative slowdown against the baseline (default 0.5)")
+    parser.add_argument("--child", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(*args.child)
+        return
+
+    runs = {}
+    if args.edges:
+        runs[Path(args.edges).stem] = (compress(load_edges(args.edges), args.speed), {})
+    elif args.call_traces:
+        runs["call_traces"] = (compress(edges_from_call_traces(args.call_traces), args.speed), {})
+    else:
+        for name in args.scenario or SCENARIOS:
+            script = Script(args.speed)
+            SCENARIOS[name](script)
+            runs[name] = (script.edges, script.expect)
+
+    results = {}
+    for name, (edges, expect) in runs.items():
+        print(f"Running {name} ({len(edges)} edges)...", file=sys.stderr)
+        results[name] = run_scenario(name, edges, expect, args.speed)
+    print_report(results, args.speed)
+
+    if args.save:
+        Path(args.save).write_text(json.dumps(results, indent=2) + "\n")
+    baseline = json.loads(Path(args.baseline).read_text()) if args.baseline else {}
+    problems = regressions(results, baseline, args.tolerance)
+    for problem in problems:
+        print(f"REGRESSION {problem}")
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -11,7 +11,7 @@ It only does the bits that make the device app safe and runnable on a laptop:
   isolated ``test/`` directories.
 * Points the server at that config + an isolated uploads dir via the
   ``AGB_CONFIG_PATH`` / ``AGB_UPLOAD_FOLDER`` env overrides.
-* Stubs out the device-only side effects (``systemctl restart`` on config save,
+* Stubs out the device-only side effects (``systemctl reload`` on config save,
   and ``reboot`` / ``shutdown``) so the buttons are harmless to click.
 
 Run:
@@ -45,7 +45,8 @@ sys.path.insert(0, str(PROJECT_ROOT))
 TEST_RECORDINGS_DIR = TEST_DIR / "recordings"
 TEST_UPLOADS_DIR = TEST_DIR / "uploads"
 TEST_SOUNDS_DIR = TEST_DIR / "sounds"
-for _d in (TEST_RECORDINGS_DIR, TEST_UPLOADS_DIR, TEST_SOUNDS_DIR):
+TEST_CACHE_DIR = TEST_DIR / "cache"
+for _d in (TEST_RECORDINGS_DIR, TEST_UPLOADS_DIR, TEST_SOUNDS_DIR, TEST_CACHE_DIR):
     _d.mkdir(exist_ok=True)
 
 # Build the test config from the installer's own template so it never drifts:
@@ -57,6 +58,7 @@ TEST_CONFIG = TEST_DIR / "test_config.yaml"
 
 config = yaml.load(TEMPLATE.read_text().replace("__INSTALL_DIR__", str(TEST_DIR)))
 config["recordings_path"] = str(TEST_RECORDINGS_DIR)
+config["cache_path"] = str(TEST_CACHE_DIR)
 with TEST_CONFIG.open("w") as f:
     yaml.dump(config, f)
 
@@ -65,7 +67,7 @@ os.environ["AGB_CONFIG_PATH"] = str(TEST_CONFIG)
 os.environ["AGB_UPLOAD_FOLDER"] = str(TEST_UPLOADS_DIR)
 
 # Neuter device-only side effects (this is a dedicated, throwaway process):
-#   * edit_config() shells out to `sudo systemctl restart audioGuestBook.service`
+#   * edit_config() shells out to `sudo systemctl reload audioGuestBook.service`
 #   * reboot() / shutdown() call os.system("sudo reboot/shutdown ...")
 mock.patch(
     "webserver.server.subprocess.run",
@@ -76,7 +78,9 @@ mock.patch(
     side_effect=lambda cmd: logger.info("suppressed os.system: %s", cmd),
 ).start()
 
-from webserver.server import app  # noqa: E402  (must follow env setup + patches)
+from webserver.server import create_app  # noqa: E402  (must follow env setup + patches)
+
+app = create_app()
 
 if __name__ == "__main__":
     print("\n=== Audio Guestbook test server (real app, device actions mocked) ===")
@@ -0,0 +1,181 @@
+"""What the web server's routes share, built on first use.
+
+:func:`webserver.server.create_app` only creates an :class:`AppState`; the
+config is read and the recordings index, caches, daemon event relay and
+metrics sampler are set up by the first request that needs them. A worker
+therefore starts without touching the SD card, and one that never serves a
+request never opens the index.
+
+Paths and components are built from the config as it was when they were
+first used; changing ``recordings_path`` or ``cache_path`` needs a web
+server restart.
+"""
+
+import logging
+import threading
+from pathlib import Path
+
+from webserver.backup import BackupRunner
+from webserver.call_traces import CallTraceSummary
+from webserver.config_store import ConfigStore
+from webserver.events import EventHub
+from webserver.metrics import MetricsSampler
+from webserver.peaks import PeaksCache
+from webserver.recordings_index import RecordingsIndex, is_recording_name
+from webserver.take_analysis import AnalysisRunner
+from webserver.transcode import RenditionCache
+from webserver.transcription import TranscriptionRunner
+
+logger = logging.getLogger(__name__)
+
+
+class AppState:
+    """Lazily built, per-worker state of the web app."""
+
+    def __init__(self, config_path, upload_folder, base_dir):
+        self.config_path = Path(config_path)
+        self.upload_folder = Path(upload_folder)
+        self.base_dir = Path(base_dir)
+        self.config_store = ConfigStore(self.config_path)
+        self._lock = threading.RLock()
+        self._components = {}
+
+    @property
+    def config(self):
+        """Read-only snapshot of config.yaml (see ConfigStore)."""
+        return self.config_store.get()
+
+    def _component(self, name, build):
+        try:
+            return self._components[name]
+        except KeyError:
+            pass
+        with self._lock:
+            if name not in self._components:
+                self._components[name] = build()
+            return self._components[name]
+
+    def _resolve(self, key, default):
+        path = Path(self.config.get(key, default))
+        if not path.is_absolute():
+            path = self.base_dir / path
+        return path
+
+    def start(self):
+        """Start the background work (event relay, metrics); idempotent."""
+        self.event_hub
+        self.metrics
+
+    @property
+    def recordings_path(self):
+        def build():
+            path = self._resolve("recordings_path", "recordings")
+            if not path.exists():
+                logger.warning(f"Recordings directory does not exist, creating it: {path}")
+                path.mkdir(parents=True, exist_ok=True)
+            elif not path.is_dir():
+                raise NotADirectoryError(f"Recordings path is not a directory: {path}")
+            logger.info(f"Recordings directory: {path}")
+            return path
+
+        return self._component("recordings_path", build)
+
+    @property
+    def cache_path(self):
+        # Derived data (recordings index, caches) lives outside the recordings folder
+        return self._component("cache_path", lambda: self._resolve("cache_path", "cache"))
+
+    @property
+    def recordings_index(self):
+        def build():
+            index = RecordingsIndex(self.cache_path / "recordings.sqlite3", self.recordings_path)
+            logger.info(f"Recordings index: {index.db_path}")
+            return index
+
+        return self._component("recordings_index", build)
+
+    @property
+    def analysis_runner(self):
+        return self._component(
+            "analysis_runner", lambda: AnalysisRunner(self.config_path, self.base_dir)
+        )
+
+    def kick_analysis(self):
+        """Measure new recordings in the background, unless a call is in progress."""
+        self.analysis_runner.kick(self.recordings_index, self.call_active())
+
+    @property
+    def transcription_runner(self):
+        return self._component(
+            "transcription_runner", lambda: TranscriptionRunner(self.config_path, self.base_dir)
+        )
+
+    def kick_transcription(self):
+        """Transcribe new recordings in the background, unless a call is in progress."""
+        self.transcription_runner.kick(self.recordings_index, self.config, self.call_active())
+
+    @property
+    def backup_runner(self):
+        return self._component(
+            "backup_runner", lambda: BackupRunner(self.config_path, self.base_dir, self.cache_path)
+        )
+
+    @property
+    def peaks_cache(self):
+        return self._component(
+            "peaks_cache", lambda: PeaksCache(self.cache_path / "peaks", self.recordings_path)
+        )
+
+    @property
+    def renditions(self):
+        return self._component("renditions", lambda: RenditionCache(
+            self.cache_path / "renditions",
+            int(self.config.get("rendition_cache_mb", 256)) * 1024 * 1024,
+        ))
+
+    @property
+    def event_hub(self):
+        """Live daemon events (see src/events.py); new files go straight into the index."""
+        def build():
+            hub = EventHub(self.config.get("event_socket"))
+            hub.add_listener(self._index_new_recording)
+            hub.start()
+            return hub
+
+        return self._component("event_hub", build)
+
+    def _index_new_recording(self, event):
+        name = event.get("name", "")
+        if event.get("event") == "file_created" and name == Path(name).name and is_recording_name(name):
+            self.recordings_index.update(name)
+            self.kick_analysis()
+            self.kick_transcription()
+
+    def call_active(self):
+        """Whether the phone is in use, or None if the daemon is not reachable."""
+        hub = self.event_hub
+        if not hub.connected:
+            return None
+        return bool(hub.state.get("off_hook") or hub.state.get("recording"))
+
+    @property
+    def metrics(self):
+        """System metrics, sampled on a fixed cadence; requests read the buffer."""
+        def build():
+            sampler = MetricsSampler(
+                self.recordings_index,
+                self.call_active,
+                float(self.config.get("metrics_interval", 5)),
+                int(self.config.get("metrics_history", 720)),
+            )
+            sampler.start()
+            return sampler
+
+        return self._component("metrics", build)
+
+    @property
+    def call_traces(self):
+        """Latency traces the daemon writes per call (see src/call_trace.py)."""
+        return self._component(
+            "call_traces", lambda: CallTraceSummary(self.cache_path / "call_traces.jsonl")
+        )
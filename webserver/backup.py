@@ -0,0 +1,424 @@
+"""Incremental backup of the recordings to a mounted drive, such as a USB stick.
+
+:func:`run_backup` mirrors the recordings in ``recordings_path`` into
+``backup_path``. A manifest in the target (``.agb-backup.json``) records the
+size, mtime and SHA-256 of every file backed up, so a run only copies
+recordings that are new or changed since the last one; unchanged files are
+not even read. Recordings deleted from the device are kept on the target.
+
+Files are copied on a few threads at once. Each copy is hashed as it is
+read, written to a hidden ``.<name>.part`` file, synced, dropped from the
+page cache and read back from the drive; only a copy whose hash matches
+gets its real name and goes into the manifest. A stick pulled out mid-run
+leaves at most hidden partial files, and the next run picks up where this
+one stopped.
+
+Progress is written to ``cache_path/backup.json`` while the run goes on, and
+an exclusive lock on ``cache_path/backup.lock`` keeps two runs from copying
+at the same time. Run by hand from the install directory::
+
+    python -m webserver.backup [--target DIR] [--workers N] [--verify]
+
+The web interface starts the same command in the background (see
+:class:`BackupRunner`).
+"""
+
+import argparse
+import contextlib
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from webserver.recordings_index import is_recording_name
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = ".agb-backup.json"
+MANIFEST_VERSION = 1
+
+CHUNK_SIZE = 1024 * 1024
+
+# How often the progress file (and, during long runs, the manifest) is written
+STATUS_SECONDS = 0.5
+MANIFEST_SECONDS = 10.0
+
+# Errors kept in the progress file
+MAX_ERRORS = 20
+
+
+class BackupError(Exception):
+    """The backup cannot start (no target, target not mounted, already running)."""
+
+
+def load_manifest(target):
+    """``{name: {"size", "mtime_ns", "sha256"}}`` of what is in ``target``."""
+    try:
+        with (Path(target) / MANIFEST_NAME).open("r") as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable backup manifest, everything will be copied: {e}")
+        return {}
+    if data.get("version") != MANIFEST_VERSION or not isinstance(data.get("files"), dict):
+        return {}
+    return data["files"]
+
+
+def save_manifest(target, files):
+    path = Path(target) / MANIFEST_NAME
+    tmp = path.with_name(path.name + ".tmp")
+    with tmp.open("w") as f:
+        json.dump({"version": MANIFEST_VERSION, "updated_at": time.time(), "files": files}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def hash_file(path):
+    """SHA-256 of ``path`` as read from the drive, not the page cache."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        # Written pages are clean after an fsync, so this drops them and the
+        # reads below come from the drive
+        os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+        while chunk := f.read(CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def copy_verified(source, dest, progress=None):
+    """Copy ``source`` to ``dest`` and check the copy against the source.
+
+    Returns the manifest entry (size and mtime of the source as read, and
+    its SHA-256). ``progress(n)`` is called as bytes are written. Raises
+    OSError, or ValueError if the copy reads back differently.
+    """
+    tmp = dest.with_name(f".{dest.name}.part")
+    digest = hashlib.sha256()
+    try:
+        with open(source, "rb") as src, open(tmp, "wb") as dst:
+            # The file as opened: a recording replaced meanwhile (by
+            # post-processing) has a newer mtime and is copied next run
+            st = os.fstat(src.fileno())
+            while chunk := src.read(CHUNK_SIZE):
+                digest.update(chunk)
+                dst.write(chunk)
+                if progress:
+                    progress(len(chunk))
+            dst.flush()
+            os.fsync(dst.fileno())
+        sha256 = digest.hexdigest()
+        if hash_file(tmp) != sha256:
+            raise ValueError("copy does not match the original")
+        os.utime(tmp, ns=(st.st_atime_ns, st.st_mtime_ns))
+        os.replace(tmp, dest)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            tmp.unlink()
+        raise
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": sha256}
+
+
+def check_target(target, recordings_path, allow_same_device=False):
+    """Make sure ``target`` is a mounted drive and create it; raises BackupError.
+
+    A target on the same filesystem as the recordings is refused unless
+    ``allow_same_device``: that is the mount point of a drive that is not
+    plugged in, and copying into it would fill the SD card.
+    """
+    target = Path(target)
+    existing = target
+    while not existing.exists():
+        existing = existing.parent
+    if not allow_same_device and os.stat(existing).st_dev == os.stat(recordings_path).st_dev:
+        raise BackupError(f"{target} is not on a mounted drive (is the USB stick plugged in?)")
+    try:
+        target.mkdir(parents=True, exist_ok=True)
+    except OSError as e:
+        raise BackupError(f"Cannot create {target}: {e}") from e
+    if not os.access(target, os.W_OK):
+        raise BackupError(f"{target} is not writable")
+
+
+class BackupProgress:
+    """Counters of a run, written to the status file as they change."""
+
+    def __init__(self, status_path, target):
+        self.status_path = Path(status_path) if status_path else None
+        self._lock = threading.Lock()
+        self._written_at = 0.0
+        self.status = {
+            "state": "running",
+            "target": str(target),
+            "started_at": time.time(),
+            "finished_at": None,
+            "files_total": 0,
+            "bytes_total": 0,
+            "files_done": 0,
+            "bytes_done": 0,
+            "copied": 0,
+            "skipped": 0,
+            "failed": 0,
+            "bytes_per_second": None,
+            "errors": [],
+            "message": None,
+        }
+
+    def update(self, force=False, **counts):
+        """Add ``counts`` to the counters and write the file (at most every STATUS_SECONDS)."""
+        with self._lock:
+            for key, value in counts.items():
+                if key == "error":
+                    self.status["errors"] = (self.status["errors"] + [value])[-MAX_ERRORS:]
+                else:
+                    self.status[key] += value
+            now = time.monotonic()
+            if not force and now - self._written_at < STATUS_SECONDS:
+                return
+            self._written_at = now
+            elapsed = time.time() - self.status["started_at"]
+            if elapsed > 0:
+                self.status["bytes_per_second"] = round(self.status["bytes_done"] / elapsed)
+            write_status(self.status_path, self.status)
+
+    def finish(self, state, message=None):
+        with self._lock:
+            self.status["state"] = state
+            self.status["message"] = message
+            self.status["finished_at"] = time.time()
+        self.update(force=True)
+
+
+def write_status(status_path, status):
+    if status_path is None:
+        return
+    try:
+        status_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = status_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(status))
+        os.replace(tmp, status_path)
+    except OSError as e:
+        logger.error(f"Could not write backup status: {e}")
+
+
+def read_status(status_path):
+    """The last run's progress file, or None if there has not been one."""
+    try:
+        with Path(status_path).open("r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+@contextlib.contextmanager
+def backup_lock(lock_path):
+    """Hold the backup lock; raises BackupError if another run has it."""
+    lock_path = Path(lock_path)
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    with lock_path.open("w") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise BackupError("A backup is already running") from None
+        yield
+
+
+def is_running(lock_path):
+    """Whether a backup holds the lock right now."""
+    try:
+        with backup_lock(lock_path):
+            return False
+    except BackupError:
+        return True
+
+
+def run_backup(recordings_path, target, cache_path, workers=2, verify=False, allow_same_device=False):
+    """Back up new and changed recordings to ``target``; returns the final status.
+
+    With ``verify`` the copies already on the target are read back and
+    checked against the manifest too, and copied again if they differ.
+    Raises BackupError if the backup cannot start.
+    """
+    recordings_path = Path(recordings_path)
+    target = Path(target)
+    cache_path = Path(cache_path)
+    with backup_lock(cache_path / "backup.lock"):
+        progress = BackupProgress(cache_path / "backup.json", target)
+        try:
+            check_target(target, recordings_path, allow_same_device)
+        except BackupError as e:
+            progress.finish("failed", str(e))
+            raise
+
+        manifest = load_manifest(target)
+        manifest_lock = threading.Lock()
+        saved_at = time.monotonic()
+
+        # Decide from stat() alone what needs copying
+        pending = []
+        skipped = 0
+        with os.scandir(recordings_path) as entries:
+            for entry in entries:
+                if not is_recording_name(entry.name) or not entry.is_file():
+                    continue
+                st = entry.stat()
+                known = manifest.get(entry.name)
+                dest = target / entry.name
+                unchanged = (
+                    known is not None
+                    and known["size"] == st.st_size
+                    and known["mtime_ns"] == st.st_mtime_ns
+                    and dest.is_file()
+                    and dest.stat().st_size == st.st_size
+                )
+                if unchanged and not (verify and hash_file(dest) != known["sha256"]):
+                    skipped += 1
+                    continue
+                pending.append((entry.name, st.st_size))
+        progress.update(
+            force=True, files_total=len(pending), bytes_total=sum(size for _, size in pending),
+            skipped=skipped,
+        )
+        logger.info(f"Backing up {len(pending)} recordings to {target}, {skipped} unchanged")
+
+        def copy_one(name):
+            nonlocal saved_at
+            try:
+                entry = copy_verified(
+                    recordings_path / name, target / name, lambda n: progress.update(bytes_done=n)
+                )
+            except FileNotFoundError:
+                # Deleted since the scan
+                progress.update(files_done=1)
+                return
+            except (OSError, ValueError) as e:
+                logger.error(f"Could not back up {name}: {e}")
+                progress.update(files_done=1, failed=1, error=f"{name}: {e}")
+                return
+            with manifest_lock:
+                manifest[name] = entry
+                # Keep the manifest current on long runs, in case the stick
+                # is pulled out before the end
+                if time.monotonic() - saved_at >= MANIFEST_SECONDS:
+                    save_manifest(target, manifest)
+                    saved_at = time.monotonic()
+            progress.update(files_done=1, copied=1)
+
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+                list(pool.map(copy_one, [name for name, _ in pending]))
+            with manifest_lock:
+                save_manifest(target, manifest)
+        except OSError as e:
+            progress.finish("failed", str(e))
+            raise BackupError(f"Backup to {target} failed: {e}") from e
+
+        status = progress.status
+        failed = status["failed"]
+        progress.finish(
+            "failed" if failed else "done",
+            f"{failed} recordings could not be backed up" if failed else None,
+        )
+        logger.info(
+            f"Backed up {status['copied']} recordings ({status['bytes_done'] / 1e6:.1f} MB) "
+            f"in {status['finished_at'] - status['started_at']:.1f}s, "
+            f"{status['skipped']} unchanged, {failed} failed"
+        )
+        return dict(status)
+
+
+class BackupRunner:
+    """Starts the backup command in the background for the web interface.
+
+    The run is a separate, low-priority process; any worker can tell whether
+    it is going from the lock, and read its progress from the status file.
+    """
+
+    def __init__(self, config_path, cwd, cache_path):
+        self.config_path = Path(config_path)
+        self.cwd = Path(cwd)
+        self.lock_path = Path(cache_path) / "backup.lock"
+        self.status_path = Path(cache_path) / "backup.json"
+        self._proc = None
+
+    def running(self):
+        if self._proc is not None and self._proc.poll() is not None:
+            self._proc = None
+        return self._proc is not None or is_running(self.lock_path)
+
+    def start(self):
+        """Start a run; raises BackupError if one is already going."""
+        if self.running():
+            raise BackupError("A backup is already running")
+        env = dict(os.environ, AGB_CONFIG_PATH=str(self.config_path))
+        # Idle I/O priority: the copy never holds up a recording being saved
+        self._proc = subprocess.Popen(
+            ["ionice", "-c", "3", "nice", "-n", "10", sys.executable, "-m", "webserver.backup"],
+            cwd=str(self.cwd), env=env,
+        )
+
+    def status(self):
+        status = read_status(self.status_path) or {"state": None}
+        status["running"] = self.running()
+        if status["state"] == "running" and not status["running"]:
+            # The run was killed before it could say so
+            status["state"] = "failed"
+            status["message"] = status.get("message") or "The backup stopped unexpectedly"
+        return status
+
+
+def main():
+    from ruamel.yaml import YAML
+
+    parser = argparse.ArgumentParser(
+        description="Copy new and changed recordings to a USB stick (or any folder)."
+    )
+    parser.add_argument("--config", help="config.yaml (default: AGB_CONFIG_PATH or ./config.yaml)")
+    parser.add_argument("--target", help="folder to back up to (default: backup_path from the config)")
+    parser.add_argument("--workers", type=int, help="files copied at once (default: backup_workers or 2)")
+    parser.add_argument("--verify", action="store_true",
+                        help="also read back the copies already on the target and fix any that differ")
+    parser.add_argument("--allow-same-device", action="store_true",
+                        help="allow a target on the same drive as the recordings (for testing)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    base_dir = Path(__file__).parent.parent
+    config_path = Path(args.config or os.environ.get("AGB_CONFIG_PATH", base_dir / "config.yaml"))
+    with config_path.open("r") as f:
+        config = YAML(typ="safe").load(f)
+
+    def resolve(key, default):
+        path = Path(config.get(key, default))
+        return path if path.is_absolute() else base_dir / path
+
+    target = args.target or (config.get("backup_path") and resolve("backup_path", ""))
+    if not target:
+        logger.error("No target: set backup_path in the config or pass --target")
+        return 2
+    try:
+        status = run_backup(
+            resolve("recordings_path", "recordings"),
+            target,
+            resolve("cache_path", "cache"),
+            args.workers or int(config.get("backup_workers", 2)),
+            args.verify,
+            args.allow_same_device or bool(config.get("backup_allow_same_device", False)),
+        )
+    except BackupError as e:
+        logger.error(str(e))
+        return 1
+    return 1 if status["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,108 @@
+"""Latency summaries of the daemon's per-call traces.
+
+The daemon appends one JSON line per call to ``cache_path/call_traces.jsonl``
+(see ``src/call_trace.py``). :class:`CallTraceSummary` turns the last
+``window`` calls into per-stage p50/p95/p99, re-reading the file only when it
+has changed, and :func:`render_prometheus` formats them as a Prometheus
+summary for ``/metrics``.
+"""
+
+import collections
+import json
+import logging
+import threading
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+# Stage -> (from event, to event); see src/call_trace.py for the events
+STAGES = {
+    # Interrupt to the hook loop acting on it
+    "edge_to_settled": ("edge_detected", "debounce_settled"),
+    # What the guest waits for after lifting, greeting_start_delay included
+    "lift_to_greeting": ("edge_detected", "greeting_first_sample"),
+    # Audio start-up cost on top of greeting_start_delay
+    "delay_to_greeting": ("greeting_delay_end", "greeting_first_sample"),
+    "beep_to_capture": ("beep_end", "capture_started"),
+    "beep_to_first_frame": ("beep_end", "first_captured_frame"),
+    "hangup_to_closed": ("on_hook", "file_closed"),
+}
+
+
+class CallTraceSummary:
+    """Per-stage latency quantiles over the last ``window`` traced calls."""
+
+    def __init__(self, path, window=1000):
+        self.path = path
+        self.window = window
+        self._lock = threading.Lock()
+        self._stamp = None
+        self._summary = None
+
+    def get(self):
+        """``{"calls": {outcome: n}, "stages": {stage: {...}}}``."""
+        try:
+            st = self.path.stat()
+            stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            stamp = None
+        with self._lock:
+            if self._summary is None or stamp != self._stamp:
+                self._summary = self._summarize(self._read() if stamp else [])
+                self._stamp = stamp
+            return self._summary
+
+    def _read(self):
+        traces = []
+        with self.path.open("r") as f:
+            for line in collections.deque(f, maxlen=self.window):
+                try:
+                    traces.append(json.loads(line))
+                except ValueError:
+                    # A line cut short by a power loss
+                    logger.warning("Skipping malformed call trace line")
+        return traces
+
+    @staticmethod
+    def _summarize(traces):
+        calls = collections.Counter(t.get("outcome") or "unknown" for t in traces)
+        stages = {}
+        for stage, (start, end) in STAGES.items():
+            durations = np.array([
+                t["events"][end] - t["events"][start]
+                for t in traces
+                if start in t.get("events", {}) and end in t.get("events", {})
+            ])
+            if not len(durations):
+                continue
+            stages[stage] = {
+                "count": len(durations),
+                "sum": float(durations.sum()),
+                "quantiles": {
+                    q: float(v) for q, v in zip(QUANTILES, np.quantile(durations, QUANTILES))
+                },
+            }
+        return {"calls": dict(calls), "stages": stages}
+
+
+def render_prometheus(summary):
+    """Prometheus text exposition (version 0.0.4) of a summary."""
+    lines = [
+        "# HELP agb_call_stage_seconds Latency of each step of a call, over the recent traced calls.",
+        "# TYPE agb_call_stage_seconds summary",
+    ]
+    for stage, data in summary["stages"].items():
+        for q, value in data["quantiles"].items():
+            lines.append(f'agb_call_stage_seconds{{stage="{stage}",quantile="{q}"}} {value:.6f}')
+        lines.append(f'agb_call_stage_seconds_sum{{stage="{stage}"}} {data["sum"]:.6f}')
+        lines.append(f'agb_call_stage_seconds_count{{stage="{stage}"}} {data["count"]}')
+    lines += [
+        "# HELP agb_traced_calls Recent traced calls by outcome.",
+        "# TYPE agb_traced_calls gauge",
+    ]
+    for outcome, count in sorted(summary["calls"].items()):
+        lines.append(f'agb_traced_calls{{outcome="{outcome}"}} {count}')
+    return "\n".join(lines) + "\n"
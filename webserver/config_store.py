@@ -0,0 +1,107 @@
+"""config.yaml as seen by the web server workers.
+
+Each worker holds one parsed snapshot of the file and hands it out
+read-only. The snapshot is re-read only when the file's (inode, mtime, size)
+stamp changes, so a save made by another worker, or by hand, is picked up
+on the next request. Saves go through :meth:`ConfigStore.update`, which
+holds an exclusive lock on ``.config.yaml.lock`` while it re-reads, edits
+and atomically replaces the file, so two workers saving at the same time
+cannot undo each other's changes.
+"""
+
+import contextlib
+import fcntl
+import logging
+import os
+import tempfile
+import threading
+from pathlib import Path
+from types import MappingProxyType
+
+from ruamel.yaml import YAML
+
+logger = logging.getLogger(__name__)
+
+
+class ConfigStore:
+    """Shared, read-only snapshot of a YAML config file."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._yaml = YAML()
+        self._lock = threading.Lock()
+        self._stamp = None
+        # Never modified once loaded; update() replaces it
+        self._data = None
+
+    def _read_stamp(self):
+        try:
+            st = self.path.stat()
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _load(self):
+        with self.path.open("r") as f:
+            data = self._yaml.load(f)
+        if not isinstance(data, dict):
+            raise ValueError(f"{self.path} is not a YAML mapping")
+        return data
+
+    def get(self):
+        """The current config as a read-only mapping.
+
+        Raises FileNotFoundError if there is no config file.
+        """
+        stamp = self._read_stamp()
+        with self._lock:
+            if self._data is None or stamp != self._stamp:
+                self._data = self._load()
+                self._stamp = stamp
+                logger.info(f"Config loaded from {self.path}")
+            return MappingProxyType(self._data)
+
+    @contextlib.contextmanager
+    def _file_lock(self):
+        lock_path = self.path.with_name(f".{self.path.name}.lock")
+        with open(lock_path, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def update(self, edit):
+        """Save the config with ``edit(config)`` applied; returns the new snapshot.
+
+        ``edit`` is given a mutable copy of the file as it is on disk now,
+        not of this worker's snapshot, so concurrent saves are serialized.
+        """
+        with self._lock, self._file_lock():
+            data = self._load()
+            edit(data)
+            self._write(data)
+            self._data = data
+            self._stamp = self._read_stamp()
+            return MappingProxyType(data)
+
+    def _write(self, data):
+        """Write ``data`` to the config file atomically.
+
+        The guestbook service watches the file, so it must never see it half
+        written: dump to a temporary file next to it, then rename over it.
+        """
+        fd, tmp = tempfile.mkstemp(dir=self.path.parent, prefix=".config.", suffix=".tmp")
+        try:
+            try:
+                os.fchmod(fd, self.path.stat().st_mode & 0o777)
+            except FileNotFoundError:
+                pass
+            with os.fdopen(fd, "w") as f:
+                self._yaml.dump(data, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
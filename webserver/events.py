@@ -0,0 +1,126 @@
+"""Fan-out of daemon events to browsers over server-sent events.
+
+:class:`EventHub` keeps one connection to the daemon's event socket (see
+``src/events.py``) and copies every event into a bounded queue per
+subscriber. ``/api/events`` streams a subscriber's queue as
+``text/event-stream``.
+
+Everything here is plain sockets, threads and queues, which gevent's
+monkey-patching (the gunicorn ``gevent`` worker) turns into greenlets: an
+open stream costs a greenlet and a queue, not a worker.
+"""
+
+import json
+import logging
+import queue
+import socket
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Events a slow browser may fall behind by before it misses some
+SUBSCRIBER_QUEUE = 256
+
+RECONNECT_SECONDS = 2.0
+
+# Comment line sent when idle, so proxies and browsers keep the stream open
+KEEPALIVE_SECONDS = 15.0
+
+
+class EventHub:
+    """Relays events from the daemon socket at ``path`` to subscribers."""
+
+    def __init__(self, path):
+        self.path = path
+        self._subscribers = set()
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._thread = None
+        # Latest daemon snapshot, and whether the daemon is reachable
+        self.state = {}
+        self.connected = False
+
+    def add_listener(self, callback):
+        """Call ``callback(event)`` for every event (from the relay thread)."""
+        self._listeners.append(callback)
+
+    def start(self):
+        """Connect to the daemon in the background (idempotent)."""
+        with self._lock:
+            if self._thread is None and self.path:
+                self._thread = threading.Thread(target=self._relay, name="event-relay", daemon=True)
+                self._thread.start()
+
+    def subscribe(self):
+        """Return a new subscriber queue, primed with the current state."""
+        q = queue.Queue(maxsize=SUBSCRIBER_QUEUE)
+        q.put({"event": "state", "connected": self.connected, **self.state})
+        with self._lock:
+            self._subscribers.add(q)
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subscribers.discard(q)
+
+    def _dispatch(self, event):
+        if event.get("event") == "state":
+            self.state = {k: v for k, v in event.items() if k not in ("event", "ts")}
+            event = {**event, "connected": self.connected}
+        else:
+            # Keep the snapshot current for subscribers joining later
+            for key in self.state.keys() & event.keys():
+                self.state[key] = event[key]
+        for callback in self._listeners:
+            try:
+                callback(event)
+            except Exception as e:
+                logger.error(f"Event listener failed on {event.get('event')}: {e}")
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for q in subscribers:
+            try:
+                q.put_nowait(event)
+            except queue.Full:
+                # Too far behind; it will resync from the next state event
+                pass
+
+    def _set_connected(self, connected):
+        if connected != self.connected:
+            self.connected = connected
+            self._dispatch({"event": "daemon", "ts": time.time(), "connected": connected})
+
+    def _relay(self):
+        while True:
+            try:
+                with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                    sock.connect(self.path)
+                    self._set_connected(True)
+                    with sock.makefile("r", encoding="utf-8") as lines:
+                        for line in lines:
+                            try:
+                                self._dispatch(json.loads(line))
+                            except ValueError:
+                                logger.warning(f"Ignoring malformed event: {line!r}")
+            except OSError:
+                pass
+            self._set_connected(False)
+            time.sleep(RECONNECT_SECONDS)
+
+
+def sse_stream(hub):
+    """Generator of SSE frames for one subscriber; unsubscribes when closed."""
+    q = hub.subscribe()
+    try:
+        # Reconnect quickly if the stream drops
+        yield "retry: 3000\n\n"
+        while True:
+            try:
+                event = q.get(timeout=KEEPALIVE_SECONDS)
+            except queue.Empty:
+                yield ": keepalive\n\n"
+                continue
+            yield f"event: {event.get('event', 'message')}\ndata: {json.dumps(event)}\n\n"
+    finally:
+        hub.unsubscribe(q)
@@ -0,0 +1,159 @@
+"""HTTP range serving for recordings.
+
+Single ranges and whole files are handed to the server's ``wsgi.file_wrapper``
+with the file positioned at the start of the range and an exact
+``Content-Length``. Gunicorn turns that into ``sendfile()``, so the bytes never
+pass through Python. Without a file wrapper (the Werkzeug dev server) a
+bounded ``os.pread`` generator is used instead.
+
+Suffix ranges (``bytes=-N``), multi-range requests (``multipart/byteranges``),
+``If-Range``, ``ETag``/``If-None-Match`` and ``Last-Modified``/
+``If-Modified-Since`` are all supported, so browser seeks and replays are
+cheap.
+"""
+
+import os
+import uuid
+from datetime import datetime, timezone
+
+from flask import Response, request
+from werkzeug.http import http_date
+
+CHUNK_SIZE = 64 * 1024
+
+# More ranges than this in one request is abuse, not seeking; send the file
+MAX_RANGES = 16
+
+
+def _etag(st):
+    return f"{st.st_size:x}-{st.st_mtime_ns:x}"
+
+
+def _pread_chunks(path, start, length):
+    """Yield ``length`` bytes of ``path`` from ``start`` without seeking."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        while length > 0:
+            chunk = os.pread(fd, min(CHUNK_SIZE, length), start)
+            if not chunk:
+                break
+            start += len(chunk)
+            length -= len(chunk)
+            yield chunk
+    finally:
+        os.close(fd)
+
+
+def _body(path, start, length):
+    """Response body for one byte span, via sendfile where the server allows."""
+    file_wrapper = request.environ.get("wsgi.file_wrapper")
+    if file_wrapper is None:
+        return _pread_chunks(path, start, length)
+    f = open(path, "rb")
+    f.seek(start)
+    # The server stops after Content-Length bytes
+    return file_wrapper(f, CHUNK_SIZE)
+
+
+def _satisfiable_ranges(file_size):
+    """Byte spans requested by a Range header, as (start, stop) pairs.
+
+    Returns None when there is no usable Range header (serve the whole file)
+    and an empty list when none of the ranges can be satisfied.
+    """
+    parsed = request.range
+    if parsed is None or parsed.units != "bytes" or len(parsed.ranges) > MAX_RANGES:
+        return None
+    spans = []
+    for start, stop in parsed.ranges:
+        if start < 0:
+            # Suffix range: the last -start bytes
+            start, stop = max(0, file_size + start), file_size
+        else:
+            stop = file_size if stop is None else min(stop, file_size)
+        if start < stop:
+            spans.append((start, stop))
+    return spans
+
+
+def _range_applies(etag, mtime):
+    """Check If-Range: only honour Range if the validator still matches."""
+    if_range = request.if_range
+    if if_range.etag is None and if_range.date is None:
+        return True
+    if if_range.etag is not None:
+        return if_range.etag == etag
+    # Only an exact match with Last-Modified identifies this version
+    return if_range.date == mtime
+
+
+def send_file_ranges(path, mimetype):
+    """Serve ``path`` honouring conditional and Range request headers."""
+    path = str(path)
+    st = os.stat(path)
+    file_size = st.st_size
+    etag = _etag(st)
+    mtime = datetime.fromtimestamp(int(st.st_mtime), tz=timezone.utc)
+
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": f'"{etag}"',
+        "Last-Modified": http_date(mtime),
+        "Cache-Control": "no-cache",
+    }
+
+    # Conditional GET: the browser already has this version
+    if request.if_none_match:
+        if request.if_none_match.contains(etag):
+            return Response(status=304, headers=headers)
+    elif request.if_modified_since and request.if_modified_since >= mtime:
+        return Response(status=304, headers=headers)
+
+    spans = _satisfiable_ranges(file_size) if _range_applies(etag, mtime) else None
+
+    if spans == []:
+        headers["Content-Range"] = f"bytes */{file_size}"
+        return Response(status=416, headers=headers)
+
+    if not spans:
+        headers["Content-Length"] = str(file_size)
+        return Response(
+            _body(path, 0, file_size), status=200, mimetype=mimetype,
+            headers=headers, direct_passthrough=True,
+        )
+
+    if len(spans) == 1:
+        start, stop = spans[0]
+        headers["Content-Range"] = f"bytes {start}-{stop - 1}/{file_size}"
+        headers["Content-Length"] = str(stop - start)
+        return Response(
+            _body(path, start, stop - start), status=206, mimetype=mimetype,
+            headers=headers, direct_passthrough=True,
+        )
+
+    # Several ranges: multipart/byteranges with a part per span
+    boundary = uuid.uuid4().hex
+    parts = []
+    for start, stop in spans:
+        part_header = (
+            f"\r\n--{boundary}\r\n"
+            f"Content-Type: {mimetype}\r\n"
+            f"Content-Range: bytes {start}-{stop - 1}/{file_size}\r\n\r\n"
+        ).encode()
+        parts.append((part_header, start, stop))
+    closing = f"\r\n--{boundary}--\r\n".encode()
+    headers["Content-Length"] = str(
+        sum(len(h) + stop - start for h, start, stop in parts) + len(closing)
+    )
+
+    def generate():
+        for part_header, start, stop in parts:
+            yield part_header
+            yield from _pread_chunks(path, start, stop - start)
+        yield closing
+
+    return Response(
+        generate(), status=206,
+        content_type=f"multipart/byteranges; boundary={boundary}",
+        headers=headers, direct_passthrough=True,
+    )
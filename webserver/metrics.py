@@ -0,0 +1,127 @@
+"""Background sampling of system metrics for the dashboard.
+
+:class:`MetricsSampler` takes a sample every ``metrics_interval`` seconds on
+its own thread (a greenlet under the gunicorn gevent worker) and keeps the
+last ``metrics_history`` samples in a ring buffer. Requests only read the
+buffer, so ``/api/system-status`` costs the same however often it is polled,
+and CPU usage is always the average over one sampling interval rather than
+over whatever time passed since the previous request.
+"""
+
+import collections
+import logging
+import os
+import threading
+import time
+
+import psutil
+
+logger = logging.getLogger(__name__)
+
+THERMAL_ZONE = "/sys/class/thermal/thermal_zone0/temp"
+
+
+def read_temperature():
+    """SoC temperature in degrees Celsius, or None off the Pi."""
+    try:
+        with open(THERMAL_ZONE) as f:
+            return round(int(f.read().strip()) / 1000, 1)
+    except (OSError, ValueError):
+        return None
+
+
+def block_device(path):
+    """Kernel name of the block device holding ``path`` (e.g. ``mmcblk0p2``)."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    link = f"/sys/dev/block/{os.major(st.st_dev)}:{os.minor(st.st_dev)}"
+    if not os.path.exists(link):
+        return None
+    return os.path.basename(os.path.realpath(link))
+
+
+class MetricsSampler:
+    """Samples CPU, memory, disk, temperature, SD writes and call state.
+
+    ``recordings_index`` provides the recording count; ``call_active`` is a
+    callable returning True/False, or None when it is not known.
+    """
+
+    def __init__(self, recordings_index, call_active, interval=5.0, history=720):
+        self.recordings_index = recordings_index
+        self.call_active = call_active
+        self.interval = max(1.0, float(interval))
+        self.samples = collections.deque(maxlen=max(1, int(history)))
+        self._device = block_device(recordings_index.recordings_path)
+        self._last_io = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def latest(self):
+        """Most recent sample, or None before the first one."""
+        return self.samples[-1] if self.samples else None
+
+    def start(self):
+        """Start sampling in the background (idempotent)."""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="metrics-sampler", daemon=True)
+                self._thread.start()
+
+    def history(self, since=None):
+        """Samples in time order, optionally only those taken after ``since``."""
+        samples = list(self.samples)
+        if since is not None:
+            samples = [s for s in samples if s["ts"] > since]
+        return samples
+
+    def _write_bytes(self):
+        counters = None
+        if self._device:
+            counters = psutil.disk_io_counters(perdisk=True).get(self._device)
+        if counters is None:
+            counters = psutil.disk_io_counters()
+        return counters.write_bytes if counters else None
+
+    def sample(self):
+        """Take one sample and append it to the buffer."""
+        now = time.monotonic()
+        write_bytes = self._write_bytes()
+        write_rate = None
+        if write_bytes is not None and self._last_io is not None:
+            last_at, last_bytes = self._last_io
+            write_rate = round(max(0, write_bytes - last_bytes) / (now - last_at))
+        self._last_io = (now, write_bytes) if write_bytes is not None else None
+
+        self.recordings_index.sync()
+        sample = {
+            "ts": time.time(),
+            # Average since the previous sample (the first one primes it)
+            "cpu": psutil.cpu_percent(),
+            "memory": psutil.virtual_memory().percent,
+            "disk": psutil.disk_usage(str(self.recordings_index.recordings_path)).percent,
+            "temperature": read_temperature(),
+            "sd_write_bytes_per_s": write_rate,
+            "recordings": self.recordings_index.count(),
+            "call_active": self.call_active(),
+        }
+        self.samples.append(sample)
+        return sample
+
+    def _run(self):
+        psutil.cpu_percent()
+        next_at = time.monotonic() + min(1.0, self.interval)
+        while True:
+            time.sleep(max(0.0, next_at - time.monotonic()))
+            try:
+                self.sample()
+            except Exception as e:
+                logger.error(f"Could not sample system metrics: {e}")
+            # Fixed cadence: skip missed ticks rather than drifting
+            next_at += self.interval
+            now = time.monotonic()
+            if next_at < now:
+                next_at = now + self.interval
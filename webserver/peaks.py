@@ -0,0 +1,241 @@
+"""Waveform peaks for recordings, cached as small binary sidecars.
+
+A waveform preview needs a min, max and RMS value per horizontal bucket, not
+the audio itself. :class:`PeaksCache` computes them once per recording and
+bucket count with vectorized NumPy over a memory-mapped WAV, a bounded number
+of frames at a time, and stores them under ``cache_path/peaks``. A sidecar
+records the size and mtime of the recording it was computed from and is
+recomputed when either changes.
+
+Sidecar layout (little-endian)::
+
+    magic "AGBP", version u8, pad u8, buckets u16, size u64, mtime_ns i64
+    min[buckets] i16, max[buckets] i16, rms[buckets] i16
+
+Values are full-scale fractions quantized to 16 bits, so a 1000-bucket
+waveform is 6 KB whatever the length of the recording.
+"""
+
+import glob
+import logging
+import os
+import struct
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+HEADER = struct.Struct("<4sBxHQq")
+MAGIC = b"AGBP"
+VERSION = 1
+
+MAX_BUCKETS = 4096
+
+# Frames converted to float at once; bounds memory for long recordings
+CHUNK_FRAMES = 1 << 18
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+class PeaksUnavailable(ValueError):
+    """The recording is not a WAV file peaks can be computed from."""
+
+
+def _wav_layout(path, size):
+    """Return (data offset, data size, channels, format tag, bits, rate) of a WAV."""
+    with open(path, "rb") as f:
+        head = f.read(12)
+        if head[:4] != b"RIFF" or head[8:12] != b"WAVE":
+            raise PeaksUnavailable(f"Not a WAV file: {path.name}")
+        fmt = None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                break
+            chunk_id, chunk_size = struct.unpack("<4sI", header)
+            if chunk_id == b"fmt ":
+                body = f.read(chunk_size + (chunk_size & 1))
+                tag, channels, rate, _, _, bits = struct.unpack("<HHIIHH", body[:16])
+                if tag == WAVE_FORMAT_EXTENSIBLE and len(body) >= 26:
+                    # The real format is the first two bytes of the SubFormat GUID
+                    tag = struct.unpack("<H", body[24:26])[0]
+                fmt = (channels, tag, bits, rate)
+            elif chunk_id == b"data":
+                if fmt is None:
+                    break
+                # An unpatched header (still recording, or power cut) has a
+                # size of 0 or one past the end of the file
+                available = size - f.tell()
+                data_size = chunk_size if 0 < chunk_size <= available else available
+                return (f.tell(), data_size) + fmt
+            else:
+                f.seek(chunk_size + (chunk_size & 1), os.SEEK_CUR)
+    raise PeaksUnavailable(f"No audio data in {path.name}")
+
+
+def sample_format(tag, bits, name):
+    """(dtype, to_float, values per sample) of WAV samples with this format tag and size.
+
+    ``to_float`` turns a (frames, channels * values per sample) array of
+    ``dtype`` into float32 samples in [-1, 1].
+    """
+    if tag == WAVE_FORMAT_IEEE_FLOAT and bits == 32:
+        return "<f4", lambda a: a.astype(np.float32), 1
+    if tag != WAVE_FORMAT_PCM:
+        raise PeaksUnavailable(f"Unsupported WAV encoding 0x{tag:04x} in {name}")
+    if bits == 8:
+        return "u1", lambda a: (a.astype(np.float32) - 128) / 128, 1
+    if bits == 16:
+        return "<i2", lambda a: a.astype(np.float32) / 32768, 1
+    if bits == 24:
+        # No 24-bit dtype: assemble each sample from its three bytes
+        def to_float(a):
+            b = a.reshape(a.shape[0], -1, 3).astype(np.int32)
+            samples = (b[..., 0] | (b[..., 1] << 8) | (b[..., 2] << 16)) << 8 >> 8
+            return samples.astype(np.float32) / 8388608
+        return "u1", to_float, 3
+    if bits == 32:
+        return "<i4", lambda a: a.astype(np.float32) / 2147483648, 1
+    raise PeaksUnavailable(f"Unsupported {bits}-bit WAV: {name}")
+
+
+def wav_frames(path, size):
+    """Memory-map the samples of a WAV as a (frames, channels) array.
+
+    Returns the array, a function turning a slice of it into float32
+    samples in [-1, 1], and the sample rate.
+    """
+    offset, data_size, channels, tag, bits, rate = _wav_layout(path, size)
+    if channels < 1:
+        raise PeaksUnavailable(f"No channels in {path.name}")
+    dtype, to_float, values = sample_format(tag, bits, path.name)
+
+    sample_bytes = (bits + 7) // 8
+    frame_count = data_size // (sample_bytes * channels)
+    if frame_count == 0:
+        return np.zeros((0, channels), dtype=np.float32), lambda a: a, rate
+    frames = np.memmap(path, dtype=dtype, mode="r", offset=offset,
+                       shape=(frame_count, channels * values))
+    return frames, to_float, rate
+
+
+def compute_peaks(path, buckets, size=None):
+    """Return (min, max, rms) float32 arrays of ``buckets`` values each.
+
+    Channels are folded together: min and max across all channels, RMS of all
+    samples. Buckets that hold no frames (more buckets than frames) are zero.
+    """
+    path = Path(path)
+    if size is None:
+        size = path.stat().st_size
+    frames, to_float, _ = wav_frames(path, size)
+    lows = np.zeros(buckets, dtype=np.float32)
+    highs = np.zeros(buckets, dtype=np.float32)
+    rms = np.zeros(buckets, dtype=np.float32)
+    frame_count = len(frames)
+    if frame_count == 0:
+        return lows, highs, rms
+
+    # Bucket i covers frames edges[i]:edges[i + 1]; reduceat needs them non-empty
+    edges = np.linspace(0, frame_count, buckets + 1).astype(np.int64)
+    filled = np.flatnonzero(edges[1:] > edges[:-1])
+    starts = edges[filled]
+    counts = edges[filled + 1] - starts
+
+    # Whole buckets per chunk, about CHUNK_FRAMES frames each
+    per_chunk = max(1, CHUNK_FRAMES * len(filled) // frame_count)
+    for first in range(0, len(filled), per_chunk):
+        group = slice(first, first + per_chunk)
+        begin = starts[group][0]
+        end = starts[group][-1] + counts[group][-1]
+        samples = to_float(np.asarray(frames[begin:end]))
+        offsets = starts[group] - begin
+        lows[filled[group]] = np.minimum.reduceat(samples.min(axis=1), offsets)
+        highs[filled[group]] = np.maximum.reduceat(samples.max(axis=1), offsets)
+        energy = np.add.reduceat(np.square(samples).mean(axis=1), offsets)
+        rms[filled[group]] = np.sqrt(energy / counts[group])
+    return lows, highs, rms
+
+
+def _dequantize(quantized, buckets):
+    values = quantized / 32767
+    return values[:buckets], values[buckets:2 * buckets], values[2 * buckets:]
+
+
+class PeaksCache:
+    """Peaks for the recordings in one folder, cached on disk."""
+
+    def __init__(self, cache_dir, recordings_path):
+        self.cache_dir = Path(cache_dir)
+        self.recordings_path = Path(recordings_path)
+
+    def _sidecar(self, name, buckets):
+        return self.cache_dir / f"{name}.{buckets}.peaks"
+
+    @staticmethod
+    def etag(st, buckets):
+        """Validator for the peaks of a recording in the state ``st``."""
+        return f"{buckets:x}-{st.st_size:x}-{st.st_mtime_ns:x}"
+
+    def get(self, name, buckets, st=None):
+        """Return (min, max, rms) arrays for recording ``name``.
+
+        Served from the sidecar if it matches the recording's current size
+        and mtime, otherwise computed and written back. Either way the values
+        are the 16-bit quantized ones, so responses do not depend on whether
+        the cache was warm.
+        """
+        if not 1 <= buckets <= MAX_BUCKETS:
+            raise ValueError(f"buckets must be between 1 and {MAX_BUCKETS}")
+        path = self.recordings_path / name
+        if st is None:
+            st = path.stat()
+        sidecar = self._sidecar(name, buckets)
+        cached = self._read(sidecar, buckets, st)
+        if cached is not None:
+            return cached
+        quantized = np.concatenate([
+            np.round(np.clip(values, -1, 1) * 32767).astype("<i2")
+            for values in compute_peaks(path, buckets, st.st_size)
+        ])
+        self._write(sidecar, buckets, st, quantized)
+        return _dequantize(quantized, buckets)
+
+    def _read(self, sidecar, buckets, st):
+        try:
+            data = sidecar.read_bytes()
+        except FileNotFoundError:
+            return None
+        if len(data) != HEADER.size + 6 * buckets:
+            return None
+        magic, version, stored_buckets, size, mtime_ns = HEADER.unpack_from(data)
+        if (magic, version, stored_buckets, size, mtime_ns) != (
+            MAGIC, VERSION, buckets, st.st_size, st.st_mtime_ns
+        ):
+            return None
+        return _dequantize(np.frombuffer(data, dtype="<i2", offset=HEADER.size), buckets)
+
+    def _write(self, sidecar, buckets, st, quantized):
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            # Write aside and rename so a reader never sees a partial sidecar
+            fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(HEADER.pack(MAGIC, VERSION, buckets, st.st_size, st.st_mtime_ns))
+                f.write(quantized.tobytes())
+            os.replace(tmp, sidecar)
+        except OSError as e:
+            logger.warning(f"Could not cache peaks for {sidecar.name}: {e}")
+
+    def discard(self, name):
+        """Remove every cached bucket count for recording ``name``."""
+        for sidecar in self.cache_dir.glob(f"{glob.escape(name)}.*.peaks"):
+            try:
+                sidecar.unlink()
+            except OSError as e:
+                logger.warning(f"Could not remove {sidecar}: {e}")
+
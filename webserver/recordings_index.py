@@ -0,0 +1,633 @@
+"""Persistent SQLite index of the recordings folder.
+
+The web UI used to ``iterdir()`` and ``stat()`` the whole recordings folder on
+every request. The index keeps name, size, mtime, duration and sample format
+for every recording, so listings, counts and ZIP file lists are a single query.
+
+It is kept current incrementally:
+
+* the delete/rename routes update it directly, and
+* :meth:`RecordingsIndex.sync` picks up files created by the daemon. It costs
+  one ``stat()`` of the directory when nothing was added or removed, and only
+  new or changed files have their headers read.
+
+Audio metadata comes from the file header only; the audio data is never read
+here. Empty-take measurements (see ``webserver.take_analysis``) are added
+later by :meth:`RecordingsIndex.set_analysis` and cleared whenever a file
+changes.
+
+Transcripts (see ``webserver.transcription``) are kept in their own table,
+with an FTS5 full-text index over their text, and survive a rebuild of the
+recordings table: they are slow to make, and are only redone when the
+recording they were made from changes.
+"""
+
+import base64
+import json
+import logging
+import os
+import re
+import sqlite3
+import struct
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# Recording formats the daemon can produce (see file_type in config.yaml)
+AUDIO_SUFFIXES = (".wav", ".flac", ".opus")
+
+# Files modified this recently may still be growing (a call in progress, or a
+# WAV header not yet patched), which does not change the directory's mtime.
+# They are re-checked on every sync until they settle.
+SETTLE_SECONDS = 15 * 60
+
+# The index is a cache: when the schema changes, the recordings table is
+# dropped and rebuilt from the folder.
+SCHEMA_VERSION = 5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS recordings (
+    name TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    recorded_at TEXT NOT NULL,
+    line TEXT,
+    duration REAL,
+    sample_rate INTEGER,
+    channels INTEGER,
+    sample_format TEXT,
+    analyzed_at REAL,
+    rms_db REAL,
+    speech_db REAL,
+    speech_seconds REAL
+);
+CREATE INDEX IF NOT EXISTS recordings_recorded_at ON recordings (recorded_at);
+CREATE INDEX IF NOT EXISTS recordings_mtime ON recordings (mtime);
+CREATE INDEX IF NOT EXISTS recordings_analyzed_at ON recordings (analyzed_at);
+CREATE INDEX IF NOT EXISTS recordings_line ON recordings (line);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+# Not dropped with the recordings table. ``words`` is a JSON list of
+# [word, start, end] (seconds into the recording); ``seconds`` is the time
+# the transcription took, for the real-time factor.
+TRANSCRIPTS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS transcripts (
+    name TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    transcribed_at REAL NOT NULL,
+    text TEXT NOT NULL,
+    words TEXT NOT NULL,
+    audio_seconds REAL,
+    seconds REAL,
+    error TEXT
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS transcripts_fts USING fts5(
+    name UNINDEXED, text, tokenize = 'unicode61 remove_diacritics 2'
+);
+"""
+
+# Words of a search, optionally with a trailing * for a prefix match
+SEARCH_TERM_RE = re.compile(r"\w+\*?")
+
+# Marks around the matched words in search snippets
+SNIPPET_START = "\x02"
+SNIPPET_END = "\x03"
+
+
+# Sort keys accepted by RecordingsIndex.query(), mapped to their column
+SORT_COLUMNS = {
+    "date": "recorded_at",
+    "name": "name",
+    "size": "size",
+    "duration": "duration",
+}
+
+# Recordings are named after the ISO timestamp they were started at
+TIMESTAMP_RE = re.compile(r"^(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(?:\.\d+)?)")
+
+# ...followed by the phone line when the daemon runs several (see
+# src/phone_line.py): <timestamp>_<line>.wav
+LINE_RE = re.compile(TIMESTAMP_RE.pattern + r"_([A-Za-z0-9-]+)\.[^.]+$")
+
+
+def is_recording_name(name):
+    return not name.startswith(".") and name.lower().endswith(AUDIO_SUFFIXES)
+
+
+def recorded_at(name, mtime):
+    """ISO timestamp a recording was made at: from its name, else its mtime."""
+    match = TIMESTAMP_RE.match(name)
+    if match:
+        return match.group(1)
+    return datetime.fromtimestamp(mtime).isoformat()
+
+
+def recording_line(name):
+    """Phone line a recording was made on, or None if it is not tagged."""
+    match = LINE_RE.match(name)
+    return match.group(2) if match else None
+
+
+def fts_query(text):
+    """FTS5 query for the words in ``text``, all of which must match.
+
+    Each word is quoted, so punctuation and FTS syntax in the user's input
+    are never interpreted. Raises ValueError if there is nothing to search.
+    """
+    terms = SEARCH_TERM_RE.findall(text)
+    if not terms:
+        raise ValueError("Nothing to search for")
+    return " ".join(
+        f'"{term.rstrip("*")}"' + ("*" if term.endswith("*") else "") for term in terms
+    )
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+    if not isinstance(values, list) or len(values) != 2:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return values
+
+
+def read_audio_info(path, size=None):
+    """Return duration/sample_rate/channels/sample_format from the header.
+
+    Unknown or damaged files yield ``None`` values rather than raising.
+    """
+    info = {"duration": None, "sample_rate": None, "channels": None, "sample_format": None}
+    try:
+        if size is None:
+            size = os.path.getsize(path)
+        with open(path, "rb") as f:
+            head = f.read(64)
+            if head[:4] == b"RIFF" and head[8:12] == b"WAVE":
+                info.update(_wav_info(f, size))
+            elif head[:4] == b"fLaC":
+                info.update(_flac_info(head))
+            elif head[:4] == b"OggS":
+                info.update(_opus_info(f, head, size))
+    except (OSError, struct.error, ValueError) as e:
+        logger.warning(f"Could not read audio header of {path}: {e}")
+    return info
+
+
+def _wav_info(f, size):
+    """Walk the RIFF chunks up to 'data', seeking over anything else."""
+    f.seek(12)
+    fmt = None
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            break
+        chunk_id, chunk_size = struct.unpack("<4sI", header)
+        if chunk_id == b"fmt ":
+            fmt = struct.unpack("<HHIIHH", f.read(16))
+            f.seek(chunk_size - 16 + (chunk_size & 1), os.SEEK_CUR)
+        elif chunk_id == b"data":
+            if fmt is None:
+                break
+            _, channels, rate, _, block_align, bits = fmt
+            # A size of 0 or one running past the end means the header was
+            # never patched (still recording, or the power was cut)
+            data_size = chunk_size
+            available = size - f.tell()
+            if data_size == 0 or data_size > available:
+                data_size = available
+            return {
+                "duration": data_size / (rate * block_align) if rate and block_align else None,
+                "sample_rate": rate,
+                "channels": channels,
+                "sample_format": f"pcm_s{bits}le" if bits > 8 else "pcm_u8",
+            }
+        else:
+            f.seek(chunk_size + (chunk_size & 1), os.SEEK_CUR)
+    return {}
+
+
+def _flac_info(head):
+    # STREAMINFO is always the first metadata block, right after 'fLaC'
+    streaminfo = head[8:42]
+    packed = int.from_bytes(streaminfo[10:18], "big")
+    rate = packed >> 44
+    channels = ((packed >> 41) & 0x7) + 1
+    bits = ((packed >> 36) & 0x1F) + 1
+    total_samples = packed & 0xFFFFFFFFF
+    return {
+        "duration": total_samples / rate if rate and total_samples else None,
+        "sample_rate": rate,
+        "channels": channels,
+        "sample_format": f"flac_s{bits}",
+    }
+
+
+def _opus_info(f, head, size):
+    if head[28:36] != b"OpusHead":
+        return {}
+    channels = head[37]
+    pre_skip = struct.unpack("<H", head[38:40])[0]
+    # The duration is the granule position of the last page; Opus granules
+    # always count 48 kHz samples
+    f.seek(max(0, size - 65536))
+    tail = f.read()
+    last = tail.rfind(b"OggS")
+    duration = None
+    if last != -1 and len(tail) >= last + 14:
+        granule = struct.unpack("<q", tail[last + 6:last + 14])[0]
+        if granule > 0:
+            duration = max(0, granule - pre_skip) / 48000
+    return {
+        "duration": duration,
+        "sample_rate": 48000,
+        "channels": channels,
+        "sample_format": "opus",
+    }
+
+
+class RecordingsIndex:
+    """SQLite-backed index of one recordings folder.
+
+    All methods are safe to call from any thread or greenlet.
+    """
+
+    def __init__(self, db_path, recordings_path):
+        self.recordings_path = Path(recordings_path)
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.executescript(SCHEMA)
+            if self._get_meta("schema_version") != str(SCHEMA_VERSION):
+                self._db.execute("DROP TABLE recordings")
+                self._db.executescript(SCHEMA)
+                self._set_meta("schema_version", SCHEMA_VERSION)
+                self._bump()
+        try:
+            with self._lock, self._db:
+                self._db.executescript(TRANSCRIPTS_SCHEMA)
+            self.has_transcripts = True
+        except sqlite3.OperationalError as e:
+            # SQLite built without FTS5
+            logger.warning(f"Transcript search unavailable: {e}")
+            self.has_transcripts = False
+        self._dir_mtime_ns = None
+
+    # ----- metadata -----
+
+    def _get_meta(self, key, default=None):
+        row = self._db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row["value"] if row else default
+
+    def _set_meta(self, key, value):
+        self._db.execute(
+            "INSERT INTO meta (key, value) VALUES (?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, str(value)),
+        )
+
+    @property
+    def generation(self):
+        """Counter bumped on every change to the index."""
+        with self._lock:
+            return int(self._get_meta("generation", 0))
+
+    def _bump(self):
+        self._set_meta("generation", int(self._get_meta("generation", 0)) + 1)
+
+    # ----- incremental updates -----
+
+    def sync(self, force=False):
+        """Bring the index in line with the folder; cheap if nothing changed."""
+        with self._lock:
+            try:
+                dir_mtime_ns = self.recordings_path.stat().st_mtime_ns
+            except FileNotFoundError:
+                return
+            if force or dir_mtime_ns != self._dir_mtime_ns:
+                self._rescan()
+                self._dir_mtime_ns = dir_mtime_ns
+            else:
+                self._refresh_recent()
+
+    def _rescan(self):
+        indexed = {
+            row["name"]: (row["size"], row["mtime"])
+            for row in self._db.execute("SELECT name, size, mtime FROM recordings")
+        }
+        seen = set()
+        changed = False
+        with self._db:
+            with os.scandir(self.recordings_path) as entries:
+                for entry in entries:
+                    if not is_recording_name(entry.name) or not entry.is_file():
+                        continue
+                    seen.add(entry.name)
+                    st = entry.stat()
+                    if indexed.get(entry.name) != (st.st_size, st.st_mtime):
+                        self._upsert(entry.name, st)
+                        changed = True
+            for name in indexed.keys() - seen:
+                self._db.execute("DELETE FROM recordings WHERE name = ?", (name,))
+                changed = True
+            if changed:
+                self._bump()
+        if changed:
+            logger.info(f"Recordings index updated: {len(seen)} recordings")
+
+    def _refresh_recent(self):
+        cutoff = time.time() - SETTLE_SECONDS
+        rows = self._db.execute(
+            "SELECT name, size, mtime FROM recordings WHERE mtime >= ?", (cutoff,)
+        ).fetchall()
+        with self._db:
+            changed = False
+            for row in rows:
+                try:
+                    st = (self.recordings_path / row["name"]).stat()
+                except FileNotFoundError:
+                    continue
+                if (st.st_size, st.st_mtime) != (row["size"], row["mtime"]):
+                    self._upsert(row["name"], st)
+                    changed = True
+            if changed:
+                self._bump()
+
+    def _upsert(self, name, st):
+        info = read_audio_info(self.recordings_path / name, st.st_size)
+        self._db.execute(
+            "INSERT OR REPLACE INTO recordings "
+            "(name, size, mtime, recorded_at, line, duration, sample_rate, channels, sample_format) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (name, st.st_size, st.st_mtime, recorded_at(name, st.st_mtime), recording_line(name),
+             info["duration"], info["sample_rate"], info["channels"], info["sample_format"]),
+        )
+
+    def update(self, name):
+        """(Re)index one recording, or drop it if it no longer exists."""
+        with self._lock, self._db:
+            try:
+                st = (self.recordings_path / name).stat()
+            except FileNotFoundError:
+                self._db.execute("DELETE FROM recordings WHERE name = ?", (name,))
+            else:
+                self._upsert(name, st)
+            self._bump()
+
+    def remove(self, name):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM recordings WHERE name = ?", (name,))
+            self._remove_transcript(name)
+            self._bump()
+
+    def rename(self, old_name, new_name):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM recordings WHERE name = ?", (new_name,))
+            if self.has_transcripts:
+                self._remove_transcript(new_name)
+                self._db.execute("UPDATE transcripts SET name = ? WHERE name = ?", (new_name, old_name))
+                self._db.execute("UPDATE transcripts_fts SET name = ? WHERE name = ?", (new_name, old_name))
+            row = self._db.execute(
+                "SELECT mtime FROM recordings WHERE name = ?", (old_name,)
+            ).fetchone()
+            if row:
+                self._db.execute(
+                    "UPDATE recordings SET name = ?, recorded_at = ?, line = ? WHERE name = ?",
+                    (new_name, recorded_at(new_name, row["mtime"]), recording_line(new_name), old_name),
+                )
+            self._bump()
+
+    # ----- empty-take analysis -----
+
+    def pending_analysis(self, limit=None, force=False):
+        """Recordings (name, size, mtime) without measurements, newest first."""
+        sql = "SELECT name, size, mtime FROM recordings"
+        if not force:
+            sql += " WHERE analyzed_at IS NULL"
+        sql += " ORDER BY mtime DESC"
+        params = []
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+        with self._lock:
+            return [dict(row) for row in self._db.execute(sql, params)]
+
+    def set_analysis(self, results):
+        """Store measurements from (name, size, mtime, result) tuples.
+
+        A result is dropped if the file changed since it was measured.
+        """
+        now = time.time()
+        with self._lock, self._db:
+            for name, size, mtime, result in results:
+                self._db.execute(
+                    "UPDATE recordings SET analyzed_at = ?, rms_db = ?, speech_db = ?, "
+                    "speech_seconds = ? WHERE name = ? AND size = ? AND mtime = ?",
+                    (now, result["rms_db"], result["speech_db"], result["speech_seconds"],
+                     name, size, mtime),
+                )
+            self._bump()
+
+    # ----- transcripts -----
+
+    def _remove_transcript(self, name):
+        if self.has_transcripts:
+            self._db.execute("DELETE FROM transcripts WHERE name = ?", (name,))
+            self._db.execute("DELETE FROM transcripts_fts WHERE name = ?", (name,))
+
+    def pending_transcription(self, limit=None, force=False):
+        """Recordings (name, size, mtime) without an up-to-date transcript, newest first."""
+        sql = (
+            "SELECT r.name, r.size, r.mtime FROM recordings r "
+            "LEFT JOIN transcripts t ON t.name = r.name"
+        )
+        if not force:
+            sql += " WHERE t.name IS NULL OR t.size != r.size OR t.mtime != r.mtime"
+        sql += " ORDER BY r.mtime DESC"
+        params = []
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+        with self._lock:
+            return [dict(row) for row in self._db.execute(sql, params)]
+
+    def set_transcript(self, name, size, mtime, result):
+        """Store a transcript made from the recording at that size and mtime.
+
+        ``result`` has ``text``, ``words``, ``audio_seconds``, ``seconds`` and
+        ``error``. Transcripts of recordings deleted meanwhile are dropped.
+        """
+        with self._lock, self._db:
+            self._remove_transcript(name)
+            if not self._db.execute("SELECT 1 FROM recordings WHERE name = ?", (name,)).fetchone():
+                return
+            self._db.execute(
+                "INSERT INTO transcripts (name, size, mtime, transcribed_at, text, words, "
+                "audio_seconds, seconds, error) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (name, size, mtime, time.time(), result["text"], json.dumps(result["words"]),
+                 result["audio_seconds"], result["seconds"], result["error"]),
+            )
+            if result["text"]:
+                self._db.execute(
+                    "INSERT INTO transcripts_fts (name, text) VALUES (?, ?)", (name, result["text"])
+                )
+            self._bump()
+
+    def prune_transcripts(self):
+        """Drop transcripts of recordings no longer in the index."""
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM transcripts WHERE name NOT IN (SELECT name FROM recordings)")
+            self._db.execute("DELETE FROM transcripts_fts WHERE name NOT IN (SELECT name FROM recordings)")
+
+    def search(self, text, limit=50, line=None):
+        """Recordings whose transcript has every word of ``text``, best match first.
+
+        Rows are recordings plus ``snippet`` (the matched words between
+        SNIPPET_START and SNIPPET_END) and ``words`` (the transcript's
+        [word, start, end] list). Raises ValueError for an empty search.
+        """
+        query = fts_query(text)
+        sql = (
+            "SELECT r.*, t.words, snippet(transcripts_fts, 1, ?, ?, '…', 16) AS snippet "
+            "FROM transcripts_fts JOIN recordings r ON r.name = transcripts_fts.name "
+            "JOIN transcripts t ON t.name = r.name "
+            "WHERE transcripts_fts MATCH ?"
+        )
+        params = [SNIPPET_START, SNIPPET_END, query]
+        if line:
+            sql += " AND r.line = ?"
+            params.append(line)
+        sql += " ORDER BY bm25(transcripts_fts) LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            rows = [dict(row) for row in self._db.execute(sql, params)]
+        for row in rows:
+            row["words"] = json.loads(row["words"])
+        return rows
+
+    def transcription_stats(self):
+        """Transcripts made, audio transcribed and time taken, with the real-time factor.
+
+        The real-time factor is processing time over audio time: below 1 is
+        faster than real time.
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT COUNT(*) AS transcribed, COUNT(error) AS failed, "
+                "COALESCE(SUM(audio_seconds), 0) AS audio_seconds, "
+                "COALESCE(SUM(seconds), 0) AS seconds FROM transcripts"
+            ).fetchone()
+            pending = self._db.execute(
+                "SELECT COUNT(*) FROM recordings r LEFT JOIN transcripts t ON t.name = r.name "
+                "WHERE t.name IS NULL OR t.size != r.size OR t.mtime != r.mtime"
+            ).fetchone()[0]
+        stats = dict(row)
+        stats["pending"] = pending
+        stats["audio_seconds"] = round(stats["audio_seconds"], 1)
+        stats["seconds"] = round(stats["seconds"], 1)
+        stats["real_time_factor"] = (
+            round(stats["seconds"] / stats["audio_seconds"], 3) if stats["audio_seconds"] else None
+        )
+        return stats
+
+    # ----- queries -----
+
+    def names(self):
+        """All recording names, newest first."""
+        with self._lock:
+            return [
+                row["name"]
+                for row in self._db.execute("SELECT name FROM recordings ORDER BY mtime DESC")
+            ]
+
+    def query(self, sort="date", order="desc", limit=None, cursor=None,
+              date_from=None, date_to=None, min_speech=None, line=None):
+        """One page of recordings, plus the cursor for the next page.
+
+        Pagination is keyset based on ``(sort column, name)``, so a page costs
+        the same wherever it is in the list and stays stable while
+        recordings are added. ``date_from`` / ``date_to`` are ISO dates or
+        datetimes compared against the recording timestamp; a bare date in
+        ``date_to`` includes that whole day. ``min_speech`` leaves out takes
+        measured to have less speech than that many seconds; takes not
+        analyzed yet are kept. ``line`` keeps only takes from that phone line.
+        """
+        column = SORT_COLUMNS.get(sort)
+        if column is None:
+            raise ValueError(f"Unknown sort key: {sort}")
+        if order not in ("asc", "desc"):
+            raise ValueError(f"Unknown sort order: {order}")
+
+        where, params = [], []
+        if date_from:
+            where.append("recorded_at >= ?")
+            params.append(date_from)
+        if date_to:
+            where.append("recorded_at <= ?")
+            params.append(date_to + "T23:59:59.999999" if len(date_to) == 10 else date_to)
+        if min_speech is not None:
+            where.append("(speech_seconds IS NULL OR speech_seconds >= ?)")
+            params.append(min_speech)
+        if line:
+            where.append("line = ?")
+            params.append(line)
+        if cursor:
+            # NULL durations sort as 0 so they keep a stable position
+            key = f"COALESCE({column}, 0)" if column == "duration" else column
+            where.append(f"({key}, name) {'<' if order == 'desc' else '>'} (?, ?)")
+            params.extend(decode_cursor(cursor))
+
+        sql = "SELECT * FROM recordings"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        key = f"COALESCE({column}, 0)" if column == "duration" else column
+        sql += f" ORDER BY {key} {order.upper()}, name {order.upper()}"
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit + 1)
+
+        with self._lock:
+            rows = [dict(row) for row in self._db.execute(sql, params)]
+
+        next_cursor = None
+        if limit and len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            last_key = last[column] if column != "duration" else (last["duration"] or 0)
+            next_cursor = encode_cursor([last_key, last["name"]])
+        return rows, next_cursor
+
+    def lines(self):
+        """Names of the phone lines that have recordings, sorted."""
+        with self._lock:
+            return [
+                row["line"]
+                for row in self._db.execute(
+                    "SELECT DISTINCT line FROM recordings WHERE line IS NOT NULL ORDER BY line"
+                )
+            ]
+
+    def count(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM recordings").fetchone()[0]
+
+    def get(self, name):
+        with self._lock:
+            row = self._db.execute("SELECT * FROM recordings WHERE name = ?", (name,)).fetchone()
+            return dict(row) if row else None
@@ -1,26 +1,34 @@
-import io
+import hashlib
+import json
 import logging
 import os
-import re
 import subprocess
-import sys
-import zipfile
-from io import BytesIO
 from pathlib import Path
 
 from flask import (
+    Blueprint,
     Flask,
     Response,
+    current_app,
     flash,
     jsonify,
     redirect,
     render_template,
     request,
-    send_file,
     send_from_directory,
     url_for,
 )
-from ruamel.yaml import YAML
+
+from webserver.app_state import AppState
+from webserver.backup import BackupError
+from webserver.call_traces import render_prometheus
+from webserver.events import sse_stream
+from webserver.file_ranges import send_file_ranges
+from webserver.peaks import PeaksCache, PeaksUnavailable
+from webserver.recordings_index import is_recording_name
+from webserver.transcription import match_times
+from webserver.transcode import FORMATS, TranscodeError
+from webserver.zip_stream import stream_zip
 
 # Set up logging and app configuration
 logging.basicConfig(level=logging.INFO)
@@ -31,88 +39,133 @@ WEBSERVER_DIR = Path(__file__).parent.absolute()
 BASE_DIR = WEBSERVER_DIR.parent
 STATIC_DIR = WEBSERVER_DIR / "static"
 
-# Log critical paths for debugging
-logger.info(f"Current working directory: {os.getcwd()}")
-logger.info(f"Webserver directory: {WEBSERVER_DIR}")
-logger.info(f"Base directory: {BASE_DIR}")
-logger.info(f"Static directory: {STATIC_DIR}")
-
-# Create Flask app with absolute path to static folder
-app = Flask(__name__,
-           static_url_path="/static",
-           static_folder=str(STATIC_DIR))
-app.secret_key = "supersecretkey"  # Needed for flashing messages
-
-# Define other important paths. The AGB_CONFIG_PATH / AGB_UPLOAD_FOLDER env
-# overrides let an off-device harness (test/test_server.py) point the app at an
-# isolated config and uploads dir. The device never sets these, so its behavior
-# is unchanged.
-config_path = Path(os.environ.get("AGB_CONFIG_PATH", str(BASE_DIR / "config.yaml")))
-upload_folder = Path(os.environ.get("AGB_UPLOAD_FOLDER", str(BASE_DIR / "uploads")))
-upload_folder.mkdir(parents=True, exist_ok=True)
-
-logger.info(f"Config path: {config_path}")
-logger.info(f"Upload folder: {upload_folder}")
-
-# Initialize ruamel.yaml
-yaml = YAML()
-
-# Attempt to grab recording path from the configuration file
-try:
-    with config_path.open("r") as f:
-        config = yaml.load(f)
-        logger.info(f"Config loaded successfully from {config_path}")
-except FileNotFoundError as e:
-    logger.error(f"Configuration file not found: {e}")
-    sys.exit(1)
-except Exception as e:
-    logger.error(f"Error loading configuration: {e}")
-    sys.exit(1)
-
-# Ensure recordings_path is an absolute path
-recordings_path_str = config.get("recordings_path", "recordings")
-recordings_path = Path(recordings_path_str)
-if not recordings_path.is_absolute():
-    recordings_path = BASE_DIR / recordings_path_str
-    logger.info(f"Converted relative recordings path to absolute: {recordings_path}")
-
-# Verify recordings directory exists and is accessible
-if not recordings_path.exists():
-    logger.warning(f"Recordings directory does not exist: {recordings_path}")
-    try:
-        recordings_path.mkdir(parents=True, exist_ok=True)
-        logger.info(f"Created recordings directory: {recordings_path}")
-    except Exception as e:
-        logger.error(f"Failed to create recordings directory: {e}")
-        sys.exit(1)
-elif not recordings_path.is_dir():
-    logger.error(f"Recordings path exists but is not a directory: {recordings_path}")
-    sys.exit(1)
-else:
-    logger.info(f"Recordings directory verified: {recordings_path}")
+bp = Blueprint("guestbook", __name__)
+
+
+def create_app(config_path=None, upload_folder=None):
+    """Create the web app.
+
+    Nothing is read from disk here: the config and everything built from it
+    are loaded by the first request that needs them (see app_state.py), so
+    gunicorn workers start fast. The AGB_CONFIG_PATH / AGB_UPLOAD_FOLDER env
+    overrides let an off-device harness (test/test_server.py) point the app
+    at an isolated config and uploads dir; the device never sets them.
+    """
+    if config_path is None:
+        config_path = os.environ.get("AGB_CONFIG_PATH", BASE_DIR / "config.yaml")
+    if upload_folder is None:
+        upload_folder = os.environ.get("AGB_UPLOAD_FOLDER", BASE_DIR / "uploads")
+
+    # Create Flask app with absolute path to static folder
+    app = Flask(__name__,
+               static_url_path="/static",
+               static_folder=str(STATIC_DIR))
+    app.secret_key = "supersecretkey"  # Needed for flashing messages
+    app.extensions["guestbook"] = AppState(config_path, upload_folder, BASE_DIR)
+    app.register_blueprint(bp)
+
+    logger.info(f"Config path: {config_path}")
+    logger.info(f"Upload folder: {upload_folder}")
+    return app
+
+
+def __getattr__(name):
+    # Service files written by older installers run `webserver.server:app`
+    if name == "app":
+        global app
+        app = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def state():
+    """The AppState of the app handling the current request."""
+    return current_app.extensions["guestbook"]
+
+
+@bp.before_app_request
+def start_background():
+    state().start()
+
+
+# Recording formats the daemon can produce (see file_type in config.yaml)
+AUDIO_MIMETYPES = {
+    ".wav": "audio/wav",
+    ".flac": "audio/flac",
+    ".opus": "audio/ogg",
+}
+
+
+def recording_mimetype(path):
+    return AUDIO_MIMETYPES.get(path.suffix.lower(), "application/octet-stream")
+
+
+def playback_format(path):
+    """Rendition format (see transcode.FORMATS) to serve ``path`` as, or None.
+
+    ``?format=opus|mp3|original`` wins; otherwise the Accept header is
+    negotiated, with the original preferred on a tie (``*/*``).
+    """
+    requested = request.args.get("format")
+    if requested is None:
+        # Original first, so it wins ties
+        candidates = {recording_mimetype(path): "original"}
+        for fmt, (_, mimetype, _) in FORMATS.items():
+            candidates.setdefault(mimetype, fmt)
+        best = request.accept_mimetypes.best_match(list(candidates))
+        requested = candidates.get(best, "original")
+    if requested == "original":
+        return None
+    if requested not in FORMATS:
+        raise ValueError(f"Unknown format: {requested}")
+    if FORMATS[requested][0] == path.suffix.lower():
+        return None
+    return requested
+
+
+def min_speech(params):
+    """Speech threshold for leaving out empty takes, or None to keep them.
+
+    ``exclude_empty=1`` leaves out takes with less than
+    ``empty_take_min_speech`` seconds of speech (see take_analysis.py).
+    """
+    if params.get("exclude_empty", "").lower() not in ("1", "true", "on"):
+        return None
+    return float(state().config.get("empty_take_min_speech", 0.5))
+
 
 def normalize_path(path):
     """Normalize and convert paths to Unix format."""
     return str(path.as_posix())
 
 
-@app.route("/")
+@bp.route("/")
 def index():
-    return render_template("index.html")
+    config = state().config
+    return render_template(
+        "index.html",
+        playback_format=config.get("playback_format", "original"),
+        backup_enabled=bool(config.get("backup_path")),
+        search_enabled=bool(config.get("transcribe", False)),
+    )
 
 
-@app.route("/<filename>", methods=["GET"])
+@bp.route("/<filename>", methods=["GET"])
 def download_file(filename):
     """Download a file dynamically from the recordings folder."""
-    return send_from_directory(recordings_path, filename, as_attachment=True)
+    return send_from_directory(state().recordings_path, filename, as_attachment=True)
 
 
-@app.route("/delete/<filename>", methods=["POST"])
+@bp.route("/delete/<filename>", methods=["POST"])
 def delete_file(filename):
     """Delete a specific recording."""
-    file_path = recordings_path / filename
+    app_state = state()
+    file_path = app_state.recordings_path / filename
     try:
         file_path.unlink()
+        app_state.recordings_index.remove(filename)
+        app_state.peaks_cache.discard(filename)
+        app_state.renditions.discard(filename)
         return jsonify({"success": True, "message": f"{filename} has been deleted."})
     except Exception as e:
         return jsonify(
@@ -120,32 +173,173 @@ def delete_file(filename):
         ), 500
 
 
-@app.route("/api/recordings")
+@bp.route("/api/recordings")
 def get_recordings():
-    """API route to get a list of all recordings."""
+    """API route to get one page of recordings.
+
+    Query parameters (all optional):
+      limit   page size (default 50, max 500)
+      cursor  ``next_cursor`` from the previous page
+      sort    date | name | size | duration (default date)
+      order   asc | desc (default desc)
+      from/to ISO date or datetime bounds on the recording timestamp
+      exclude_empty  1 to leave out empty takes (guest hung up)
+      line    only recordings from this phone line
+
+    Responses carry a strong ETag derived from the index generation, so an
+    unchanged page is answered with 304 Not Modified.
+    """
     try:
-        # List directory contents if it exists
-        if recordings_path.exists() and recordings_path.is_dir():
-            all_items = list(sorted(recordings_path.iterdir(), key=lambda f:f.stat().st_mtime, reverse=True))
-            logger.info(f"Directory contains {len(all_items)} items")
-
-            # List all items with their types
-            for item in all_items:
-                logger.info(f"  - {item.name} ({'file' if item.is_file() else 'dir'})")
-
-            files = [f.name for f in all_items if f.is_file()]
-            logger.info(f"Found {len(files)} files: {files}")
-            return jsonify(files)
-        else:
-            logger.error(f"Recordings path is not a valid directory: {recordings_path}")
+        app_state = state()
+        if not app_state.recordings_path.is_dir():
+            logger.error(f"Recordings path is not a valid directory: {app_state.recordings_path}")
             return jsonify({"error": "Recordings directory not found"}), 404
 
+        recordings_index = app_state.recordings_index
+        recordings_index.sync()
+        app_state.kick_analysis()
+        app_state.kick_transcription()
+        args = request.args
+        etag = hashlib.sha1(
+            f"{recordings_index.generation}?{sorted(args.items(multi=True))}".encode()
+        ).hexdigest()
+        if request.if_none_match.contains(etag):
+            resp = Response(status=304)
+        else:
+            try:
+                limit = min(max(int(args.get("limit", 50)), 1), 500)
+                rows, next_cursor = recordings_index.query(
+                    sort=args.get("sort", "date"),
+                    order=args.get("order", "desc"),
+                    limit=limit,
+                    cursor=args.get("cursor"),
+                    date_from=args.get("from"),
+                    date_to=args.get("to"),
+                    min_speech=min_speech(args),
+                    line=args.get("line"),
+                )
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            resp = jsonify({
+                "recordings": [
+                    {key: row[key] for key in ("name", "size", "recorded_at", "line", "duration", "speech_seconds")}
+                    for row in rows
+                ],
+                "next_cursor": next_cursor,
+            })
+        resp.set_etag(etag)
+        # Let the browser cache pages, but revalidate every time
+        resp.headers["Cache-Control"] = "no-cache"
+        return resp
+
     except Exception as e:
         logger.error(f"Error accessing recordings directory: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
 
-@app.route("/config", methods=["GET", "POST"])
+@bp.route("/api/search")
+def search_recordings():
+    """Recordings whose transcript contains every word of ``q``, best match first.
+
+    Query parameters: ``q`` (words; ``word*`` matches a prefix), ``limit``
+    (default 50, max 200) and ``line``. Each result has the recording's
+    fields, a ``snippet`` of the transcript with the matched words between
+    the control characters STX and ETX, and ``matches``: the matched words
+    with the seconds into the recording they were said at.
+    ``transcription`` reports progress and throughput (real-time factor) of
+    the background transcription.
+    """
+    app_state = state()
+    recordings_index = app_state.recordings_index
+    if not recordings_index.has_transcripts:
+        return jsonify({"error": "Transcript search is not available"}), 503
+    recordings_index.sync()
+    app_state.kick_transcription()
+    args = request.args
+    text = args.get("q", "")
+    try:
+        limit = min(max(int(args.get("limit", 50)), 1), 200)
+        rows = recordings_index.search(text, limit=limit, line=args.get("line"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({
+        "recordings": [
+            {
+                **{key: row[key] for key in ("name", "size", "recorded_at", "line", "duration", "snippet")},
+                "matches": match_times(row["words"], text),
+            }
+            for row in rows
+        ],
+        "next_cursor": None,
+        "transcription": {
+            "enabled": bool(app_state.config.get("transcribe", False)),
+            **recordings_index.transcription_stats(),
+        },
+    })
+
+
+@bp.route("/api/lines")
+def get_lines():
+    """Phone lines that have recordings, for the line filter."""
+    recordings_index = state().recordings_index
+    recordings_index.sync()
+    return jsonify({"lines": recordings_index.lines()})
+
+
+@bp.route("/api/recordings/<filename>/peaks")
+def recording_peaks(filename):
+    """Waveform peaks of a WAV recording: min, max and RMS per bucket.
+
+    ``buckets`` (default 200) sets the resolution. Values are full-scale
+    fractions; the result is cached on disk until the recording changes.
+    """
+    file_path = state().recordings_path / filename
+    if filename != Path(filename).name or not file_path.is_file():
+        return jsonify({"error": "File not found"}), 404
+
+    try:
+        buckets = int(request.args.get("buckets", 200))
+    except ValueError:
+        return jsonify({"error": "buckets must be an integer"}), 400
+    st = file_path.stat()
+    etag = PeaksCache.etag(st, buckets)
+    if request.if_none_match.contains(etag):
+        resp = Response(status=304)
+    else:
+        try:
+            lows, highs, rms = state().peaks_cache.get(filename, buckets, st)
+        except PeaksUnavailable as e:
+            return jsonify({"error": str(e)}), 415
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        resp = jsonify({
+            "buckets": buckets,
+            "min": lows.round(4).tolist(),
+            "max": highs.round(4).tolist(),
+            "rms": rms.round(4).tolist(),
+        })
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp
+
+
+@bp.route("/api/events")
+def events():
+    """Server-sent events stream of the daemon's live state.
+
+    The first event is ``state`` (handset, prompt playing, recording in
+    progress, and whether the daemon is reachable); then one event per
+    change: hook, playback_started/finished, recording_started/stopped,
+    file_created, time_exceeded, greeting_recording_started/stopped.
+    """
+    return Response(
+        sse_stream(state().event_hub),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@bp.route("/config", methods=["GET", "POST"])
 def edit_config():
     """Handle GET and POST requests to edit the configuration."""
     if request.method == "POST":
@@ -153,31 +347,38 @@ def edit_config():
         for key, value in request.form.items():
             logger.info(f"  {key}: {value}")
         try:
+            app_state = state()
             # Handle file uploads
+            uploads = {}
             for field in ["greeting", "beep", "time_exceeded"]:
                 if f"{field}_file" in request.files:
                     file = request.files[f"{field}_file"]
                     if file.filename:
-                        file_path = upload_folder / file.filename
+                        app_state.upload_folder.mkdir(parents=True, exist_ok=True)
+                        file_path = app_state.upload_folder / file.filename
                         file.save(file_path)
                         # Store path relative to BASE_DIR for portability
-                        config[field] = normalize_path(file_path.relative_to(BASE_DIR))
+                        uploads[field] = normalize_path(file_path.relative_to(BASE_DIR))
 
-            update_config(request.form)
+            def edit(config):
+                config.update(uploads)
+                update_config(config, request.form)
 
-            with config_path.open("w") as f:
-                yaml.dump(config, f)
+            # Re-reads the file under a lock, so saves from other workers are kept
+            app_state.config_store.update(edit)
 
-            # Restart the audioGuestBook service to apply changes
+            # Ask the audioGuestBook service to reload (SIGHUP). It applies
+            # the changes between calls, so a recording in progress is kept.
             try:
-                subprocess.run(["sudo", "systemctl", "restart", "audioGuestBook.service"], check=True)
-                logger.info("Successfully restarted audioGuestBook service")
-                flash("Configuration updated and service restarted successfully!", "success")
+                subprocess.run(["sudo", "systemctl", "reload", "audioGuestBook.service"], check=True)
+                logger.info("Asked audioGuestBook service to reload its configuration")
+                flash("Configuration updated! Changes apply once the phone is idle.", "success")
             except subprocess.CalledProcessError as e:
-                logger.error(f"Failed to restart audioGuestBook service: {e}")
-                flash("Configuration updated but failed to restart service. Please restart manually.", "warning")
+                # The service also notices the file change on its own
+                logger.error(f"Failed to reload audioGuestBook service: {e}")
+                flash("Configuration updated; the service will pick it up within a few seconds.", "warning")
 
-            return redirect(url_for("edit_config"))
+            return redirect(url_for(".edit_config"))
         except Exception as e:
             logger.error(f"Error updating configuration: {e}")
             flash(f"Error updating configuration: {str(e)}", "error")
@@ -185,8 +386,7 @@ def edit_config():
 
     # Load the current configuration
     try:
-        with config_path.open("r") as f:
-            current_config = yaml.load(f)
+        current_config = state().config
     except FileNotFoundError as e:
         logger.error(f"Configuration file not found: {e}")
         current_config = {}
@@ -194,153 +394,125 @@ def edit_config():
     return render_template("config.html", config=current_config)
 
 
-@app.route("/recordings/<filename>")
+@bp.route("/recordings/<filename>")
 def serve_recording(filename):
-    """Serve a specific recording with proper streaming and range support."""
-    file_path = recordings_path / filename
+    """Serve a specific recording with range and conditional request support.
+
+    An Opus or MP3 rendition is served instead when asked for (see
+    playback_format()); it is encoded on first request and cached.
+    """
+    file_path = state().recordings_path / filename
 
     # Verify file exists
-    if not file_path.exists():
+    if filename != Path(filename).name or not file_path.is_file():
         logger.error(f"Recording file not found: {file_path}")
         return jsonify({"error": "File not found"}), 404
 
-    # Get file size for range requests
-    file_size = file_path.stat().st_size
-
-    # Parse Range header
-    range_header = request.headers.get('Range', None)
-
-    if range_header:
-        # Parse the range header
-        byte1, byte2 = 0, None
-        match = re.search(r'(\d+)-(\d*)', range_header)
-        groups = match.groups()
-
-        if groups[0]:
-            byte1 = int(groups[0])
-        if groups[1]:
-            byte2 = int(groups[1])
-
-        if byte2 is None:
-            byte2 = file_size - 1
-
-        length = byte2 - byte1 + 1
+    try:
+        fmt = playback_format(file_path)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-        # Create the response with the proper headers for range request
-        resp = Response(
-            generate_file_chunks(str(file_path), byte1, byte2),
-            status=206,
-            mimetype='audio/wav',
-            direct_passthrough=True
-        )
+    mimetype = recording_mimetype(file_path)
+    if fmt is not None:
+        try:
+            file_path = state().renditions.get(file_path, fmt)
+            mimetype = FORMATS[fmt][1]
+        except (TranscodeError, OSError) as e:
+            # Playing the original slowly beats not playing at all
+            logger.error(f"Serving original {filename}, {fmt} rendition failed: {e}")
+
+    resp = send_file_ranges(file_path, mimetype)
+    resp.vary.add("Accept")
+    return resp
 
-        resp.headers.add('Content-Range', f'bytes {byte1}-{byte2}/{file_size}')
-        resp.headers.add('Accept-Ranges', 'bytes')
-        resp.headers.add('Content-Length', str(length))
-        return resp
 
-    # If no range header, serve the whole file
-    resp = Response(
-        generate_file_chunks(str(file_path), 0, file_size - 1),
-        mimetype='audio/wav'
+def is_empty_take(name, threshold):
+    row = state().recordings_index.get(name)
+    speech = row["speech_seconds"] if row else None
+    return speech is not None and speech < threshold
+
+
+def selected_recordings(params):
+    """Resolve the recordings a download request refers to.
+
+    ``files[]`` names recordings explicitly. Otherwise ``selector=all``
+    and/or a ``from``/``to`` date range select on the server, so the browser
+    does not have to post thousands of file names, and ``line`` keeps one
+    phone line's takes. ``exclude_empty=1`` leaves empty takes out of either.
+    """
+    app_state = state()
+    threshold = min_speech(params)
+    names = params.getlist("files[]")
+    if names:
+        # Only plain recording names inside the recordings folder
+        names = [name for name in names if name == Path(name).name and is_recording_name(name)]
+        if threshold is not None:
+            names = [name for name in names if not is_empty_take(name, threshold)]
+        return [app_state.recordings_path / name for name in names]
+    app_state.recordings_index.sync()
+    rows, _ = app_state.recordings_index.query(
+        date_from=params.get("from") or None,
+        date_to=params.get("to") or None,
+        min_speech=threshold,
+        line=params.get("line") or None,
     )
-    resp.headers.add('Accept-Ranges', 'bytes')
-    resp.headers.add('Content-Length', str(file_size))
-    return resp
+    return [app_state.recordings_path / row["name"] for row in rows]
 
 
-def generate_file_chunks(file_path, byte1=0, byte2=None):
-    """Generator to stream file in chunks with range support."""
-    with open(file_path, 'rb') as f:
-        f.seek(byte1)
-        while True:
-            buffer_size = 8192
-            if byte2:
-                buffer_size = min(buffer_size, byte2 - f.tell() + 1)
-                if buffer_size <= 0:
-                    break
-            chunk = f.read(buffer_size)
-            if not chunk:
-                break
-            yield chunk
+def zip_response(paths, download_name):
+    """Stream a ZIP of ``paths`` as a chunked attachment."""
+    logger.info(f"Streaming {len(paths)} files as {download_name}")
+    return Response(
+        stream_zip(paths),
+        mimetype="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{download_name}"'},
+        direct_passthrough=True,
+    )
 
 
-@app.route("/download-all")
+@bp.route("/download-all")
 def download_all():
-    """Download all recordings as a zip file."""
-    memory_file = io.BytesIO()
-    with zipfile.ZipFile(memory_file, "w") as zf:
-        wav_files = [f for f in recordings_path.iterdir() if f.is_file() and f.suffix.lower() == ".wav"]
-
-        # Log the files being added to the zip
-        logger.info(f"Adding {len(wav_files)} files to zip")
-
-        for file_path in wav_files:
-            # Use absolute path for reading
-            abs_path = str(file_path.absolute())
-            logger.info(f"Adding file: {abs_path}")
-
-            # Verify file exists and is readable
-            if os.path.exists(abs_path) and os.access(abs_path, os.R_OK):
-                # Add to zip with just the filename as the internal path
-                zf.write(abs_path, arcname=file_path.name)
-            else:
-                logger.error(f"Cannot access file: {abs_path}")
-
-    memory_file.seek(0)
-
-    logger.info(f"Zip file size: {memory_file.getbuffer().nbytes} bytes")
-
-    return send_file(
-        memory_file,
-        mimetype="application/zip",
-        as_attachment=True,
-        download_name="recordings.zip",
-    )
+    """Download all recordings (optionally within from/to dates) as a zip file."""
+    try:
+        paths = selected_recordings(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return zip_response(paths, "recordings.zip")
 
 
-@app.route("/download-selected", methods=["POST"])
+@bp.route("/download-selected", methods=["POST"])
 def download_selected():
     """Download selected recordings as a zip file."""
-    selected_files = request.form.getlist("files[]")
-    logger.info(f"Selected files for download: {selected_files}")
-
-    memory_file = BytesIO()
-    with zipfile.ZipFile(memory_file, "w") as zf:
-        for filename in selected_files:
-            file_path = recordings_path / filename
-            if file_path.exists() and os.access(str(file_path), os.R_OK):
-                logger.info(f"Adding to zip: {file_path}")
-                zf.write(str(file_path), filename)
-            else:
-                logger.error(f"Cannot access file: {file_path}")
-
-    memory_file.seek(0)
-    logger.info(f"Zip file size: {memory_file.getbuffer().nbytes} bytes")
-
-    return send_file(
-        memory_file,
-        mimetype="application/zip",
-        download_name="selected_recordings.zip",
-        as_attachment=True,
-    )
+    try:
+        paths = selected_recordings(request.form)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return zip_response(paths, "selected_recordings.zip")
 
 
-@app.route("/rename/<old_filename>", methods=["POST"])
+@bp.route("/rename/<old_filename>", methods=["POST"])
 def rename_recording(old_filename):
     """Rename a recording."""
     new_filename = request.json["newFilename"]
-    old_path = recordings_path / old_filename
-    new_path = recordings_path / new_filename
+    app_state = state()
+    old_path = app_state.recordings_path / old_filename
+    new_path = app_state.recordings_path / new_filename
 
     if old_path.exists():
         os.rename(str(old_path), str(new_path))
+        app_state.peaks_cache.discard(old_filename)
+        app_state.renditions.discard(old_filename)
+        if is_recording_name(new_filename):
+            app_state.recordings_index.rename(old_filename, new_filename)
+        else:
+            app_state.recordings_index.remove(old_filename)
         return jsonify(success=True)
     else:
         return jsonify(success=False), 404
 
 
-@app.route("/reboot", methods=["POST"])
+@bp.route("/reboot", methods=["POST"])
 def reboot():
     """Reboot the system."""
     try:
@@ -353,7 +525,7 @@ def reboot():
         ), 500
 
 
-@app.route("/shutdown", methods=["POST"])
+@bp.route("/shutdown", methods=["POST"])
 def shutdown():
     """Shut down the system."""
     try:
@@ -366,8 +538,8 @@ def shutdown():
         ), 500
 
 
-def update_config(form_data):
-    """Update the YAML configuration with form data."""
+def update_config(config, form_data):
+    """Update the YAML configuration ``config`` with form data."""
     for key, value in form_data.items():
         # Skip CSRF token if it exists
         if key == 'csrf_token':
@@ -401,34 +573,98 @@ def update_config(form_data):
         except (ValueError, TypeError) as e:
             logger.error(f"Failed to update '{key}': {e}")
 
-@app.route("/api/system-status")
+@bp.route("/api/system-status")
 def system_status():
-    """Return basic system information for the dashboard."""
+    """Return the latest system metrics sample for the dashboard."""
+    sample = state().metrics.latest
+    if sample is None:
+        return jsonify({"success": False, "message": "No metrics sampled yet"}), 503
+    return jsonify({"success": True, **sample})
+
+
+@bp.route("/api/system-status/history")
+def system_status_history():
+    """Return the buffered metrics samples, oldest first, for charts.
+
+    ``?since=<ts>`` returns only samples taken after that Unix time, so a
+    chart can poll for new points.
+    """
     try:
-        import psutil
+        since = float(request.args["since"]) if "since" in request.args else None
+    except ValueError:
+        return jsonify({"success": False, "message": "Invalid since"}), 400
+    metrics = state().metrics
+    return jsonify({
+        "success": True,
+        "interval": metrics.interval,
+        "samples": metrics.history(since),
+    })
+
+@bp.route("/metrics")
+def prometheus_metrics():
+    """Per-call latency quantiles in Prometheus text format."""
+    return Response(
+        render_prometheus(state().call_traces.get()),
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+    )
 
-        cpu_usage = psutil.cpu_percent()
-        memory_usage = psutil.virtual_memory().percent
-        disk_usage = psutil.disk_usage("/").percent
-        recording_count = len([f for f in recordings_path.iterdir() if f.is_file()])
 
-        return jsonify(
-            {
-                "success": True,
-                "cpu": cpu_usage,
-                "memory": memory_usage,
-                "disk": disk_usage,
-                "recordings": recording_count,
-            }
-        )
-    except Exception as e:
-        logger.error(f"Error getting system status: {e}")
+@bp.route("/api/postprocess-status")
+def postprocess_status():
+    """Queue depth and recent job times of the daemon's post-processing.
+
+    The daemon writes cache_path/postprocess.json whenever a job is queued or
+    finishes.
+    """
+    app_state = state()
+    status = {"enabled": bool(app_state.config.get("postprocess", False))}
+    try:
+        with (app_state.cache_path / "postprocess.json").open("r") as f:
+            status.update(json.load(f))
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError) as e:
+        logger.error(f"Error reading post-processing status: {e}")
+        return jsonify({"success": False, "message": str(e)}), 500
+    return jsonify(status)
+
+@bp.route("/api/backup", methods=["GET"])
+def backup_status():
+    """Progress of the running (or last) backup to ``backup_path``.
+
+    The backup process writes cache_path/backup.json as it copies (see
+    backup.py); ``running`` says whether it is still going.
+    """
+    app_state = state()
+    try:
+        status = app_state.backup_runner.status()
+    except (OSError, ValueError) as e:
+        logger.error(f"Error reading backup status: {e}")
+        return jsonify({"success": False, "message": str(e)}), 500
+    status["enabled"] = bool(app_state.config.get("backup_path"))
+    return jsonify(status)
+
+
+@bp.route("/api/backup", methods=["POST"])
+def start_backup():
+    """Start backing up new and changed recordings to ``backup_path``."""
+    app_state = state()
+    if not app_state.config.get("backup_path"):
+        return jsonify({"success": False, "message": "No backup_path configured"}), 400
+    try:
+        app_state.backup_runner.start()
+    except BackupError as e:
+        return jsonify({"success": False, "message": str(e)}), 409
+    except OSError as e:
+        logger.error(f"Could not start the backup: {e}")
         return jsonify({"success": False, "message": str(e)}), 500
+    return jsonify({"success": True, "message": "Backup started"}), 202
 
-@app.route("/delete-recordings", methods=["POST"])
+@bp.route("/delete-recordings", methods=["POST"])
 def delete_recordings():
     """Delete multiple recordings in bulk."""
     try:
+        app_state = state()
         data = request.get_json()
         if not data or 'ids' not in data:
             return jsonify({"success": False, "message": "No recordings specified for deletion"}), 400
@@ -437,10 +673,13 @@ def delete_recordings():
         failed_files = []
 
         for filename in data['ids']:
-            file_path = recordings_path / filename
+            file_path = app_state.recordings_path / filename
             try:
                 if file_path.exists():
                     file_path.unlink()
+                    app_state.recordings_index.remove(filename)
+                    app_state.peaks_cache.discard(filename)
+                    app_state.renditions.discard(filename)
                     deleted_files.append(filename)
                     logger.info(f"Successfully deleted: {filename}")
                 else:
@@ -476,5 +715,4 @@ if __name__ == "__main__":
     # Print summary of configuration for debugging
     logger.info("=== Starting Audio Guestbook Server ===")
     logger.info(f"Static files location: {STATIC_DIR}")
-    logger.info(f"Recordings location: {recordings_path}")
     logger.info("=====================================")
@@ -1,9 +1,71 @@
-// In your recordings.js file
+// Recordings are fetched from /api/recordings one page at a time. The next
+// page is requested when the sentinel row below the table scrolls into view.
+const PAGE_SIZE = 50;
+let nextCursor = null;
+let loadingPage = false;
+let listGeneration = 0;
+
+// Searches return the best matches in one page (see /api/search)
+const SEARCH_LIMIT = 200;
+
+function searchText() {
+  return document.getElementById("search")?.value.trim() || "";
+}
+
+function recordingsQuery(cursor) {
+  const search = searchText();
+  if (search) {
+    const params = new URLSearchParams({ q: search, limit: SEARCH_LIMIT });
+    const line = document.getElementById("filter-line")?.value;
+    if (line) params.set("line", line);
+    return "/api/search?" + params.toString();
+  }
+  const params = new URLSearchParams({ limit: PAGE_SIZE });
+  const sortBy = document.getElementById("sort-by")?.value;
+  const dateFrom = document.getElementById("filter-from")?.value;
+  const dateTo = document.getElementById("filter-to")?.value;
+  const excludeEmpty = document.getElementById("exclude-empty")?.checked;
+  const line = document.getElementById("filter-line")?.value;
+
+  if (sortBy) {
+    const [sort, order] = sortBy.split(":");
+    params.set("sort", sort);
+    params.set("order", order);
+  }
+  if (dateFrom) params.set("from", dateFrom);
+  if (dateTo) params.set("to", dateTo);
+  if (excludeEmpty) params.set("exclude_empty", "1");
+  if (line) params.set("line", line);
+  if (cursor) params.set("cursor", cursor);
+  return "/api/recordings?" + params.toString();
+}
+
+// (Re)load the list from the first page
 function loadRecordings() {
   console.log("Starting to load recordings...");
+  listGeneration += 1;
+  nextCursor = null;
+  loadingPage = false;
+
+  const recordingList = document.getElementById("recording-list");
+  if (!recordingList) {
+    console.error("recording-list element not found in DOM");
+    return;
+  }
+  recordingList.innerHTML = "";
+  const selectAllCheckbox = document.getElementById("select-all");
+  if (selectAllCheckbox) selectAllCheckbox.checked = false;
+
+  loadNextPage(true);
+}
+
+function loadNextPage(firstPage = false) {
+  if (loadingPage || (!firstPage && !nextCursor)) return;
+  loadingPage = true;
+  const generation = listGeneration;
 
-  // Add a timestamp parameter to prevent caching
-  fetch("/api/recordings?t=" + new Date().getTime())
+  // The browser revalidates with If-None-Match, so an unchanged page costs a 304
+  fetch(recordingsQuery(firstPage ? null : nextCursor))
     .then((response) => {
       console.log("API response status:", response.status);
       if (!response.ok) {
@@ -11,18 +73,16 @@ function loadRecordings() {
       }
       return response.json();
     })
-    .then((files) => {
-      console.log("Files returned by API:", files);
+    .then((page) => {
+      // A newer loadRecordings() call has replaced this list
+      if (generation !== listGeneration) return;
 
-      const recordingList = document.getElementById("recording-list");
-      if (!recordingList) {
-        console.error("recording-list element not found in DOM");
-        return;
-      }
+      const files = page.recordings.map((recording) => recording.name);
+      nextCursor = page.next_cursor;
 
-      recordingList.innerHTML = "";
+      const recordingList = document.getElementById("recording-list");
 
-      if (!files || files.length === 0) {
+      if (firstPage && files.length === 0) {
         console.log("No files returned by API");
         // Display empty state message
         const emptyRow = document.createElement("tr");
@@ -30,8 +90,8 @@ function loadRecordings() {
           <td colspan="5" class="py-8 text-center">
             <div class="flex flex-col items-center">
               <i class="fas fa-microphone-slash text-4xl text-gray-300 dark:text-gray-600 mb-3"></i>
-              <p class="text-gray-500 dark:text-gray-400">No recordings yet.</p>
-              <p class="text-sm text-gray-400 dark:text-gray-500 mt-1">Recordings will appear here when created.</p>
+              <p class="text-gray-500 dark:text-gray-400">${searchText() ? "No recordings match your search." : "No recordings yet."}</p>
+              <p class="text-sm text-gray-400 dark:text-gray-500 mt-1">${searchText() ? "Only transcribed recordings can be found." : "Recordings will appear here when created."}</p>
             </div>
           </td>
         `;
@@ -46,56 +106,39 @@ function loadRecordings() {
         document.getElementById('delete-selected')?.classList.remove("hidden");
 
         // Add recording items
-        files.forEach((filename, index) => {
-          console.log(`Creating item ${index + 1}/${files.length}: ${filename}`);
+        const newItems = [];
+        page.recordings.forEach((recording) => {
+          const filename = recording.name;
           try {
             const item = createRecordingItem(filename);
+            if (recording.snippet !== undefined) addTranscriptMatch(item, recording);
             recordingList.appendChild(item);
+            newItems.push(item);
           } catch (err) {
             console.error(`Error creating item for ${filename}:`, err);
           }
         });
-      }
 
-      try {
-        console.log("Setting up event listeners");
-        setupEventListeners();
-      } catch (err) {
-        console.error("Error in setupEventListeners:", err);
-      }
+        try {
+          newItems.forEach(setupItemListeners);
+        } catch (err) {
+          console.error("Error in setupItemListeners:", err);
+        }
 
-      try {
-        // Initialize Plyr for all audio elements
-        console.log("Initializing audio players");
-        const audioElements = document.querySelectorAll('audio');
-        console.log(`Found ${audioElements.length} audio elements`);
-
-        const players = Array.from(audioElements).map(p => {
-          // Ensure audio elements are set up for proper loading
-          p.preload = "metadata";
-
-          // Create and configure the Plyr instance with simplified controls
-          // Remove the settings control from the options
-          return new Plyr(p, {
-            controls: ['play', 'progress', 'current-time', 'duration', 'mute', 'volume'],
-            displayDuration: true,
-            hideControls: false,
-            invertTime: false,
-            toggleInvert: false,
-            seekTime: 5,
-            tooltips: { controls: false, seek: false },
-            fullscreen: { enabled: false },
-            keyboard: { focused: true, global: false }
-          });
-        });
+        try {
+          initAudioPlayers(newItems);
+        } catch (err) {
+          console.error("Error initializing audio players:", err);
+        }
 
-        improveAudioDurationDetection();
-        console.log(`Initialized ${players.length} Plyr players`);
-      } catch (err) {
-        console.error("Error initializing audio players:", err);
+        observeWaveforms(newItems);
       }
+
+      loadingPage = false;
+      observeSentinel();
     })
     .catch((error) => {
+      loadingPage = false;
       console.error("Error loading recordings:", error);
 
       // Show error in UI if toast function exists
@@ -126,8 +169,111 @@ function loadRecordings() {
     });
 }
 
-function improveAudioDurationDetection() {
-  document.querySelectorAll('audio').forEach(audio => {
+let sentinelObserver = null;
+
+function observeSentinel() {
+  const sentinel = document.getElementById("recordings-sentinel");
+  if (!sentinel) return;
+  sentinel.classList.toggle("hidden", !nextCursor);
+
+  if (!sentinelObserver) {
+    sentinelObserver = new IntersectionObserver((entries) => {
+      if (entries.some((entry) => entry.isIntersecting)) loadNextPage();
+    }, { rootMargin: "200px" });
+    sentinelObserver.observe(sentinel);
+  } else if (nextCursor) {
+    // Re-arm: if the sentinel is still visible the observer will not fire
+    // again on its own
+    sentinelObserver.unobserve(sentinel);
+    sentinelObserver.observe(sentinel);
+  }
+}
+
+// Waveform previews come from /api/recordings/<file>/peaks, a few KB per
+// recording, and are only fetched once their row scrolls into view. The
+// bucket count is fixed so every client hits the same server-side cache.
+const WAVEFORM_BUCKETS = 200;
+let waveformObserver = null;
+
+function observeWaveforms(items) {
+  if (!waveformObserver) {
+    waveformObserver = new IntersectionObserver((entries) => {
+      entries.forEach((entry) => {
+        if (!entry.isIntersecting) return;
+        waveformObserver.unobserve(entry.target);
+        drawWaveform(entry.target);
+      });
+    }, { rootMargin: "200px" });
+  }
+  items.forEach((item) => {
+    const canvas = item.querySelector("canvas.waveform");
+    if (canvas) waveformObserver.observe(canvas);
+  });
+}
+
+function drawWaveform(canvas) {
+  const filename = canvas.dataset.filename;
+  fetch(`/api/recordings/${encodeURIComponent(filename)}/peaks?buckets=${WAVEFORM_BUCKETS}`)
+    .then((response) => (response.ok ? response.json() : null))
+    .then((peaks) => {
+      if (!peaks) {
+        canvas.classList.add("hidden");
+        return;
+      }
+      const scale = window.devicePixelRatio || 1;
+      canvas.width = canvas.clientWidth * scale;
+      canvas.height = canvas.clientHeight * scale;
+      const ctx = canvas.getContext("2d");
+      const barWidth = canvas.width / peaks.buckets;
+      const middle = canvas.height / 2;
+      const dark = document.documentElement.classList.contains("dark");
+
+      // Peak envelope, with the RMS level drawn solid over it
+      ctx.fillStyle = dark ? "rgba(129, 140, 248, 0.4)" : "rgba(79, 70, 229, 0.3)";
+      peaks.max.forEach((high, i) => {
+        const top = middle - high * middle;
+        ctx.fillRect(i * barWidth, top, Math.max(barWidth - 1, 1), (high - peaks.min[i]) * middle || 1);
+      });
+      ctx.fillStyle = dark ? "#818CF8" : "#4F46E5";
+      peaks.rms.forEach((level, i) => {
+        ctx.fillRect(i * barWidth, middle - level * middle, Math.max(barWidth - 1, 1), 2 * level * middle || 1);
+      });
+    })
+    .catch((error) => {
+      console.error(`Error loading waveform for ${filename}:`, error);
+    });
+}
+
+function initAudioPlayers(items) {
+  // Initialize Plyr for the audio elements of the given rows
+  const audioElements = items.flatMap((item) => Array.from(item.querySelectorAll('audio')));
+  console.log(`Found ${audioElements.length} audio elements`);
+
+  const players = audioElements.map(p => {
+    // Ensure audio elements are set up for proper loading
+    p.preload = "metadata";
+
+    // Create and configure the Plyr instance with simplified controls
+    // Remove the settings control from the options
+    return new Plyr(p, {
+      controls: ['play', 'progress', 'current-time', 'duration', 'mute', 'volume'],
+      displayDuration: true,
+      hideControls: false,
+      invertTime: false,
+      toggleInvert: false,
+      seekTime: 5,
+      tooltips: { controls: false, seek: false },
+      fullscreen: { enabled: false },
+      keyboard: { focused: true, global: false }
+    });
+  });
+
+  improveAudioDurationDetection(audioElements);
+  console.log(`Initialized ${players.length} Plyr players`);
+}
+
+function improveAudioDurationDetection(audioElements) {
+  audioElements.forEach(audio => {
     // For WAV files specifically
     if (audio.src.toLowerCase().endsWith('.wav')) {
       // Try to force metadata loading
@@ -159,6 +305,18 @@ function improveAudioDurationDetection() {
   });
 }
 
+// The player can stream a compressed rendition instead of the original
+// (playback_format in config.yaml); downloads always get the original.
+function playbackSource(filename) {
+  let format = document.getElementById("recording-list")?.dataset.playbackFormat;
+  if (!format || format === "original") return `/recordings/${filename}`;
+  // Older Safari cannot play Ogg Opus
+  if (format === "opus" && !document.createElement("audio").canPlayType('audio/ogg; codecs="opus"')) {
+    format = "mp3";
+  }
+  return `/recordings/${filename}?format=${format}`;
+}
+
 function createRecordingItem(filename) {
   const row = document.createElement("tr");
   row.className =
@@ -182,7 +340,8 @@ function createRecordingItem(filename) {
         </div>
       </td>
       <td class="p-2">
-        <audio class="audio-player" src="/recordings/${filename}"></audio>
+        <audio class="audio-player" src="${playbackSource(filename)}"></audio>
+        ${filename.toLowerCase().endsWith(".wav") ? `<canvas class="waveform block w-full h-6 mt-1" data-filename="${filename}"></canvas>` : ""}
       </td>
       <td class="p-2 recording-date text-sm text-gray-600 dark:text-gray-400">${formattedDate}</td>
       <td class="p-2">
@@ -196,21 +355,63 @@ function createRecordingItem(filename) {
   return row;
 }
 
+function escapeHtml(text) {
+  const div = document.createElement("div");
+  div.textContent = text;
+  return div.innerHTML;
+}
+
+function formatSeconds(seconds) {
+  return `${Math.floor(seconds / 60)}:${String(Math.floor(seconds % 60)).padStart(2, "0")}`;
+}
+
+// A search result shows the matching part of its transcript; the times the
+// words were said seek the player there
+function addTranscriptMatch(item, recording) {
+  const nameCell = item.querySelector(".recording-name").closest("td");
+  const snippet = document.createElement("p");
+  snippet.className = "text-sm text-gray-500 dark:text-gray-400 mt-1";
+  snippet.innerHTML = escapeHtml(recording.snippet)
+    .replace(/\x02/g, "<mark>")
+    .replace(/\x03/g, "</mark>");
+  recording.matches.forEach((match) => {
+    const link = document.createElement("a");
+    link.href = "#";
+    link.className = "text-xs mr-1";
+    link.textContent = formatSeconds(match.start);
+    link.title = `"${match.word}"`;
+    link.addEventListener("click", (e) => {
+      e.preventDefault();
+      e.stopPropagation();
+      const audio = item.querySelector("audio");
+      audio.currentTime = match.start;
+      audio.play();
+    });
+    snippet.appendChild(document.createTextNode(" "));
+    snippet.appendChild(link);
+  });
+  nameCell.appendChild(snippet);
+}
+
 function parseDateTime(filename) {
   const regex = /(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2})/;
   const match = filename.match(regex);
   return match ? match[1] : null;
 }
 
+// Page-level controls; bound once since rows come and go as pages load
 function setupEventListeners() {
   const selectAllCheckbox = document.getElementById("select-all");
   const downloadSelectedButton = document.getElementById("download-selected");
   const deleteSelectedButton = document.getElementById("delete-selected");
-  const recordingItems = document.querySelectorAll(".recording-item");
+
+  ["search", "sort-by", "filter-from", "filter-to", "filter-line", "exclude-empty"].forEach((id) => {
+    document.getElementById(id)?.addEventListener("change", loadRecordings);
+  });
 
   selectAllCheckbox.addEventListener("change", function () {
     const isChecked = this.checked;
-    recordingItems.forEach((item) => {
+    document.querySelectorAll(".recording-item").forEach((item) => {
       item.querySelector(".recording-checkbox").checked = isChecked;
       item.classList.toggle("selected", isChecked);
     });
@@ -231,13 +432,28 @@ function setupEventListeners() {
     form.method = "POST";
     form.action = "/download-selected";
 
-    selectedFiles.forEach((filename) => {
+    const addField = (name, value) => {
       const input = document.createElement("input");
       input.type = "hidden";
-      input.name = "files[]";
-      input.value = filename;
+      input.name = name;
+      input.value = value;
       form.appendChild(input);
-    });
+    };
+
+    if (selectAllCheckbox.checked && nextCursor) {
+      // Everything matching the filters is selected, including pages not
+      // loaded yet: let the server pick the files
+      addField("selector", "all");
+      const dateFrom = document.getElementById("filter-from")?.value;
+      const dateTo = document.getElementById("filter-to")?.value;
+      if (dateFrom) addField("from", dateFrom);
+      if (dateTo) addField("to", dateTo);
+      const line = document.getElementById("filter-line")?.value;
+      if (line) addField("line", line);
+      if (document.getElementById("exclude-empty")?.checked) addField("exclude_empty", "1");
+    } else {
+      selectedFiles.forEach((filename) => addField("files[]", filename));
+    }
 
     document.body.appendChild(form);
     form.submit();
@@ -292,87 +508,83 @@ function setupEventListeners() {
       });
     }
   });
+}
 
-  recordingItems.forEach((item) => {
-    item.addEventListener("click", function (e) {
-      if (e.target.type === "checkbox") return; // Don't toggle selection when clicking the checkbox
-      if (e.target.closest('.plyr')) return; // Don't toggle selection when clicking the player
-      if (e.target.closest('.delete-button')) return; // Don't toggle selection when clicking delete
-      if (e.target.classList.contains('recording-name')) return; // Don't toggle when clicking the name
-
-      const checkbox = this.querySelector(".recording-checkbox");
-      checkbox.checked = !checkbox.checked;
-      this.classList.toggle("selected", checkbox.checked);
-      updateSelectAllCheckbox();
-    });
+// Per-row listeners, bound as each page of rows is added
+function setupItemListeners(item) {
+  item.addEventListener("click", function (e) {
+    if (e.target.type === "checkbox") return; // Don't toggle selection when clicking the checkbox
+    if (e.target.closest('.plyr')) return; // Don't toggle selection when clicking the player
+    if (e.target.closest('.delete-button')) return; // Don't toggle selection when clicking delete
+    if (e.target.classList.contains('recording-name')) return; // Don't toggle when clicking the name
+
+    const checkbox = this.querySelector(".recording-checkbox");
+    checkbox.checked = !checkbox.checked;
+    this.classList.toggle("selected", checkbox.checked);
+    updateSelectAllCheckbox();
+  });
 
-    const checkbox = item.querySelector(".recording-checkbox");
-    checkbox.addEventListener("change", function () {
-      item.classList.toggle("selected", this.checked);
-      updateSelectAllCheckbox();
-    });
+  const checkbox = item.querySelector(".recording-checkbox");
+  checkbox.addEventListener("change", function () {
+    item.classList.toggle("selected", this.checked);
+    updateSelectAllCheckbox();
   });
 
   // Detect mobile devices to activate swipe only on mobile
   if (isMobileDevice()) {
-    recordingItems.forEach((item) => {
-      const hammer = new Hammer(item);
-      hammer.on("swipeleft", function () {
-        // Animate swipe left
-        item.style.transition = "transform 0.3s ease-out";
-        item.style.transform = "translateX(-100%)";
-        setTimeout(() => {
-          if (
-            confirm(`Are you sure you want to delete ${item.dataset.filename}?`)
-          ) {
-            fetch(`/delete/${item.dataset.filename}`, { method: "POST" }).then(
-              () => loadRecordings(),
-            );
-          } else {
-            // Reset position if canceled
-            item.style.transform = "translateX(0)";
-          }
-        }, 300); // Wait for animation to finish
-      });
+    const hammer = new Hammer(item);
+    hammer.on("swipeleft", function () {
+      // Animate swipe left
+      item.style.transition = "transform 0.3s ease-out";
+      item.style.transform = "translateX(-100%)";
+      setTimeout(() => {
+        if (
+          confirm(`Are you sure you want to delete ${item.dataset.filename}?`)
+        ) {
+          fetch(`/delete/${item.dataset.filename}`, { method: "POST" }).then(
+            () => loadRecordings(),
+          );
+        } else {
+          // Reset position if canceled
+          item.style.transform = "translateX(0)";
+        }
+      }, 300); // Wait for animation to finish
     });
   }
 
   // Handle click-to-delete for desktop users
-  document.querySelectorAll(".delete-button").forEach((button) => {
-    button.addEventListener("click", function (e) {
-      e.stopPropagation(); // Prevent row click event
-      const item = button.closest(".recording-item");
-      if (
-        confirm(`Are you sure you want to delete ${item.dataset.filename}?`)
-      ) {
-        fetch(`/delete/${item.dataset.filename}`, { method: "POST" }).then(() =>
-          loadRecordings(),
-        );
-      }
-    });
+  const button = item.querySelector(".delete-button");
+  button.addEventListener("click", function (e) {
+    e.stopPropagation(); // Prevent row click event
+    if (
+      confirm(`Are you sure you want to delete ${item.dataset.filename}?`)
+    ) {
+      fetch(`/delete/${item.dataset.filename}`, { method: "POST" }).then(() =>
+        loadRecordings(),
+      );
+    }
   });
 
   // Handle renaming the recording when the title is edited
-  document.querySelectorAll(".recording-name").forEach((span) => {
-    span.addEventListener("blur", function () {
-      const newFilename = span.innerText.trim();
-      const oldFilename = span.closest(".recording-item").dataset.filename;
-      if (newFilename !== oldFilename) {
-        // Send a request to rename the file
-        fetch(`/rename/${oldFilename}`, {
-          method: "POST",
-          headers: { "Content-Type": "application/json" },
-          body: JSON.stringify({ newFilename }),
+  const span = item.querySelector(".recording-name");
+  span.addEventListener("blur", function () {
+    const newFilename = span.innerText.trim();
+    const oldFilename = item.dataset.filename;
+    if (newFilename !== oldFilename) {
+      // Send a request to rename the file
+      fetch(`/rename/${oldFilename}`, {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({ newFilename }),
+      })
+        .then(() => {
+          loadRecordings();
         })
-          .then(() => {
-            loadRecordings();
-          })
-          .catch((err) => {
-            console.error("Rename error:", err);
-            alert("Failed to rename the file.");
-          });
-      }
-    });
+        .catch((err) => {
+          console.error("Rename error:", err);
+          alert("Failed to rename the file.");
+        });
+    }
   });
 }
 
@@ -385,11 +597,173 @@ function updateSelectAllCheckbox() {
   selectAllCheckbox.checked = allChecked;
 }
 
+// Live daemon state over server-sent events (/api/events): the status line
+// follows the phone, and finished recordings appear without a reload
+function describeLineState(state) {
+  if (!state.connected) return ["Guestbook service not running", "text-red-800"];
+  if (state.recording) return ["Recording a message...", "text-red-800"];
+  if (state.playing) return ["Playing " + state.playing.replace("_", " ") + "...", "text-gray-500"];
+  if (state.off_hook) return ["Handset lifted", "text-gray-500"];
+  return ["Waiting for a call", "text-green-700"];
+}
+
+// With several phone lines the status line shows each of them
+function describePhoneState(state) {
+  const lines = Object.entries(state.lines || {});
+  if (!state.connected || lines.length === 0) return describeLineState(state);
+  const text = lines
+    .map(([name, line]) => `${name}: ${describeLineState({ connected: true, ...line })[0]}`)
+    .join(" · ");
+  return [text, describeLineState(state)[1]];
+}
+
+function connectEvents() {
+  if (!window.EventSource) return;
+  const lineState = {};
+  const status = document.getElementById("line-status");
+  const icon = document.getElementById("line-status-icon");
+
+  const render = () => {
+    if (!status || !icon) return;
+    const [text, color] = describePhoneState(lineState);
+    status.textContent = text;
+    icon.className = `fas fa-circle mr-1 ${color}`;
+  };
+
+  const source = new EventSource("/api/events");
+  const update = (e) => {
+    const data = JSON.parse(e.data);
+    ["connected", "off_hook", "playing", "recording", "lines"].forEach((key) => {
+      if (key in data) lineState[key] = data[key];
+    });
+    render();
+  };
+  ["state", "daemon", "hook", "playback_started", "playback_finished",
+   "recording_started", "recording_stopped"].forEach((name) => source.addEventListener(name, update));
+  source.addEventListener("file_created", (e) => {
+    const data = JSON.parse(e.data);
+    const lineFilter = document.getElementById("filter-line");
+    if (data.line && lineFilter && !lineFilter.querySelector(`option[value="${CSS.escape(data.line)}"]`)) {
+      loadLines();
+    }
+    addNewRecording(data.name);
+  });
+}
+
+// The line filter is only shown once recordings from named lines exist
+function loadLines() {
+  const select = document.getElementById("filter-line");
+  if (!select) return;
+  fetch("/api/lines")
+    .then((response) => response.json())
+    .then((data) => {
+      const selected = select.value;
+      select.querySelectorAll("option:not([value=''])").forEach((option) => option.remove());
+      data.lines.forEach((line) => {
+        const option = document.createElement("option");
+        option.value = line;
+        option.textContent = line;
+        select.appendChild(option);
+      });
+      select.value = data.lines.includes(selected) ? selected : "";
+      const hidden = data.lines.length === 0;
+      select.classList.toggle("hidden", hidden);
+      document.querySelector("label[for='filter-line']")?.classList.toggle("hidden", hidden);
+    })
+    .catch((error) => console.error("Error loading lines:", error));
+}
+
+function addNewRecording(filename) {
+  // Only the default view (newest first, unfiltered) can take a new row at
+  // the top without reordering anything
+  const filtered = ["search", "filter-from", "filter-to", "filter-line"].some((id) => document.getElementById(id)?.value);
+  const sortBy = document.getElementById("sort-by")?.value;
+  if (filtered || (sortBy && sortBy !== "date:desc")) return;
+
+  const recordingList = document.getElementById("recording-list");
+  if (!recordingList || recordingList.querySelector(`[data-filename="${CSS.escape(filename)}"]`)) return;
+  if (!recordingList.querySelector(".recording-item")) {
+    // Replace the empty state
+    loadRecordings();
+    return;
+  }
+  const item = createRecordingItem(filename);
+  recordingList.prepend(item);
+  setupItemListeners(item);
+  initAudioPlayers([item]);
+  observeWaveforms([item]);
+}
+
+// Backup to USB (/api/backup): the copy runs on the server, the page polls
+// its progress while it goes on
+const BACKUP_POLL_MS = 1000;
+// Another server worker may answer a poll before the new run has started
+const BACKUP_START_GRACE_MS = 5000;
+let backupRequestedAt = 0;
+
+function formatMegabytes(bytes) {
+  return (bytes / 1e6).toFixed(1) + " MB";
+}
+
+function describeBackup(status) {
+  if (status.state === "running") {
+    const percent = status.bytes_total ? Math.floor((100 * status.bytes_done) / status.bytes_total) : 100;
+    const rate = status.bytes_per_second ? `, ${formatMegabytes(status.bytes_per_second)}/s` : "";
+    return `Backing up: ${status.files_done}/${status.files_total} recordings, ` +
+      `${formatMegabytes(status.bytes_done)} of ${formatMegabytes(status.bytes_total)} (${percent}%${rate})`;
+  }
+  const when = status.finished_at ? moment.unix(status.finished_at).fromNow() : "";
+  if (status.state === "done") {
+    return `Last backup ${when}: ${status.copied} copied, ${status.skipped} already on the drive`;
+  }
+  if (status.state === "failed") {
+    return `Last backup ${when} failed: ${status.message || "see the log"}`;
+  }
+  return "";
+}
+
+function pollBackup() {
+  const button = document.getElementById("backup-start");
+  const line = document.getElementById("backup-status");
+  if (!button || !line) return;
+  fetch("/api/backup")
+    .then((response) => response.json())
+    .then((status) => {
+      const text = describeBackup(status);
+      line.textContent = text;
+      line.classList.toggle("hidden", !text);
+      button.disabled = status.running;
+      if (status.running || Date.now() - backupRequestedAt < BACKUP_START_GRACE_MS) {
+        setTimeout(pollBackup, BACKUP_POLL_MS);
+      }
+    })
+    .catch((error) => console.error("Error reading backup status:", error));
+}
+
+function startBackup() {
+  fetch("/api/backup", { method: "POST" })
+    .then((response) => response.json())
+    .then((data) => {
+      if (data.success) {
+        backupRequestedAt = Date.now();
+      } else if (typeof showToast === "function") {
+        showToast("Backup not started: " + data.message, "error");
+      }
+      pollBackup();
+    })
+    .catch((error) => console.error("Error starting backup:", error));
+}
+
 function isMobileDevice() {
   return /Mobi|Android/i.test(navigator.userAgent);
 }
 
 // Initialize recordings on page load
 document.addEventListener("DOMContentLoaded", function () {
+  setupEventListeners();
   loadRecordings();
+  loadLines();
+  connectEvents();
+  document.getElementById("backup-start")?.addEventListener("click", startBackup);
+  pollBackup();
 });
\ No newline at end of file
@@ -0,0 +1,222 @@
+"""Detection of empty takes: guests who lifted the handset and hung up.
+
+:func:`analyze_take` measures a recording with vectorized NumPy, a block at
+a time (WAV memory-mapped, FLAC and Opus decoded as they are read): the
+overall RMS level and, from short-time FFTs, the energy in the speech band
+(300-3400 Hz) of every ~32 ms frame. Frames whose
+speech-band level is above ``empty_take_db`` count as speech. A take with
+less than ``empty_take_min_speech`` seconds of speech is empty.
+
+The measurements are stored in the recordings index (see
+:meth:`RecordingsIndex.set_analysis`), so listings and ZIP downloads can
+leave empty takes out with a plain query.
+
+Run as a module to classify every recording not analyzed yet, on all cores::
+
+    python -m webserver.take_analysis [--workers N] [--force]
+
+The web server starts the same command with one worker, at low priority, when
+new recordings appear (see :class:`AnalysisRunner`).
+"""
+
+import argparse
+import logging
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from webserver.peaks import PeaksUnavailable
+from webserver.transcode import MonoReader
+
+logger = logging.getLogger(__name__)
+
+# Telephone speech band
+SPEECH_BAND = (300.0, 3400.0)
+
+# Analysis frame length, rounded up to a power of two
+FRAME_SECONDS = 0.032
+
+# Frames analyzed per FFT batch; bounds memory for long recordings
+BATCH_FRAMES = 256
+
+# Results written to the index per transaction in batch mode
+WRITE_BATCH = 64
+
+
+def analyze_take(path, threshold_db=-45.0):
+    """Measure the recording at ``path``.
+
+    Returns ``rms_db`` (whole take), ``speech_db`` (95th percentile
+    speech-band frame level) and ``speech_seconds`` (time with speech-band
+    level above ``threshold_db``). Levels are dBFS, ``None`` for digital
+    silence.
+    """
+    with MonoReader(path) as reader:
+        rate = reader.rate
+        n = 1 << max(0, int(np.ceil(np.log2(max(1, rate * FRAME_SECONDS)))))
+        window = np.hanning(n).astype(np.float32)
+        # Scale so a band's summed |X|^2 becomes the mean square of that band
+        scale = 2.0 / (n * np.sum(np.square(window)))
+        freqs = np.fft.rfftfreq(n, 1.0 / rate) if rate else np.zeros(n // 2 + 1)
+        band = (freqs >= SPEECH_BAND[0]) & (freqs <= SPEECH_BAND[1])
+
+        total_square = 0.0
+        total_samples = 0
+        band_levels = []
+        while len(mono := reader.read(n * BATCH_FRAMES)):
+            total_square += float(np.dot(mono, mono))
+            total_samples += len(mono)
+            whole = len(mono) // n
+            if whole == 0:
+                continue
+            spectrum = np.fft.rfft(mono[:whole * n].reshape(whole, n) * window, axis=1)
+            power = np.square(spectrum.real) + np.square(spectrum.imag)
+            band_levels.append(power[:, band].sum(axis=1) * scale)
+
+    def db(mean_square):
+        return round(float(10 * np.log10(mean_square)), 1) if mean_square > 0 else None
+
+    levels = np.concatenate(band_levels) if band_levels else np.zeros(0)
+    speech = levels > 10 ** (threshold_db / 10)
+    return {
+        "rms_db": db(total_square / total_samples) if total_samples else None,
+        "speech_db": db(np.percentile(levels, 95)) if len(levels) else None,
+        "speech_seconds": round(float(speech.sum()) * n / rate, 2) if rate else 0.0,
+    }
+
+
+def _analyze(job):
+    """Pool entry point: (name, size, mtime, path, threshold) -> result."""
+    name, size, mtime, path, threshold_db = job
+    try:
+        result = analyze_take(path, threshold_db)
+    except (OSError, ValueError) as e:
+        # Not audio (PeaksUnavailable) or unreadable: recorded as analyzed
+        # with no measurements, so it is not retried on every run
+        if not isinstance(e, PeaksUnavailable):
+            logger.warning(f"Could not analyze {name}: {e}")
+        result = {"rms_db": None, "speech_db": None, "speech_seconds": None}
+    return name, size, mtime, result
+
+
+def analyze_pending(index, threshold_db=-45.0, min_speech=0.5, workers=None, force=False):
+    """Analyze every recording in ``index`` without measurements.
+
+    Results are written back in batches as they come in. Returns the number
+    of recordings analyzed and how many of them are empty takes.
+    """
+    index.sync()
+    pending = index.pending_analysis(force=force)
+    if not pending:
+        return 0, 0
+    jobs = [
+        (row["name"], row["size"], row["mtime"], str(index.recordings_path / row["name"]), threshold_db)
+        for row in pending
+    ]
+    analyzed = empty = 0
+    batch = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for job_result in pool.map(_analyze, jobs, chunksize=8):
+            batch.append(job_result)
+            speech = job_result[3]["speech_seconds"]
+            empty += speech is not None and speech < min_speech
+            if len(batch) == WRITE_BATCH:
+                index.set_analysis(batch)
+                analyzed += len(batch)
+                batch = []
+    if batch:
+        index.set_analysis(batch)
+        analyzed += len(batch)
+    return analyzed, empty
+
+
+class AnalysisRunner:
+    """Runs the batch command in the background for newly indexed takes.
+
+    At most one run at a time; it is a separate process, so the web server's
+    event loop never does the number crunching. None is started while a
+    call is in progress, and a run that fails is not started again until
+    the recordings change.
+    """
+
+    def __init__(self, config_path, cwd):
+        self.config_path = Path(config_path)
+        self.cwd = Path(cwd)
+        self._proc = None
+        self._started_generation = None
+        self._failed_generation = None
+
+    def kick(self, index, call_active=None):
+        """Start a run if there is work and none is in progress."""
+        if self._proc is not None:
+            if self._proc.poll() is None:
+                return
+            if self._proc.returncode != 0:
+                logger.warning(
+                    f"Empty-take analysis exited with status {self._proc.returncode}; "
+                    "not retried until the recordings change"
+                )
+                self._failed_generation = self._started_generation
+            self._proc = None
+        if call_active:
+            return
+        generation = index.generation
+        if generation == self._failed_generation:
+            return
+        if not index.pending_analysis(limit=1):
+            return
+        self._started_generation = generation
+        env = dict(os.environ, AGB_CONFIG_PATH=str(self.config_path))
+        self._proc = subprocess.Popen(
+            ["nice", "-n", "10", sys.executable, "-m", "webserver.take_analysis", "--workers", "1"],
+            cwd=str(self.cwd), env=env,
+        )
+
+
+def main():
+    from ruamel.yaml import YAML
+
+    from webserver.recordings_index import RecordingsIndex
+
+    parser = argparse.ArgumentParser(description="Classify recordings as empty takes or not.")
+    parser.add_argument("--config", help="config.yaml (default: AGB_CONFIG_PATH or ./config.yaml)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="processes to use (default: all cores)")
+    parser.add_argument("--force", action="store_true", help="re-analyze every recording")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    base_dir = Path(__file__).parent.parent
+    config_path = Path(args.config or os.environ.get("AGB_CONFIG_PATH", base_dir / "config.yaml"))
+    with config_path.open("r") as f:
+        config = YAML(typ="safe").load(f)
+
+    def resolve(key, default):
+        path = Path(config.get(key, default))
+        return path if path.is_absolute() else base_dir / path
+
+    index = RecordingsIndex(resolve("cache_path", "cache") / "recordings.sqlite3",
+                            resolve("recordings_path", "recordings"))
+    started = time.monotonic()
+    analyzed, empty = analyze_pending(
+        index,
+        float(config.get("empty_take_db", -45)),
+        float(config.get("empty_take_min_speech", 0.5)),
+        args.workers,
+        args.force,
+    )
+    elapsed = time.monotonic() - started
+    if analyzed:
+        logger.info(
+            f"Analyzed {analyzed} recordings in {elapsed:.1f}s "
+            f"({analyzed / elapsed:.1f}/s, {args.workers} workers), {empty} empty takes"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+"""Compressed renditions of recordings for playback over slow links.
+
+A WAV recording at CD quality is 1.4 Mbit/s, about 10.6 MB per minute, which
+is slow to stream over the Pi's hotspot. :class:`RenditionCache` encodes an Opus or MP3
+copy the first time one is asked for and keeps it on disk under
+``cache_path/renditions``.
+
+* Rendition file names include the size and mtime of the recording they were
+  made from, so a changed recording never serves a stale rendition.
+* The cache has a byte budget. Serving a rendition marks it used (its atime
+  is set explicitly, so ``noatime`` mounts are fine and the mtime that
+  validators are derived from is untouched), and the least recently used
+  renditions are removed when a new one pushes the total over budget.
+* Concurrent requests for the same rendition wait for a single encode.
+
+Encoding uses ``opusenc`` and ``lame`` at low CPU priority. Non-WAV
+recordings are decoded with ``flac``/``opusdec`` and piped in.
+
+:class:`MonoReader` reads any recording as mono float samples, a block at a
+time, for the analyses that measure or transcribe it.
+"""
+
+import glob
+import logging
+import os
+import struct
+import subprocess
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+from webserver.peaks import WAVE_FORMAT_EXTENSIBLE, PeaksUnavailable, sample_format, wav_frames
+
+logger = logging.getLogger(__name__)
+
+# format name -> (suffix, mimetype, encoder command taking input and output)
+FORMATS = {
+    "opus": (".opus", "audio/ogg", lambda src, dst: [
+        "opusenc", "--quiet", "--bitrate", "48", src, dst,
+    ]),
+    "mp3": (".mp3", "audio/mpeg", lambda src, dst: [
+        "lame", "--quiet", "-V", "6", src, dst,
+    ]),
+}
+
+# Decoders writing WAV to stdout for recordings the encoders cannot read
+DECODERS = {
+    ".flac": lambda src: ["flac", "--decode", "--stdout", "--silent", src],
+    ".opus": lambda src: ["opusdec", "--quiet", src, "-"],
+}
+
+# Encoding competes with the guestbook daemon for CPU
+NICE = ["nice", "-n", "10"]
+
+ENCODE_TIMEOUT = 600
+
+
+class TranscodeError(RuntimeError):
+    """A rendition could not be produced."""
+
+
+class MonoReader:
+    """Mono float32 samples of a recording, read a block at a time.
+
+    WAV files are memory-mapped; FLAC and Opus recordings are decoded with
+    DECODERS as they are read, so memory use does not depend on the length
+    of the recording. Raises PeaksUnavailable for a file it cannot read,
+    ValueError for one that does not decode and OSError if the decoder
+    cannot be run.
+    """
+
+    def __init__(self, path):
+        path = Path(path)
+        self.name = path.name
+        self._proc = None
+        suffix = path.suffix.lower()
+        if suffix == ".wav":
+            self._frames, self._to_float, self.rate = wav_frames(path, path.stat().st_size)
+            self._position = 0
+            return
+        if suffix not in DECODERS:
+            raise PeaksUnavailable(f"Cannot decode {path.name}")
+        self._proc = subprocess.Popen(
+            DECODERS[suffix](str(path)), stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+        )
+        try:
+            self._read_header()
+        except BaseException:
+            self.close()
+            raise
+
+    def _read_header(self):
+        # The decoders write a streamed WAV header: its sizes may be zero or
+        # a placeholder, so samples are read until end of output instead
+        stream = self._proc.stdout
+        head = stream.read(12)
+        if head[:4] != b"RIFF" or head[8:12] != b"WAVE":
+            raise ValueError(f"Could not decode {self.name}")
+        fmt = None
+        while True:
+            header = stream.read(8)
+            if len(header) < 8:
+                raise ValueError(f"No audio data decoded from {self.name}")
+            chunk_id, chunk_size = struct.unpack("<4sI", header)
+            if chunk_id == b"data":
+                break
+            body = stream.read(chunk_size + (chunk_size & 1))
+            if chunk_id == b"fmt ":
+                fmt = body
+        if fmt is None or len(fmt) < 16:
+            raise ValueError(f"No audio format decoded from {self.name}")
+        tag, channels, self.rate, _, _, bits = struct.unpack("<HHIIHH", fmt[:16])
+        if tag == WAVE_FORMAT_EXTENSIBLE and len(fmt) >= 26:
+            tag = struct.unpack("<H", fmt[24:26])[0]
+        if channels < 1:
+            raise ValueError(f"No channels decoded from {self.name}")
+        self._dtype, self._to_float, values = sample_format(tag, bits, self.name)
+        self._width = channels * values
+        self._frame_bytes = (bits + 7) // 8 * channels
+
+    def read(self, frames):
+        """The next ``frames`` samples or fewer; empty at the end."""
+        if self._proc is None:
+            block = self._frames[self._position:self._position + frames]
+            self._position += len(block)
+            samples = self._to_float(np.asarray(block))
+        else:
+            data = self._proc.stdout.read(frames * self._frame_bytes)
+            data = data[:len(data) - len(data) % self._frame_bytes]
+            block = np.frombuffer(data, dtype=self._dtype).reshape(-1, self._width)
+            samples = self._to_float(block)
+        return samples.mean(axis=1) if len(samples) else np.zeros(0, dtype=np.float32)
+
+    def close(self):
+        if self._proc is not None:
+            self._proc.kill()
+            self._proc.stdout.close()
+            self._proc.wait()
+            self._proc = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class _Pending:
+    def __init__(self):
+        self.done = threading.Event()
+        self.error = None
+
+
+class RenditionCache:
+    """Size-bounded LRU disk cache of encoded recordings.
+
+    Waiting on a concurrent encode is per process, which covers the single
+    gunicorn worker the web server runs with (greenlets share it).
+    """
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._pending = {}
+
+    def _path(self, name, st, fmt):
+        suffix = FORMATS[fmt][0]
+        return self.cache_dir / f"{name}.{st.st_size:x}-{st.st_mtime_ns:x}{suffix}"
+
+    def get(self, source, fmt):
+        """Return the path of the ``fmt`` rendition of ``source``, encoding it
+        if it is not cached yet."""
+        source = Path(source)
+        st = source.stat()
+        path = self._path(source.name, st, fmt)
+        with self._lock:
+            if self._touch(path):
+                return path
+            pending = self._pending.get(path)
+            owner = pending is None
+            if owner:
+                pending = self._pending[path] = _Pending()
+
+        if not owner:
+            pending.done.wait()
+            if pending.error is not None:
+                raise pending.error
+            return path
+
+        try:
+            started = time.monotonic()
+            self._encode(source, path, fmt)
+            logger.info(
+                f"Encoded {path.name} ({path.stat().st_size} bytes) "
+                f"in {time.monotonic() - started:.2f}s"
+            )
+            self._evict(keep=path)
+        except Exception as e:
+            pending.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._pending[path]
+            pending.done.set()
+        return path
+
+    def _touch(self, path):
+        """Mark ``path`` as just used; False if it is not cached."""
+        try:
+            st = path.stat()
+            os.utime(path, ns=(time.time_ns(), st.st_mtime_ns))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def _encode(self, source, path, fmt):
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        os.close(fd)
+        encode = FORMATS[fmt][2]
+        decode = DECODERS.get(source.suffix.lower())
+        decoder = None
+        try:
+            if decode is None:
+                encoder = subprocess.Popen(
+                    NICE + encode(str(source), tmp), stderr=subprocess.PIPE
+                )
+            else:
+                decoder = subprocess.Popen(
+                    NICE + decode(str(source)), stdout=subprocess.PIPE,
+                    stderr=subprocess.DEVNULL,
+                )
+                encoder = subprocess.Popen(
+                    NICE + encode("-", tmp), stdin=decoder.stdout, stderr=subprocess.PIPE
+                )
+                decoder.stdout.close()
+            _, stderr = encoder.communicate(timeout=ENCODE_TIMEOUT)
+            if decoder is not None and decoder.wait(timeout=ENCODE_TIMEOUT) != 0:
+                raise TranscodeError(f"Could not decode {source.name}")
+            if encoder.returncode != 0:
+                raise TranscodeError(
+                    f"Encoding {source.name} to {fmt} failed: {stderr.decode(errors='replace').strip()}"
+                )
+            os.replace(tmp, path)
+        except subprocess.TimeoutExpired:
+            encoder.kill()
+            encoder.wait()
+            if decoder is not None:
+                decoder.kill()
+                decoder.wait()
+            raise TranscodeError(f"Encoding {source.name} to {fmt} timed out")
+        finally:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+
+    def _evict(self, keep):
+        """Remove least recently used renditions until within budget."""
+        entries = []
+        total = 0
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if entry.name.endswith(".tmp") or not entry.is_file():
+                    continue
+                st = entry.stat()
+                entries.append((st.st_atime_ns, st.st_size, entry.path))
+                total += st.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if path == str(keep):
+                continue
+            try:
+                os.unlink(path)
+                total -= size
+                logger.info(f"Evicted rendition {os.path.basename(path)}")
+            except OSError as e:
+                logger.warning(f"Could not evict {path}: {e}")
+
+    def discard(self, name):
+        """Remove every rendition of recording ``name``."""
+        for path in self.cache_dir.glob(f"{glob.escape(name)}.*"):
+            try:
+                path.unlink()
+            except OSError as e:
+                logger.warning(f"Could not remove {path}: {e}")
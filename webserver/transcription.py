@@ -0,0 +1,289 @@
+"""Offline speech-to-text of the recordings, for searching what guests said.
+
+Recordings are transcribed with Vosk (https://alphacephei.com/vosk), an
+offline, CPU-only recognizer, using the model folder named by
+``transcribe_model`` (e.g. ``vosk-model-small-en-us-0.15``, about 50 MB of
+RAM). Vosk is an optional dependency: without it (``pip install vosk``) or
+without ``transcribe: true`` nothing is transcribed and search is empty.
+
+Each transcript is stored in the recordings index with the time of every
+word (see :meth:`RecordingsIndex.set_transcript`), where an FTS5 index
+makes it searchable; ``/api/search`` returns the matching recordings with
+the times the words were said. A transcript is redone only when its
+recording changes, so each run only transcribes new recordings.
+
+Run as a module to transcribe every recording without a transcript::
+
+    python -m webserver.transcription [--limit N] [--force]
+
+The web server starts the same command in the background when new
+recordings appear and no call is in progress (see
+:class:`TranscriptionRunner`). It runs in the idle scheduling class, so it
+only gets CPU time the guestbook service leaves unused, and reports its
+throughput as a real-time factor: processing time over audio time.
+"""
+
+import argparse
+import importlib.util
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+from webserver.peaks import PeaksUnavailable
+from webserver.recordings_index import SEARCH_TERM_RE
+from webserver.transcode import MonoReader
+
+logger = logging.getLogger(__name__)
+
+# Audio handed to the recognizer per call
+CHUNK_SECONDS = 1.0
+
+# Times of matched words returned per search result
+MAX_MATCHES = 20
+
+
+class TranscriptionUnavailable(RuntimeError):
+    """Vosk or its model is missing."""
+
+
+def _to_pcm16(mono):
+    return (np.clip(mono, -1.0, 32767 / 32768) * 32768).astype("<i2").tobytes()
+
+
+def read_mono_pcm(path):
+    """(sample_rate, iterator of mono S16_LE chunks) for a recording.
+
+    Read with the same :class:`MonoReader` the empty-take analysis uses.
+    Raises ValueError for audio that cannot be read.
+    """
+    reader = MonoReader(path)
+
+    def chunks():
+        with reader:
+            while len(mono := reader.read(max(1, int(reader.rate * CHUNK_SECONDS)))):
+                yield _to_pcm16(mono)
+
+    return reader.rate, chunks()
+
+
+class VoskTranscriber:
+    """Speech-to-text with a Vosk model loaded once per run."""
+
+    def __init__(self, model_path):
+        try:
+            import vosk
+        except ImportError as e:
+            raise TranscriptionUnavailable("Vosk is not installed (pip install vosk)") from e
+        if not Path(model_path).is_dir():
+            raise TranscriptionUnavailable(f"Vosk model not found: {model_path}")
+        vosk.SetLogLevel(-1)
+        self._vosk = vosk
+        self.model = vosk.Model(str(model_path))
+
+    def transcribe(self, path):
+        """``text``, ``words`` ([word, start, end]) and ``audio_seconds`` of a recording."""
+        rate, chunks = read_mono_pcm(path)
+        recognizer = self._vosk.KaldiRecognizer(self.model, rate)
+        recognizer.SetWords(True)
+        results = []
+        audio_bytes = 0
+        for chunk in chunks:
+            audio_bytes += len(chunk)
+            if recognizer.AcceptWaveform(chunk):
+                results.append(json.loads(recognizer.Result()))
+        results.append(json.loads(recognizer.FinalResult()))
+        words = [
+            [word["word"], round(word["start"], 2), round(word["end"], 2)]
+            for result in results for word in result.get("result", [])
+        ]
+        return {
+            "text": " ".join(result["text"] for result in results if result.get("text")),
+            "words": words,
+            "audio_seconds": round(audio_bytes / 2 / rate, 2) if rate else 0.0,
+        }
+
+
+def transcribe_pending(index, transcriber, limit=None, force=False):
+    """Transcribe recordings without an up-to-date transcript, newest first.
+
+    New recordings that arrive meanwhile are picked up before returning.
+    Returns (recordings transcribed, audio seconds, processing seconds).
+    """
+    done = 0
+    audio_seconds = processing_seconds = 0.0
+    seen = set()
+    while limit is None or done < limit:
+        index.sync()
+        pending = [
+            row for row in index.pending_transcription(force=force) if row["name"] not in seen
+        ]
+        if not pending:
+            break
+        for row in pending[:None if limit is None else limit - done]:
+            name = row["name"]
+            seen.add(name)
+            started = time.monotonic()
+            result = {"text": "", "words": [], "audio_seconds": None, "error": None}
+            path = index.recordings_path / name
+            try:
+                result.update(transcriber.transcribe(path))
+            except (OSError, ValueError) as e:
+                if not path.exists():
+                    continue  # deleted since the query
+                # Recorded as done with no text, so it is not retried on every run
+                if not isinstance(e, PeaksUnavailable):
+                    logger.warning(f"Could not transcribe {name}: {e}")
+                result["error"] = str(e)
+            result["seconds"] = round(time.monotonic() - started, 2)
+            index.set_transcript(name, row["size"], row["mtime"], result)
+            done += 1
+            if result["audio_seconds"]:
+                audio_seconds += result["audio_seconds"]
+                processing_seconds += result["seconds"]
+                logger.info(
+                    f"Transcribed {name}: {result['audio_seconds']:.1f}s of audio in "
+                    f"{result['seconds']:.1f}s (RTF {result['seconds'] / result['audio_seconds']:.2f})"
+                )
+    index.prune_transcripts()
+    return done, audio_seconds, processing_seconds
+
+
+def match_times(words, text, limit=MAX_MATCHES):
+    """``[{"word", "start", "end"}]`` for the words of a transcript that match a search."""
+    terms = [term.lower() for term in SEARCH_TERM_RE.findall(text)]
+    matches = []
+    for word, start, end in words:
+        lowered = word.lower()
+        if any(lowered.startswith(term[:-1]) if term.endswith("*") else lowered == term for term in terms):
+            matches.append({"word": word, "start": start, "end": end})
+            if len(matches) == limit:
+                break
+    return matches
+
+
+def _lower_priority():
+    # Only run when the CPU would otherwise be idle: a call in progress
+    # always comes first
+    try:
+        os.sched_setscheduler(0, os.SCHED_IDLE, os.sched_param(0))
+    except (AttributeError, OSError):
+        os.nice(19)
+
+
+class TranscriptionRunner:
+    """Runs the transcription command in the background for new recordings.
+
+    At most one run at a time, and none is started while a call is in
+    progress; the run itself transcribes everything pending, including
+    recordings made while it goes on. A run that fails is not started
+    again until the recordings change.
+    """
+
+    def __init__(self, config_path, cwd):
+        self.config_path = Path(config_path)
+        self.cwd = Path(cwd)
+        self._proc = None
+        self._checked_generation = None
+        self._started_generation = None
+        self._failed_generation = None
+        self._warned = None
+        self._available = importlib.util.find_spec("vosk") is not None
+
+    def _unavailable(self, config):
+        """Why a run would fail straight away, or None."""
+        if not self._available:
+            return "Vosk is not installed (pip install vosk)"
+        model = Path(config.get("transcribe_model", "models/vosk"))
+        if not model.is_absolute():
+            model = self.cwd / model
+        if not model.is_dir():
+            return f"the Vosk model folder {model} does not exist"
+        return None
+
+    def kick(self, index, config, call_active=None):
+        """Start a run if transcription is enabled, there is work and none is in progress."""
+        if not config.get("transcribe", False) or not index.has_transcripts:
+            return
+        problem = self._unavailable(config)
+        if problem and problem != self._warned:
+            logger.warning(f"transcribe is on but {problem}")
+        self._warned = problem
+        if problem:
+            return
+        if self._proc is not None:
+            if self._proc.poll() is None:
+                return
+            if self._proc.returncode != 0:
+                logger.warning(
+                    f"Transcription exited with status {self._proc.returncode}; "
+                    "not retried until the recordings change"
+                )
+                self._failed_generation = self._started_generation
+            self._proc = None
+        if call_active:
+            return
+        generation = index.generation
+        if generation in (self._checked_generation, self._failed_generation):
+            return
+        if not index.pending_transcription(limit=1):
+            self._checked_generation = generation
+            return
+        self._checked_generation = None
+        self._started_generation = generation
+        env = dict(os.environ, AGB_CONFIG_PATH=str(self.config_path))
+        self._proc = subprocess.Popen(
+            ["ionice", "-c", "3", sys.executable, "-m", "webserver.transcription"],
+            cwd=str(self.cwd), env=env,
+        )
+
+
+def main():
+    from ruamel.yaml import YAML
+
+    from webserver.recordings_index import RecordingsIndex
+
+    parser = argparse.ArgumentParser(description="Transcribe recordings for search.")
+    parser.add_argument("--config", help="config.yaml (default: AGB_CONFIG_PATH or ./config.yaml)")
+    parser.add_argument("--model", help="Vosk model folder (default: transcribe_model from the config)")
+    parser.add_argument("--limit", type=int, help="transcribe at most this many recordings")
+    parser.add_argument("--force", action="store_true", help="transcribe every recording again")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    _lower_priority()
+    base_dir = Path(__file__).parent.parent
+    config_path = Path(args.config or os.environ.get("AGB_CONFIG_PATH", base_dir / "config.yaml"))
+    with config_path.open("r") as f:
+        config = YAML(typ="safe").load(f)
+
+    def resolve(key, default):
+        path = Path(config.get(key, default))
+        return path if path.is_absolute() else base_dir / path
+
+    index = RecordingsIndex(resolve("cache_path", "cache") / "recordings.sqlite3",
+                            resolve("recordings_path", "recordings"))
+    if not index.has_transcripts:
+        logger.error("This SQLite has no FTS5; transcripts cannot be indexed")
+        return 1
+    try:
+        transcriber = VoskTranscriber(args.model or resolve("transcribe_model", "models/vosk"))
+    except TranscriptionUnavailable as e:
+        logger.error(str(e))
+        return 1
+    transcribed, audio_seconds, seconds = transcribe_pending(index, transcriber, args.limit, args.force)
+    if audio_seconds:
+        logger.info(
+            f"Transcribed {transcribed} recordings, {audio_seconds / 60:.1f} min of audio in "
+            f"{seconds / 60:.1f} min (real-time factor {seconds / audio_seconds:.2f})"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
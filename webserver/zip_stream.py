@@ -0,0 +1,91 @@
+"""Streaming ZIP archives for the download routes.
+
+:func:`stream_zip` yields an archive piece by piece while reading the source
+files, so memory use is bounded by the chunk size rather than the size of the
+recordings, and the browser receives the first bytes immediately.
+
+It drives the standard library's ``zipfile`` over an unseekable sink, which
+makes ``zipfile`` write sizes and CRCs in data descriptors after each member
+instead of seeking back into the local headers. ZIP64 records are added
+automatically for members or archives over 4 GiB.
+"""
+
+import logging
+import os
+import zipfile
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+# Already-compressed audio gains nothing from DEFLATE, so it is STORED
+STORED_SUFFIXES = (".flac", ".opus", ".ogg", ".mp3")
+
+
+class _ChunkSink:
+    """Write-only, unseekable file object that collects output for yielding."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _set_compress_level(zinfo, level):
+    # Public as ZipInfo.compress_level from Python 3.13, private before
+    if hasattr(type(zinfo), "compress_level"):
+        zinfo.compress_level = level
+    else:
+        zinfo._compresslevel = level
+
+
+def stream_zip(paths, chunk_size=CHUNK_SIZE):
+    """Yield a ZIP archive of ``paths`` (stored under their file names).
+
+    WAV files are deflated at a low level (cheap on a Pi, still worthwhile
+    for PCM); compressed formats are stored. Unreadable files are logged and
+    skipped.
+    """
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, "w", allowZip64=True) as zf:
+        for path in paths:
+            try:
+                zinfo = zipfile.ZipInfo.from_file(path, arcname=os.path.basename(path))
+                src = open(path, "rb")
+            except OSError as e:
+                logger.error(f"Cannot access file: {path}: {e}")
+                continue
+            if str(path).lower().endswith(STORED_SUFFIXES):
+                zinfo.compress_type = zipfile.ZIP_STORED
+            else:
+                zinfo.compress_type = zipfile.ZIP_DEFLATED
+                _set_compress_level(zinfo, 1)
+            with src, zf.open(zinfo, "w") as dst:
+                while True:
+                    chunk = src.read(chunk_size)
+                    if not chunk:
+                        break
+                    dst.write(chunk)
+                    data = sink.drain()
+                    if data:
+                        yield data
+            data = sink.drain()
+            if data:
+                yield data
+    # Central directory (and ZIP64 end records if needed)
+    yield sink.drain()